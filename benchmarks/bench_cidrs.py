@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for IP._remove_overlaping_cidrs on synthetic whois networks.
+
+Compares the sort based sweep against the previous pairwise implementation,
+which is only run up to --pairwise-max networks as it is quadratic.
+
+    python benchmarks/bench_cidrs.py [-n 10000] [--pairwise-max 2000]
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+import ipaddress as ipa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.ip import IP
+
+
+def remove_overlaping_cidrs_pairwise(cidrs):
+    """Previous implementation, kept here as a reference"""
+    cidrs = set(cidrs)
+    iter_cidrs = [i for i in cidrs]
+    for a, b in itertools.combinations(iter_cidrs, 2):
+        if a.overlaps(b):
+            to_be_removed = b if a.num_addresses >= b.num_addresses else a
+            cidrs.discard(to_be_removed)
+    return cidrs
+
+
+def synthetic_cidrs(n, seed=0):
+    """n random networks between /8 and /28, many of them nested in each other"""
+    rand = random.Random(seed)
+    cidrs = []
+    while len(cidrs) < n:
+        prefixlen = rand.randint(8, 28)
+        address = rand.randint(1, 2 ** 32 - 1)
+        parent = ipa.ip_network((address >> (32 - prefixlen) << (32 - prefixlen), prefixlen))
+        cidrs.append(parent)
+        # Nested networks, like whois nets returned by RIRs
+        for _ in range(rand.randint(0, 3)):
+            if len(cidrs) < n:
+                sub_prefixlen = rand.randint(prefixlen + 1, 30)
+                cidrs.append(rand.choice(list(itertools.islice(parent.subnets(new_prefix=sub_prefixlen), 64))))
+    return cidrs
+
+
+def timed(func, cidrs, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func(cidrs)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=10000, help='number of networks (default is 10000)')
+    parser.add_argument('--pairwise-max', type=int, default=2000, help='largest input for the pairwise implementation')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    sizes = sorted(set([n for n in (100, 1000, args.pairwise_max) if n < args.n] + [args.n]))
+
+    print '{:>8} {:>12} {:>12} {:>8}'.format('networks', 'sorted (s)', 'pairwise (s)', 'kept')
+    for n in sizes:
+        cidrs = synthetic_cidrs(n)
+        sorted_time, kept = timed(IP._remove_overlaping_cidrs, cidrs, args.repeat)
+
+        pairwise = 'skipped'
+        if n <= args.pairwise_max:
+            pairwise_time, pairwise_kept = timed(remove_overlaping_cidrs_pairwise, cidrs, 1)
+            pairwise = '{:.4f}'.format(pairwise_time)
+            assert kept == pairwise_kept, 'Implementations disagree'
+
+        for a, b in zip(sorted(kept), sorted(kept)[1:]):
+            assert not a.overlaps(b)
+
+        print '{:>8} {:>12.4f} {:>12} {:>8}'.format(n, sorted_time, pairwise, len(kept))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Memory and set insertion throughput of IP-type Hosts, with __slots__ and
+precomputed hashes, against the previous dict-backed Host and IP, which are
+kept here as a reference.
+
+Each variant runs in its own process, which builds n Hosts, adds them to a set
+twice (the second time every add is a duplicate, so it's all hashing and
+equality) and reports its peak RSS growth measured with resource.getrusage.
+
+    python benchmarks/bench_host_slots.py [-n 1000000]
+"""
+import argparse
+import gc
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import ipaddress as ipa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.host import Host
+
+
+class LegacyIP(object):
+    """Previous implementation of IP, without lookups"""
+
+    def __init__(self, ip, rev_domains=()):
+        ipa.ip_address(unicode(ip))
+        self.ip = str(ip)
+        self.rev_domains = rev_domains
+        self.whois_ip = {}
+        self.cidrs = set()
+        self.shodan = None
+
+    def __str__(self):
+        return str(self.ip)
+
+    def __hash__(self):
+        return hash(('ip', self.ip))
+
+    def __eq__(self, other):
+        return self.ip == other.ip
+
+
+class LegacyHost(object):
+    """Previous implementation of Host for ip-type hosts, without lookups"""
+
+    def __init__(self, ips=(), reverse_domains=()):
+        self.domain = None
+        self.type = 'ip'
+        self.ips = [LegacyIP(str(ip), reverse_domains) for ip in ips]
+        self.mx = set()
+        self.ns = set()
+        self.whois_domain = None
+        self.linkedin_page = None
+        self.urls = {}
+        self.related_hosts = set()
+        self.subdomains = set()
+        self.google_subdomains = set()
+        self.cidrs = set()
+
+    def __hash__(self):
+        return hash(('ip', ','.join([str(ip) for ip in self.ips])))
+
+    def __eq__(self, other):
+        return self.ips == other.ips
+
+
+implementations = {
+    'legacy': LegacyHost,
+    'slots': Host,
+}
+
+
+def measure(implementation, n):
+    """Runs in the child process. Prints peak RSS growth in KB, and seconds taken to build and insert."""
+    cls = implementations[implementation]
+    ips = ['10.{}.{}.{}'.format(i >> 16 & 255, i >> 8 & 255, i & 255) for i in xrange(n)]
+
+    gc.collect()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.time()
+    hosts = [cls(ips=[ip], reverse_domains=['host.example.com']) for ip in ips]
+    built = time.time() - start
+
+    gc.collect()
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.time()
+    found = set()
+    for _ in range(2):
+        for host in hosts:
+            found.add(host)
+    inserted = time.time() - start
+    assert len(found) == n
+
+    print after - before, built, inserted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=1000000, help='number of hosts (default is 1000000)')
+    parser.add_argument('--implementation', choices=sorted(implementations), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.implementation:
+        measure(args.implementation, args.n)
+        sys.exit()
+
+    print '{:>8} {:>8} {:>12} {:>12} {:>10} {:>14}'.format(
+        'hosts', 'class', 'memory (MB)', 'bytes/host', 'build (s)', 'set adds/s')
+    for implementation in sorted(implementations):
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), '--implementation', implementation, '-n', str(args.n)])
+        kilobytes, built, inserted = output.split()
+        kilobytes = int(kilobytes)
+        print '{:>8} {:>8} {:>12.1f} {:>12.0f} {:>10.2f} {:>14.0f}'.format(
+            args.n, implementation, kilobytes / 1024.0, kilobytes * 1024.0 / args.n,
+            float(built), 2 * args.n / float(inserted))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Startup time of InstaRecon, i.e. what every run pays before scanning anything.
+
+Python 2 has no -X importtime, so each scenario is timed in a fresh interpreter
+(best of --repeat), and with --modules the slowest imports of the lazy scenario
+are listed, timed by wrapping __import__.
+
+Scenarios:
+    lookup   -- import src.lookup, with providers loaded lazily
+    eager    -- import src.lookup and every provider, as lookup.py used to
+    cli      -- scripts/instarecon.py --help
+
+    python benchmarks/bench_import.py [--repeat 10] [--modules]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+scenarios = [
+    ('lookup', ['-c', 'import src.lookup']),
+    ('eager', ['-c', 'import src.lookup, ipwhois, pythonwhois, requests, shodan']),
+    ('cli', [os.path.join(root, 'scripts', 'instarecon.py'), '--help']),
+]
+
+# Wraps __import__ to time each import made by src.lookup itself, including everything it imports in turn
+import_timer = '''
+import __builtin__, sys, time
+original_import = __builtin__.__import__
+depth = [0]
+times = {}
+def timed_import(name, *args, **kwargs):
+    depth[0] += 1
+    start = time.time()
+    try:
+        return original_import(name, *args, **kwargs)
+    finally:
+        depth[0] -= 1
+        if depth[0] == 1:
+            times[name] = times.get(name, 0) + time.time() - start
+__builtin__.__import__ = timed_import
+import src.lookup
+for name, elapsed in sorted(times.items(), key=lambda x: -x[1])[:15]:
+    print '{:>30} {:>10.1f}'.format(name, elapsed * 1000)
+'''
+
+
+def run(args):
+    env = dict(os.environ, PYTHONPATH=root)
+    start = time.time()
+    subprocess.check_call([sys.executable] + args, cwd=root, env=env, stdout=open(os.devnull, 'w'))
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--modules', action='store_true', help='list the slowest imports of src.lookup')
+    args = parser.parse_args()
+
+    baseline = min(run(['-c', 'pass']) for _ in range(args.repeat))
+    print '{:>8} {:>10} {:>14}'.format('scenario', 'best (ms)', 'imports (ms)')
+    print '{:>8} {:>10.1f} {:>14}'.format('python', baseline * 1000, '-')
+    for name, scenario in scenarios:
+        best = min(run(scenario) for _ in range(args.repeat))
+        print '{:>8} {:>10.1f} {:>14.1f}'.format(name, best * 1000, (best - baseline) * 1000)
+
+    if args.modules:
+        print ''
+        print '{:>30} {:>10}'.format('import in src.lookup', 'ms')
+        sys.stdout.flush()
+        subprocess.check_call([sys.executable, '-c', import_timer], cwd=root, env=dict(os.environ, PYTHONPATH=root))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""
+Offline benchmark suite. Starts the local stand-ins in tests/stubs.py (a DNS
+server with configurable latency and loss, a whois server, and an HTTP server
+replaying Google and Shodan fixtures), points lookup and ipwhois at them, and
+measures:
+
+    rev_dns_on_cidr      -- reverse DNS sweep of --cidr
+    host_lookup_dns      -- Host(domain).lookup_dns() on --hosts domains
+    lookup_whois_ip_all  -- Host.lookup_whois_ip_all() on --hosts hosts, 2 IPs each
+    scan_targets         -- InstaRecon.populate() and scan_targets() on --targets domains and one /24
+
+Results are printed as a table and saved as JSON with -o, so runs of different
+versions can be compared with --compare.
+
+    python benchmarks/bench_suite.py [-o results.json] [--compare previous.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import ipaddress as ipa
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'scripts'))
+
+import dns.rdatatype
+
+from instarecon import InstaRecon
+from src._version import __version__
+from src.host import Host, host_registry
+from src.ip import whois_index
+import src.cache as cache
+import src.lookup as lookup
+import src.whois_client as whois_client
+from tests.stubs import GoogleStub, ShodanStub, StubDNSServer, StubHTTPServer, StubWhoisServer, synthetic_records
+
+
+def bench_records(qname, rdtype):
+    """synthetic_records, but A records are public addresses (spread over 256 /24s), so they get whois and Shodan lookups"""
+    if rdtype == dns.rdatatype.A and not qname.to_text().startswith('nx'):
+        h = hash(qname.to_text().lower()) & 0xffff
+        return ['93.184.{}.{}'.format(h >> 8, h & 255 or 1)]
+    return synthetic_records(qname, rdtype)
+
+
+class StubEnvironment(object):
+    """
+    Context manager that starts every stub server and points lookup (and ipwhois, which
+    has its servers built in) at them. Everything is restored on exit.
+
+    Keyword arguments:
+    dns_latency -- Float seconds each DNS response is delayed by
+    dns_loss -- Float probability of dropping each DNS query. Only applied to sweeps.
+    whois_latency -- Float seconds each whois response is delayed by
+    """
+
+    def __init__(self, dns_latency=0.002, dns_loss=0.01, whois_latency=0.01):
+        self.dns_latency = dns_latency
+        self.dns_loss = dns_loss
+        self.whois_latency = whois_latency
+
+    def __enter__(self):
+        import ipwhois.net
+
+        self.dns = StubDNSServer(records=bench_records, latency=self.dns_latency)
+        self.whois = StubWhoisServer(latency=self.whois_latency)
+
+        google = GoogleStub(['http://sub{}.example.com/page{}'.format(i % 25, i) for i in range(100)])
+        shodan = ShodanStub(['93.184.{}.{}'.format(i, j) for i in range(0, 256, 8) for j in range(1, 255, 16)])
+        self.http = StubHTTPServer(lambda path, params: google(path, params) if path == '/search' else shodan(path, params))
+
+        self.saved = {
+            'nameservers': lookup.dns_resolver.nameservers,
+            'port': lookup.dns_resolver.port,
+            'domain_whois': lookup.domain_whois,
+            'google_search_url': lookup.google_search_url,
+            'google_pacer': lookup.google_pacer,
+            'shodan_key': lookup.shodan_key,
+            'net_init': ipwhois.net.Net.__init__,
+            'get_whois': ipwhois.net.Net.get_whois,
+        }
+
+        lookup.dns_resolver.nameservers = ['127.0.0.1']
+        lookup.dns_resolver.port = self.dns.port
+        lookup.domain_whois = whois_client.WhoisClient(server_interval=0, port=self.whois.port, iana_server='127.0.0.1')
+        lookup.google_search_url = self.http.url + '/search'
+        lookup.google_pacer = lookup.Pacer(delay=0, min_delay=0, max_delay=0)
+        lookup.shodan_key = 'benchmark'
+        self.configure_http()
+
+        # ipwhois asks Team Cymru for the ASN over DNS, and then the RIR over whois
+        net_init, get_whois, dns_port, whois_port = self.saved['net_init'], self.saved['get_whois'], self.dns.port, self.whois.port
+
+        def stub_net_init(net, *args, **kwargs):
+            net_init(net, *args, **kwargs)
+            net.dns_resolver.nameservers = ['127.0.0.1']
+            net.dns_resolver.port = dns_port
+
+        def stub_get_whois(net, asn_registry='arin', retry_count=3, server=None, port=43, extra_blacklist=None):
+            return get_whois(net, asn_registry, retry_count, '127.0.0.1', whois_port, extra_blacklist)
+
+        ipwhois.net.Net.__init__ = stub_net_init
+        ipwhois.net.Net.get_whois = stub_get_whois
+        return self
+
+    def __exit__(self, *exc_info):
+        import ipwhois.net
+
+        lookup.dns_resolver.nameservers = self.saved['nameservers']
+        lookup.dns_resolver.port = self.saved['port']
+        lookup.domain_whois = self.saved['domain_whois']
+        lookup.google_search_url = self.saved['google_search_url']
+        lookup.google_pacer = self.saved['google_pacer']
+        lookup.shodan_key = self.saved['shodan_key']
+        lookup.configure_http()
+        ipwhois.net.Net.__init__ = self.saved['net_init']
+        ipwhois.net.Net.get_whois = self.saved['get_whois']
+
+        for server in (self.dns, self.whois, self.http):
+            server.close()
+
+    def configure_http(self, pool_size=None):
+        """Same as lookup.configure_http, keeping the Shodan client pointed at the stub"""
+        lookup.configure_http(pool_size)
+        lookup.shodan_client().base_url = self.http.url
+
+    def reset(self):
+        """Forgets what previous runs learned, so every run does the same lookups"""
+        whois_index.clear()
+        host_registry.clear()
+        lookup.domain_whois = whois_client.WhoisClient(server_interval=0, port=self.whois.port, iana_server='127.0.0.1')
+        self.dns.loss = 0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def result(count, elapsed, latencies=None):
+    ret = {
+        'count': count,
+        'seconds': round(elapsed, 4),
+        'per_second': round(count / elapsed, 1) if elapsed else None,
+    }
+    if latencies:
+        ret['latency_ms'] = dict(
+            [('p' + str(p), round(percentile(latencies, p) * 1000, 2)) for p in (50, 95, 99)] +
+            [('max', round(max(latencies) * 1000, 2))]
+        )
+    return ret
+
+
+def bench_rev_dns_on_cidr(env, args):
+    env.dns.loss = args.dns_loss
+    cidr = ipa.ip_network(unicode(args.cidr))
+    start = time.time()
+    found = sum(1 for _ in lookup.rev_dns_on_cidr(cidr, args.sweep_workers))
+    elapsed = time.time() - start
+    assert found == cidr.num_addresses, 'Only ' + str(found) + ' of ' + str(cidr.num_addresses) + ' addresses resolved'
+    return result(found, elapsed)
+
+
+def bench_host_lookup_dns(env, args):
+    latencies = []
+    start = time.time()
+    for i in range(args.hosts):
+        host_start = time.time()
+        Host('host{}.bench.example.com'.format(i)).lookup_dns()
+        latencies.append(time.time() - host_start)
+    return result(args.hosts, time.time() - start, latencies)
+
+
+def bench_lookup_whois_ip_all(env, args):
+    hosts = [Host(ips=['93.184.{}.{}'.format(i % 256, 1 + i // 256), '93.184.{}.{}'.format((i * 7 + 3) % 256, 2)])
+             for i in range(args.hosts)]
+    latencies = []
+    start = time.time()
+    for host in hosts:
+        host_start = time.time()
+        host.lookup_whois_ip_all()
+        latencies.append(time.time() - host_start)
+    return result(args.hosts, time.time() - start, latencies)
+
+
+def bench_scan_targets(env, args):
+    scan = InstaRecon(workers=args.workers, sweep_workers=args.sweep_workers)
+    env.configure_http(lookup.http_pool_size)
+    targets = ['site{}.example.com'.format(i) for i in range(args.targets)] + ['93.184.216.0/24']
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        scan.populate(targets)
+        scan.scan_targets()
+        elapsed = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return result(len(scan.targets), elapsed)
+
+
+benchmarks = [
+    ('rev_dns_on_cidr', bench_rev_dns_on_cidr),
+    ('host_lookup_dns', bench_host_lookup_dns),
+    ('lookup_whois_ip_all', bench_lookup_whois_ip_all),
+    ('scan_targets', bench_scan_targets),
+]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, previous=None):
+    print '{:>20} {:>8} {:>10} {:>12} {:>10} {:>10} {:>10}'.format(
+        'benchmark', 'count', 'seconds', 'per second', 'p50 (ms)', 'p95 (ms)', 'vs prev')
+    for name, _ in benchmarks:
+        if name not in results:
+            continue
+        r = results[name]
+        latency = r.get('latency_ms', {})
+        change = ''
+        if previous and name in previous and previous[name].get('per_second'):
+            change = '{:+.1f}%'.format((r['per_second'] / previous[name]['per_second'] - 1) * 100)
+        print '{:>20} {:>8} {:>10.3f} {:>12.1f} {:>10} {:>10} {:>10}'.format(
+            name, r['count'], r['seconds'], r['per_second'], latency.get('p50', '-'), latency.get('p95', '-'), change)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', help='save results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare throughput with')
+    parser.add_argument('--only', action='append', choices=[name for name, _ in benchmarks], help='run only this benchmark (can be repeated)')
+    parser.add_argument('--cidr', default='93.184.0.0/22', help='network swept by rev_dns_on_cidr (default is a /22)')
+    parser.add_argument('--hosts', type=int, default=200, help='hosts for host_lookup_dns and lookup_whois_ip_all')
+    parser.add_argument('--targets', type=int, default=20, help='domain targets for scan_targets')
+    parser.add_argument('--workers', type=int, default=4, help='InstaRecon workers for scan_targets')
+    parser.add_argument('--sweep-workers', type=int, default=lookup.rev_dns_workers)
+    parser.add_argument('--dns-latency', type=float, default=0.002, help='seconds each DNS response is delayed by')
+    parser.add_argument('--dns-loss', type=float, default=0.01, help='probability of dropping each DNS query in sweeps')
+    parser.add_argument('--whois-latency', type=float, default=0.01, help='seconds each whois response is delayed by')
+    args = parser.parse_args()
+
+    # Lookups that fail on purpose (e.g. IPs Shodan has nothing on) would flood the output
+    logging.disable(logging.ERROR)
+    cache.disable()
+    results = {}
+    with StubEnvironment(args.dns_latency, args.dns_loss, args.whois_latency) as env:
+        for name, benchmark in benchmarks:
+            if args.only and name not in args.only:
+                continue
+            env.reset()
+            results[name] = benchmark(env, args)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'version': __version__,
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'settings': vars(args),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+        print 'Results saved to ' + args.output
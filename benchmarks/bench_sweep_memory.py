@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Memory used by the results of a reverse DNS sweep, kept as a set of Hosts
+(as Network.related_hosts used to) or in a SweepResults.
+
+Each variant runs in its own process and reports how much its peak RSS grew
+while storing n synthetic results. tracemalloc isn't available on Python 2,
+so this is measured with resource.getrusage.
+
+    python benchmarks/bench_sweep_memory.py [-n 65536]
+"""
+import argparse
+import gc
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.host import Host
+from src.sweep import SweepResults
+
+
+def sweep_results(n):
+    """n (ip, reverse_domains) as rev_dns_on_cidr would yield them for a /16"""
+    for i in xrange(n):
+        ip = '10.{}.{}.{}'.format(i >> 16 & 255, i >> 8 & 255, i & 255)
+        yield ip, ['host-' + ip.replace('.', '-') + '.example.com']
+
+
+def store_hosts(n):
+    hosts = set()
+    for ip, reverse_domains in sweep_results(n):
+        hosts.add(Host(ips=[ip], reverse_domains=reverse_domains))
+    return hosts
+
+
+def store_sweep(n):
+    results = SweepResults()
+    for ip, reverse_domains in sweep_results(n):
+        results.add(ip, reverse_domains)
+    return results
+
+
+stores = {
+    'hosts': store_hosts,
+    'sweep': store_sweep,
+}
+
+
+def measure(store, n):
+    """Runs in the child process. Prints peak RSS growth in KB and seconds taken."""
+    gc.collect()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    results = stores[store](n)
+    elapsed = time.time() - start
+    gc.collect()
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert len(results) == n
+    print after - before, elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=65536, help='number of hosts found by the sweep (default is a full /16)')
+    parser.add_argument('--store', choices=sorted(stores), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.store:
+        measure(args.store, args.n)
+        sys.exit()
+
+    print '{:>8} {:>8} {:>12} {:>12} {:>10}'.format('store', 'hosts', 'memory (MB)', 'bytes/host', 'time (s)')
+    for store in sorted(stores):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--store', store, '-n', str(args.n)])
+        kilobytes, elapsed = output.split()
+        kilobytes = int(kilobytes)
+        print '{:>8} {:>8} {:>12.1f} {:>12.0f} {:>10.2f}'.format(
+            store, args.n, kilobytes / 1024.0, kilobytes * 1024.0 / args.n, float(elapsed))
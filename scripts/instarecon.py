@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 import argparse
-import csv
+import itertools
 import logging
 import os
 import sys
@@ -9,9 +9,17 @@ import ipaddress as ipa # https://docs.python.org/3/library/ipaddress.html
 import dns.resolver
 
 from src.ip import IP
-from src.host import Host
+from src.host import Host, host_registry
 from src.network import Network
+from src import cache
+from src import checkpoint
+from src import ingest
 from src import lookup
+from src import metrics
+from src import output
+from src import pool
+from src import profiling
+from src import resolver_pool
 from src._version import __version__
 
 class InstaRecon(object):
@@ -19,23 +27,57 @@ class InstaRecon(object):
     Holds all Host entries and manages scans, interpret user input, threads and outputs.
 
     Keyword arguments:
-    nameserver -- Str DNS server to be used for lookups (consumed by dns.resolver module).
+    nameserver -- List of str DNS servers lookups are spread across. Each is a comma separated list
+        of ip or ip:port, or the path of a file with one per line. A single str works too.
+    dns_hedge -- Float seconds after which a bulk DNS query is also sent to a second nameserver, or None.
     targets -- Set of Hosts or Networks that will be scanned.
+    pending -- Generator of targets read by populate, each yielded as soon as it's ready to scan, or None.
     bad_targets -- Set of user inputs that could not be understood or resolved.
     versobe -- Bool flag for verbose output printing. Passed to logs.
     shodan_key -- Str key used for Shodan lookups. Passed to lookups.
+    sweep_workers -- Int number of reverse DNS queries kept in flight when scanning a Network.
+    workers -- Int number of targets scanned concurrently.
+    csv_writer -- output.CsvWriter that each target is written to as soon as it is scanned.
+    jsonl_writer -- output.JsonLinesWriter that records of each target, and each network sweep hit, are written to as soon as they're found.
+    cache_path -- Str path of the SQLite lookup cache. Lookups aren't cached if None.
+    cache_max_age -- Int maximum age in seconds of any cached lookup. Passed to cache.
+    cache_max_size -- Int size in bytes that the lookup cache is kept under. Passed to cache.
+    profiler -- profiling.PhaseProfiler that times each phase of each scan (and profiles it with profile_stats), or None if not profiling.
+    checkpoint_path -- Str path of the checkpoint journal, or None not to keep one.
+    resume -- Bool, resume the scan recorded in checkpoint_path instead of starting a new journal.
+    journal -- checkpoint.Journal that finished targets and sweep blocks are recorded in, or None.
+    resumed -- Set of targets restored from the journal of a previous run, which aren't scanned again.
     """
     entry_banner = '# InstaRecon v' + __version__ + ' - by Luis Teixeira (teix.co)'
     exit_banner = '# Done'
 
-    def __init__(self, nameserver=None, timeout=None,
-                shodan_key=None, verbose=0):
+    def __init__(self, nameserver=None, timeout=None, dns_hedge=None,
+                shodan_key=None, verbose=0, sweep_workers=None, workers=1,
+                cache_path=None, cache_max_age=None, cache_max_size=None,
+                profile=False, profile_stats=False, checkpoint_path=None, resume=False):
 
         self.targets = set()
         self.bad_targets = set()
+        self.pending = None
+        self.sweep_workers = sweep_workers or lookup.rev_dns_workers
+        self.workers = workers or 1
+        # Enough HTTP connections for every worker to have one
+        lookup.configure_http(max(lookup.http_pool_size, self.workers))
+        self.csv_writer = None
+        self.jsonl_writer = None
+        self.profiler = profiling.PhaseProfiler(profile_stats) if profile or profile_stats else None
+        self.journal = None
+        self.resumed = set()
+        self.checkpoint_path = checkpoint_path
+        self.resume = resume
 
         if nameserver:
-            lookup.dns_resolver.nameservers = [nameserver]
+            if isinstance(nameserver, basestring):
+                nameserver = [nameserver]
+            # Raises ValueError if any of them isn't a nameserver, which is caught in main
+            lookup.configure_nameservers(resolver_pool.parse_nameservers(nameserver), dns_hedge)
+        elif dns_hedge:
+            lookup.dns_hedge_after = dns_hedge
         if timeout:
             lookup.dns_resolver.timeout = timeout
             lookup.dns_resolver.lifetime = timeout
@@ -55,52 +97,205 @@ class InstaRecon(object):
 
         logging.basicConfig(format=log_format, level=logging_level)
 
-    def populate(self, user_supplied_list):
-        for user_supplied in user_supplied_list:
-            self.add_host(user_supplied)
+        if cache_path:
+            cache.enable(cache_path, cache_max_age, cache_max_size)
 
-        if not self.targets:
-            print '# No hosts to scan'
-        else:
-            print '# Scanning', str(len(self.targets)) + '/' + str(len(user_supplied_list)), 'hosts'
+    def open_checkpoint(self):
+        """
+        Opens the checkpoint journal before running any scan. When resuming, returns the targets
+        of the run that recorded it, so they don't need to be passed again.
+        """
+        if self.checkpoint_path:
+            # If file isn't writable this raises an IOError, which is caught in main
+            self.journal = checkpoint.Journal(self.checkpoint_path, self.resume)
+            if self.resume:
+                print '# Resuming from checkpoint ' + self.checkpoint_path
+            return self.journal.targets or []
+        return []
+
+    def populate(self, user_supplied):
+        """
+        Reads the targets in user_supplied (any iterable of str, read lazily) for scan_targets.
+        Duplicates are dropped, as are IPs and networks within another network passed,
+        using ingest.targets so memory stays bounded however many are passed.
 
-            if not lookup.shodan_key:
-                print '# No Shodan key provided'
+        Nothing is resolved here: scan_targets starts scanning as soon as the first
+        target is ready, while the rest are still being read and resolved.
+        """
+        user_supplied = ingest.targets(user_supplied)
+        if self.journal:
+            user_supplied = self.record_targets(user_supplied)
+
+        self.pending = pool.prefetch(self.new_targets(user_supplied))
+
+        if not lookup.shodan_key:
+            print '# No Shodan key provided'
 
-    def add_host(self, user_supplied):
+    def record_targets(self, user_supplied):
         """
-        Add string passed by user to self.targets as proper Host/Network objects
-        For this, it attempts to create these objects and moves on if got a ValueError.
+        Generator that records each (kind, str) of user_supplied in the journal as it's read,
+        so an interrupted run can be resumed without passing the targets again.
         """
-        # Test if user_supplied is an IP?
-        try:
-            self.targets.add(Host(ips=[user_supplied]))
-            return
-        except ValueError:
-            pass
+        for kind, target in user_supplied:
+            self.journal.add_passed_target(target)
+            yield kind, target
+        self.journal.passed_targets_done()
 
-        try:
-            self.targets.add(Network(user_supplied))
+    def new_targets(self, user_supplied):
+        """
+        Generator of the Host or Network of each (kind, str) in user_supplied, in the order
+        ingest.targets yields them (domains last). IPs and networks are ready straight away,
+        while domains are resolved with lookup.bulk_resolve, many A lookups in flight at once,
+        and each is yielded as soon as its answer arrives.
+        """
+        user_supplied = iter(user_supplied)
+        first_domain = None
+        for kind, target in user_supplied:
+            if kind == ingest.DOMAIN:
+                first_domain = target
+                break
+            target = self.add_host(target, kind)
+            if target is not None:
+                yield target
+
+        if first_domain is None:
             return
-        except ValueError:
-            pass
 
-        # Test if user_supplied is a valid DNS? Needs strict flag, otherwise no ValueError will be raise by Host
+        # Targets restored from the journal, which aren't resolved again
+        restored = []
+
+        def domains():
+            for target in itertools.chain([first_domain], (target for _, target in user_supplied)):
+                finished = self.journal.finished(target) if self.journal else None
+                if finished is not None:
+                    restored.append(self.add_host(target))
+                else:
+                    yield target
+
+        for domain, ips in lookup.bulk_resolve(domains(), 'A'):
+            while restored:
+                yield restored.pop(0)
+            target = self.add_host(domain, ingest.DOMAIN, ips)
+            if target is not None:
+                yield target
+
+        while restored:
+            yield restored.pop(0)
+
+    def add_host(self, user_supplied, kind=None, ips=None):
+        """
+        Adds str user_supplied to self.targets as a Host or Network, and returns it (None if it isn't valid).
+        kind is what ingest.classify says user_supplied is, only from its syntax, and is worked out if not given.
+        ips are the IPs a domain was already resolved to, otherwise it's resolved here.
+        Targets finished in a resumed run are restored from the journal instead.
+        """
+        finished = self.journal.finished(user_supplied) if self.journal else None
+        if finished is not None:
+            self.targets.add(finished)
+            self.resumed.add(finished)
+            return finished
+
+        if kind is None:
+            kind, user_supplied = ingest.classify(user_supplied)
+
         try:
-            self.targets.add(Host(domain=user_supplied, strict=False))
-            return
+            if kind == ingest.IP:
+                target = Host(ips=[user_supplied])
+            elif kind == ingest.NETWORK:
+                target = Network(user_supplied)
+            else:
+                target = Host(domain=user_supplied, ips=ips)
         except ValueError:
             logging.critical('Couldn\'t resolve or understand ' + user_supplied)
-            pass
+            self.bad_targets.add(user_supplied)
+            return None
 
-        self.bad_targets.add(user_supplied)
+        self.targets.add(target)
+        return target
 
     def scan_targets(self):
-        for target in self.targets:
+        """
+        Scans the targets already in self.targets, and those read by populate as each becomes ready.
+        Targets finished in a resumed run are only written to the outputs.
+        """
+        pending, self.pending = self.pending, None
+
+        def targets():
+            # Copied before pending starts adding to self.targets
+            for target in itertools.chain(list(self.targets), pending or ()):
+                finished = self.journal.finished(target) if self.journal and target not in self.resumed else None
+                if finished is not None:
+                    self.targets.discard(target)
+                    self.targets.add(finished)
+                    self.resumed.add(finished)
+                    target = finished
+
+                if target in self.resumed:
+                    print '# Already scanned ' + str(target) + ' before resuming'
+                    self.write_target_csv(target)
+                    self.write_target_jsonl(target, resumed=True)
+                else:
+                    yield target
+
+        if self.workers < 2:
+            for target in targets():
+                self.scan_target(target)
+                self.finish_target(target)
+        else:
+            # Each worker prints to its own buffer, and each target's block
+            # is printed in one go once it's done, so outputs don't interleave
+            with output.captured_stdout() as stdout:
+
+                def scan_target_captured(target):
+                    stdout.capture()
+                    try:
+                        self.scan_target(target)
+                    finally:
+                        block = stdout.release()
+                    return block
+
+                for target, block in pool.imap_unordered(scan_target_captured, targets(), self.workers):
+                    stdout.write(block)
+                    stdout.flush()
+                    self.finish_target(target)
+
+        if not self.targets:
+            print '# No hosts to scan'
+        else:
+            print '# Scanned', str(len(self.targets)) + '/' + str(len(self.targets) + len(self.bad_targets)), 'hosts'
+
+    def finish_target(self, target):
+        """Saves target once it's scanned: to the csv output, and to the journal so resumed runs skip it"""
+        self.write_target_csv(target)
+        self.write_target_jsonl(target)
+        if self.journal:
+            self.journal.add_target(target)
+
+    def phase(self, target, name):
+        """Context manager that times phase name of target's scan when profiling"""
+        if self.profiler:
+            return self.profiler.phase(target, name)
+        return profiling.no_phase
+
+    def scan_target(self, target):
+        """
+        Scans target. Lookups that fail are recorded in target.errors, and anything else
+        going wrong only stops this target's scan, so the rest of the targets are still scanned.
+        """
+        try:
             if isinstance(target, Host):
                 self.scan_host(target)
             elif isinstance(target, Network):
                 self.scan_network(target)
+        except Exception as e:
+            logging.debug('Scan of ' + str(target) + ' stopped', exc_info=True)
+            target.add_error(e)
+
+        if target.errors:
+            print '[*] Failed lookups:'
+            for error in target.errors:
+                print '  ' + str(error)
+            print ''
 
     def scan_host(self, host):
         print ''
@@ -118,14 +313,42 @@ class InstaRecon(object):
         # if self.scan_flags['google'] or flags_default:
         #     self.scan_host_google(host)
 
-        self.scan_host_dns(host)
-        self.scan_host_whois(host)
-        self.scan_host_shodan(host)
-        self.scan_host_google(host)
+        try:
+            pool.run_graph(self.host_lookups(host))
+        finally:
+            # Whatever was found is printed even if some lookups failed
+            self.print_host_dns(host)
+            self.print_host_whois(host)
+            self.print_host_shodan(host)
+            self.print_host_google(host)
+
+    def host_lookups(self, host):
+        """
+        Lookups on host as tasks for pool.run_graph. Whois IP and Shodan need the IPs
+        from A records, while everything else only needs the domain, so they run
+        concurrently. Each one is timed as its phase when profiling.
+        """
+        def task(phase, lookup_method):
+            def run():
+                with self.phase(host, phase):
+                    lookup_method()
+            return run
+
+        tasks = [
+            ('a', task('dns', host.lookup_dns_a), []),
+            ('reverse_dns', task('dns', host.lookup_dns_rev_all), ['a']),
+            ('ns', task('dns', host.lookup_dns_ns), []),
+            ('mx', task('dns', host.lookup_dns_mx), []),
+            ('whois_domain', task('whois', host.lookup_whois_domain), []),
+            ('whois_ip', task('whois', host.lookup_whois_ip_all), ['a']),
+        ]
+        if lookup.shodan_key:
+            tasks.append(('shodan', task('shodan', host.lookup_shodan_all), ['a']))
+        if host.domain:
+            tasks.append(('google', task('google', host.google_lookups), []))
+        return tasks
 
-    def scan_host_dns(self, host):
-        # DNS and Whois lookups
-        host.lookup_dns()
+    def print_host_dns(self, host):
         if host.domain:
             print '[*] Domain: ' + host.domain
 
@@ -135,14 +358,12 @@ class InstaRecon(object):
             print '[*] IPs & reverse DNS:'
             print host.print_all_ips()
 
-        host.lookup_dns_ns()
         # NS records
         if host.ns:
             print ''
             print '[*] NS records:'
             print host.print_all_ns()
 
-        host.lookup_dns_mx()
         # MX records
         if host.mx:
             print ''
@@ -150,16 +371,13 @@ class InstaRecon(object):
             print host.print_all_mx()
         print ''
 
-
-    def scan_host_whois(self, host):
+    def print_host_whois(self, host):
         # Domain whois
-        host.lookup_whois_domain()
         if host.whois_domain:
             print '[*] Whois domain:'
             print host.whois_domain
 
         # IP whois
-        host.lookup_whois_ip_all()
         m = host.print_all_whois_ip()
         if m:
             for result in m:
@@ -173,14 +391,12 @@ class InstaRecon(object):
 
         print ''
 
-    def scan_host_shodan(self, host):
+    def print_host_shodan(self, host):
         # Shodan
         if lookup.shodan_key:
 
             print '# Querying Shodan for open ports'
 
-            host.lookup_shodan_all()
-
             m = host.print_all_shodan()
             if m:
                 print '[*] Shodan:'
@@ -192,12 +408,10 @@ class InstaRecon(object):
             print "# Can't do Shodan lookups without a key (pass one with -s or with unix environment variable SHODAN_KEY)"
         print ''
 
-    def scan_host_google(self, host):
+    def print_host_google(self, host):
         # Google subdomains lookup
         if host.domain:
-            print '# Querying Google for subdomains and Linkedin pages, this might take a while'
-
-            host.google_lookups()
+            print '# Querying Google for subdomains and Linkedin pages'
 
             if host.linkedin_page:
                 print '[*] Possible LinkedIn page: ' + host.linkedin_page
@@ -212,66 +426,150 @@ class InstaRecon(object):
         """Scan a network object"""
         print ''
         print '# _____________ Reverse DNS lookups on {} _____________ #'.format(str(network))
-        self.reverse_dns_on_cidr(network)
+        with self.phase(network, 'reverse_dns'):
+            self.reverse_dns_on_cidr(network, self.sweep_workers, self.journal, self.jsonl_writer)
+        with self.phase(network, 'shodan'):
+            self.scan_network_shodan(network)
+
+    def scan_network_shodan(self, network):
+        """Shodan results for the whole network, from a single paged search"""
+        if lookup.shodan_key:
+            print ''
+            print '# Querying Shodan for hosts in ' + str(network)
+
+            network.lookup_shodan()
+
+            m = network.print_all_shodan()
+            if m:
+                print '[*] Shodan:'
+                print m
+            else:
+                logging.error('No Shodan entries found')
 
     @staticmethod
-    def reverse_dns_on_cidr(target):
-        """Does reverse dns lookups on a target, and saves results to target using target.add_related_host"""
+    def reverse_dns_on_cidr(target, workers=None, journal=None, jsonl_writer=None):
+        """
+        Does reverse dns lookups on a target, and saves results to target using target.add_related_host
+        Up to workers lookups are in flight at once, but results come back in address order.
+        If journal is given, each block of target is recorded in it once swept, and blocks
+        it already has from a resumed run aren't swept again.
+        If jsonl_writer is given, each host found is written to it straight away.
+        IPs whose reverse domains are already in host_registry aren't looked up again.
+        """
         if not isinstance(target, Network):
             raise ValueError
 
-        cidr = target.cidr
+        swept = journal.swept_blocks(target) if journal else {}
+        if swept:
+            print '# ' + str(len(swept)) + ' blocks already swept before resuming'
 
-        for ip, reverse_domains in lookup.rev_dns_on_cidr(cidr):
+        for block, found in sorted(swept.iteritems(), key=lambda x: ipa.ip_network(unicode(x[0]))):
+            for ip, reverse_domains in found:
+                target.add_related_ip(ip, reverse_domains)
+                if jsonl_writer:
+                    jsonl_writer.write(target.sweep_record(ip, reverse_domains))
 
-                new_host = Host(ips=[ip], reverse_domains=reverse_domains)
-                target.add_related_host(new_host)
-                print new_host.print_all_ips()
+        for block, found in lookup.rev_dns_on_blocks(target.cidr, workers, skip=swept, known=host_registry.reverse_domains()):
+            for ip, reverse_domains in found:
+
+                # Kept packed in target.related_hosts rather than as a Host
+                target.add_related_ip(ip, reverse_domains)
+                print IP(str(ip), reverse_domains).print_ip()
+                if jsonl_writer:
+                    jsonl_writer.write(target.sweep_record(ip, reverse_domains))
+
+            if journal:
+                journal.add_block(target, block, found)
 
         if not target.related_hosts:
             print '# No results for this range'
 
-    def test_output_csv(self, filename=None):
-        """Test if file is writable before running any scan"""
+    def open_output_csv(self, filename=None):
+        """Opens csv output file before running any scan, so each target can be saved as soon as it's done"""
         if filename:
-            with open(filename, 'wb') as f:
-                # If file isn't writable this raises an IOError, which is caught in main
-                pass
+            # If file isn't writable this raises an IOError, which is caught in main
+            self.csv_writer = output.CsvWriter(filename)
 
-    def write_output_csv(self, filename=None):
-        """Writes output for each target as csv in filename"""
+    def open_output_jsonl(self, filename=None):
+        """Opens JSON Lines output file before running any scan, so records can be written as soon as they're found"""
         if filename:
-            filename = os.path.expanduser(filename)
-
-            print '# Saving output csv file'
-
-            output_as_lines = []
+            # If file isn't writable this raises an IOError, which is caught in main
+            self.jsonl_writer = output.JsonLinesWriter(filename)
 
-            for host in self.targets:
-                for line in host.print_as_csv_lines():
-                    output_as_lines.append(line)
-                output_as_lines.append(['\n'])
-
-                with open(filename, 'wb') as f:
-                    writer = csv.writer(f)
-
-                    for line in output_as_lines:
-                        writer.writerow(line)
+    def write_target_jsonl(self, target, resumed=False):
+        """
+        Writes records of target, if a JSON Lines output file was opened. Sweep hits of networks
+        are written as they're found, so only those of networks restored from the journal are written here.
+        """
+        if self.jsonl_writer:
+            if resumed and isinstance(target, Network):
+                self.jsonl_writer.write_records(target.as_records(sweep_hits=True))
+            else:
+                self.jsonl_writer.write_target(target)
+
+    def close_output_jsonl(self):
+        if self.jsonl_writer:
+            print '# Saving output JSON Lines file'
+            self.jsonl_writer.close()
+            self.jsonl_writer = None
+
+    def write_target_csv(self, target):
+        """Writes output for target as csv lines, if an output file was opened"""
+        if self.csv_writer:
+            self.csv_writer.write_target(target)
+
+    def close_checkpoint(self):
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    def print_failed_targets(self):
+        """Prints how many targets had lookups fail, as their results are incomplete"""
+        failed = [target for target in self.targets if target.errors]
+        if failed:
+            print '# ' + str(len(failed)) + '/' + str(len(self.targets)) + ' targets had failed lookups: ' + ', '.join(sorted(str(target) for target in failed))
+
+    def print_profile(self):
+        """Prints time taken by each phase and the slowest targets, if profiling"""
+        if self.profiler:
+            print ''
+            print self.profiler.summary()
+            print ''
 
-                    output_written = True
+    def close_output_csv(self):
+        """Closes csv output file. Everything was already written as each target finished."""
+        if self.csv_writer:
+            print '# Saving output csv file'
+            self.csv_writer.close()
+            self.csv_writer = None
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description=InstaRecon.entry_banner,
-        usage='%(prog)s [options] target1 [target2 ... targetN]',
+        usage='%(prog)s [options] [-i FILE] target1 [target2 ... targetN]',
         epilog=argparse.SUPPRESS,
     )
 
-    parser.add_argument('targets', nargs='+', help='targets to be scanned - can be a domain (google.com), an IP (8.8.8.8) or a network range (8.8.8.0/24)')
+    parser.add_argument('targets', nargs='*', help='targets to be scanned - can be a domain (google.com), an IP (8.8.8.8) or a network range (8.8.8.0/24)')
+    parser.add_argument('-i', '--input', required=False, action='append', metavar='FILE', help='also scan the targets in FILE, one per line (- reads stdin, can be repeated). Duplicates and IPs or ranges within another range passed are skipped')
     parser.add_argument('-o', '--output', required=False, nargs='?', help='output filename as csv')
-    parser.add_argument('-n', '--nameserver', required=False, nargs='?', help='alternative DNS server to query')
+    parser.add_argument('--jsonl', required=False, metavar='FILE', help='output filename as JSON Lines, with a record for each host, IP, subdomain and network sweep hit written as soon as it\'s found')
+    parser.add_argument('-n', '--nameserver', required=False, action='append', help='DNS servers to spread lookups across: ip or ip:port, comma separated, or a file with one per line (can be repeated)')
+    parser.add_argument('--dns-hedge', required=False, type=float, metavar='SECONDS', help='also send DNS queries of network sweeps not answered within SECONDS to a second nameserver, and use the first answer')
     parser.add_argument('-s', '--shodan_key', required=False, nargs='?', help='shodan key for automated port/service information (SHODAN_KEY environment variable also works for this)')
     parser.add_argument('-t', '--timeout', required=False, nargs='?', type=float, help='timeout for DNS lookups (default is 2s)')
+    parser.add_argument('-w', '--workers', required=False, type=int, default=1, help='number of targets scanned concurrently (default is 1)')
+    parser.add_argument('--sweep-workers', required=False, type=int, help='DNS queries kept in flight when scanning a network range (default is 100)')
+    parser.add_argument('--cache', action='store_true', help='cache lookups in a SQLite database (' + cache.default_path + ' unless --cache-path is passed)')
+    parser.add_argument('--cache-path', required=False, metavar='FILE', help='cache lookups in the SQLite database FILE (implies --cache)')
+    parser.add_argument('--no-cache', action='store_true', help='don\'t cache lookups, even if --cache or --cache-path was passed')
+    parser.add_argument('--cache-max-age', required=False, type=int, help='maximum age in seconds of cached lookups, regardless of their TTL')
+    parser.add_argument('--cache-max-size', required=False, type=int, help='maximum size in MB of the lookup cache (default is 100)')
+    parser.add_argument('--metrics-out', required=False, action='append', metavar='FILE', help='save lookup metrics to FILE at the end of the scan, as JSON or in Prometheus text format if FILE ends with .prom (can be repeated)')
+    parser.add_argument('--profile', action='store_true', help='print wall and CPU time of each phase (dns, whois, shodan, google) and the slowest targets at the end')
+    parser.add_argument('--profile-stats', required=False, metavar='FILE', help='also run each phase of each scan under cProfile, in whichever thread does it, and save their merged pstats to FILE')
+    parser.add_argument('--checkpoint', required=False, metavar='FILE', help='record each finished target and each swept block of network ranges in FILE, so the scan can be resumed with --resume')
+    parser.add_argument('--resume', required=False, metavar='FILE', help='resume the scan recorded in checkpoint FILE, skipping finished work and recording the rest in it. Targets default to those of the recorded scan')
     parser.add_argument('-v', '--verbose', action='count', default=0, help='verbose errors (-vv or -vvv for extra verbosity)')
     # parser.add_argument('--dns', action='store_true', help='DNS lookups')
     # parser.add_argument('--whois', action='store_true', help='whois lookups')
@@ -280,7 +578,17 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    targets = sorted(set(args.targets))
+    if not args.targets and not args.input and not args.resume:
+        parser.error('no targets to scan')
+
+    for path in args.input or ():
+        if path != '-' and not os.path.isfile(path):
+            parser.error('can\'t read targets from ' + path)
+
+    try:
+        resolver_pool.parse_nameservers(args.nameserver or ())
+    except ValueError as e:
+        parser.error('invalid nameserver - ' + str(e))
 
     if args.shodan_key:
         shodan_key = args.shodan_key
@@ -296,27 +604,60 @@ if __name__ == '__main__':
 
     scan = InstaRecon(
         nameserver=args.nameserver,
+        dns_hedge=args.dns_hedge,
         shodan_key=shodan_key,
         timeout=args.timeout,
         verbose=args.verbose,
+        sweep_workers=args.sweep_workers,
+        workers=args.workers,
+        cache_path=None if args.no_cache else args.cache_path or (cache.default_path if args.cache else None),
+        cache_max_age=args.cache_max_age,
+        cache_max_size=args.cache_max_size * 1024 * 1024 if args.cache_max_size else None,
+        profile=args.profile,
+        profile_stats=bool(args.profile_stats),
+        checkpoint_path=args.resume or args.checkpoint,
+        resume=bool(args.resume),
     )
 
     try:
         print scan.entry_banner
-        scan.test_output_csv(args.output)
-        scan.populate(targets)
+        scan.open_output_csv(args.output)
+        scan.open_output_jsonl(args.jsonl)
+        recorded_targets = scan.open_checkpoint()
+        if args.targets or args.input:
+            scan.populate(itertools.chain(args.targets, ingest.read_lines(args.input or ())))
+        else:
+            scan.populate(recorded_targets)
         scan.scan_targets()
 
     except KeyboardInterrupt:
         logging.warning('Scan interrupted')
-
-    except lookup.NoInternetAccess:
-        logging.critical('Something went wrong. Sure you got internet connection?')
-        sys.exit()
+        if scan.journal:
+            print '# Finished work is saved, resume the scan with --resume ' + scan.checkpoint_path
 
     except IOError:
         logging.critical('Can\'t write to file.. Better not start scanning anything, right?')
         sys.exit()
 
-    scan.write_output_csv(args.output)
+    scan.close_output_csv()
+    scan.close_output_jsonl()
+    scan.close_checkpoint()
+    scan.print_failed_targets()
+    scan.print_profile()
+
+    if args.profile_stats:
+        try:
+            if scan.profiler.dump_stats(args.profile_stats):
+                print '# Saved cProfile stats to ' + args.profile_stats + ' (python -m pstats ' + args.profile_stats + ')'
+            else:
+                logging.error('No phases were profiled, so no stats were saved to ' + args.profile_stats)
+        except IOError:
+            logging.error('Can\'t write profile stats to ' + args.profile_stats)
+
+    for path in args.metrics_out or ():
+        try:
+            metrics.export(path)
+        except IOError:
+            logging.error('Can\'t write metrics to ' + path)
+
     print scan.exit_banner
@@ -45,6 +45,7 @@ setup(
     description='Automated basic digital reconnaissance',
     packages=find_packages('.'),
     include_package_data=True,
+    package_data={'src': ['data/*.dat']},
     classifiers = [
         'Development Status :: 4 - Beta',
         'Natural Language :: English',
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+"""
+Pipelined DNS resolver that keeps many UDP queries in flight at once.
+
+dns.resolver.Resolver.query blocks on one round trip per name, which makes
+mass PTR sweeps and long subdomain lists slow. BulkResolver sends queries
+from a few UDP sockets, matches responses by message ID and question, retries
+queries that time out (on another nameserver) and falls back to TCP when a
+response is truncated. Results come back in the same order as the queries.
+
+Nameservers are picked by a resolver_pool.ResolverPool, which keeps track of
+how each of them is doing. Queries not answered within hedge_after seconds can
+be sent to a second nameserver as well, and the first answer is used.
+"""
+import collections
+import errno
+import logging
+import random
+import select
+import socket
+import time
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.query
+import dns.rcode
+
+from resolver_pool import ResolverPool
+
+# Status of each result
+OK = 'ok'
+NXDOMAIN = 'nxdomain'
+NOANSWER = 'noanswer'
+TIMEOUT = 'timeout'
+ERROR = 'error'
+
+# tries is how many times the query was sent, and elapsed the seconds from the first try to the result
+Result = collections.namedtuple('Result', ['key', 'status', 'rrsets', 'ttl', 'tries', 'elapsed', 'sent'])
+
+
+def _family(server):
+    """Address family of server, as (str ip, int port)"""
+    return socket.AF_INET6 if ':' in server[0] else socket.AF_INET
+
+
+class _Query(object):
+    """Holds state of one query while it's in flight. Used internally by BulkResolver."""
+
+    __slots__ = ('index', 'key', 'message', 'tries', 'started', 'deadline', 'server', 'sent', 'sock', 'hedge', 'packets')
+
+    def __init__(self, index, key, qname, rdtype):
+        self.index = index
+        self.key = key
+        self.message = dns.message.make_query(qname, rdtype)
+        self.tries = 0
+        # Copies of the query sent, counting retries and hedges
+        self.packets = 0
+        self.started = None
+        self.deadline = None
+        self.server = None
+        self.sent = None
+        self.sock = None
+        # (message id, server, time sent, socket) of the copy sent to a second server, if any
+        self.hedge = None
+
+
+class BulkResolver(object):
+    """
+    Resolves batches of DNS queries with many of them in flight.
+
+    Keyword arguments:
+    nameservers -- ResolverPool, or list of str IPs of nameservers. Queries are spread across them.
+    port -- Int port nameservers listen on, if nameservers is a list.
+    timeout -- Float seconds to wait for each try of a query.
+    retries -- Int number of tries for each query before giving up on it.
+    max_in_flight -- Int maximum number of queries waiting for a response at once.
+    sockets -- Int number of UDP sockets queries are spread across, for each address family (IPv4, IPv6) of the nameservers.
+    hedge_after -- Float seconds after which a query that wasn't answered is sent to
+        a second nameserver as well, or None to only send it again once it times out.
+    """
+
+    def __init__(self, nameservers, port=53, timeout=2, retries=3, max_in_flight=100, sockets=2, hedge_after=None):
+        if not nameservers:
+            raise ValueError('No nameservers to query')
+        if isinstance(nameservers, ResolverPool):
+            self.pool = nameservers
+        else:
+            self.pool = ResolverPool([(ns, port) for ns in nameservers])
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.max_in_flight = max(1, max_in_flight)
+        self.sockets = max(1, sockets)
+        # Only worth it if there's another server to send queries to
+        self.hedge_after = hedge_after if hedge_after and len(self.pool.servers) > 1 else None
+
+    def resolve(self, queries):
+        """
+        Generator that resolves each (key, qname, rdtype) in queries.
+
+        Yields a Result for each query, in the same order as queries. rrsets is a list
+        of the answer rrsets of type rdtype (CNAMEs are followed by the server),
+        and ttl is the lowest TTL among them. sent is the number of packets sent
+        for the query, counting retries and hedged copies.
+        """
+        # Sockets of each address family that nameservers are in, as IPv4 sockets can't reach IPv6 servers
+        socks = {}
+        for family in set(_family(server) for server in self.pool.servers):
+            socks[family] = []
+            for _ in range(self.sockets):
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+                sock.setblocking(0)
+                socks[family].append(sock)
+        all_socks = [sock for family_socks in socks.itervalues() for sock in family_socks]
+
+        iterator = enumerate(queries)
+        exhausted = False
+        in_flight = {}     # message id -> _Query
+        done = {}          # index -> Result
+        next_index = 0
+
+        try:
+            while True:
+                # Results held for reordering count towards the window as well
+                while not exhausted and len(in_flight) + len(done) < self.max_in_flight:
+                    try:
+                        index, (key, qname, rdtype) = next(iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    query = _Query(index, key, qname, rdtype)
+                    self._send(query, in_flight, socks)
+
+                while next_index in done:
+                    yield done.pop(next_index)
+                    next_index += 1
+
+                if exhausted and not in_flight and not done:
+                    return
+
+                if not in_flight:
+                    continue
+
+                wait = max(0, min(self._next_event(query) for query in in_flight.itervalues()) - time.time())
+                readable = select.select(all_socks, [], [], wait)[0]
+
+                for sock in readable:
+                    self._receive(sock, in_flight, done)
+
+                now = time.time()
+                for query in set(query for query in in_flight.itervalues() if query.deadline <= now):
+                    self._remove(query, in_flight)
+                    self.pool.failure(query.server)
+                    if query.tries < self.retries:
+                        logging.debug('Timeout resolving ' + str(query.key) + '. Retrying.')
+                        self._send(query, in_flight, socks)
+                    else:
+                        done[query.index] = self._finish(query, TIMEOUT)
+
+                if self.hedge_after:
+                    for query in [query for query in in_flight.itervalues()
+                                  if query.hedge is None and query.sent + self.hedge_after <= now]:
+                        self._send_hedge(query, in_flight, socks)
+        finally:
+            for sock in all_socks:
+                sock.close()
+
+    def _next_event(self, query):
+        """Time at which query times out, or is due to be hedged"""
+        if self.hedge_after and query.hedge is None:
+            return min(query.deadline, query.sent + self.hedge_after)
+        return query.deadline
+
+    @staticmethod
+    def _new_id(in_flight):
+        """Message id not used by any other query in flight"""
+        while True:
+            message_id = random.randint(0, 0xffff)
+            if message_id not in in_flight:
+                return message_id
+
+    @staticmethod
+    def _socket(socks, query, server):
+        """One of socks (dict of address family:list of sockets) that can reach server, picked by query"""
+        family_socks = socks[_family(server)]
+        return family_socks[query.index % len(family_socks)]
+
+    def _send(self, query, in_flight, socks):
+        """Sends query to the nameserver picked by the pool, other than the one that just timed out"""
+        query.message.id = self._new_id(in_flight)
+        query.server = self.pool.choose(exclude=(query.server,))
+        query.sock = self._socket(socks, query, query.server)
+        query.tries += 1
+        query.packets += 1
+        query.sent = time.time()
+        if query.started is None:
+            query.started = query.sent
+        query.deadline = query.sent + self.timeout
+        query.hedge = None
+        in_flight[query.message.id] = query
+
+        try:
+            query.sock.sendto(query.message.to_wire(), query.server)
+        except socket.error as e:
+            # Treated as a lost packet, it'll be retried once its deadline passes
+            logging.debug('Failed to send query for ' + str(query.key) + ' - ' + str(e))
+
+    def _send_hedge(self, query, in_flight, socks):
+        """Sends a copy of query to a second nameserver, with its own message id. The first answer wins."""
+        server = self.pool.choose(exclude=(query.server,))
+        if server == query.server:
+            # Every other server is ejected
+            query.hedge = False
+            return
+
+        hedge_id = self._new_id(in_flight)
+        hedge_sock = self._socket(socks, query, server)
+        query.hedge = (hedge_id, server, time.time(), hedge_sock)
+        query.packets += 1
+        in_flight[hedge_id] = query
+
+        message_id = query.message.id
+        query.message.id = hedge_id
+        try:
+            hedge_sock.sendto(query.message.to_wire(), server)
+        except socket.error as e:
+            logging.debug('Failed to send hedged query for ' + str(query.key) + ' - ' + str(e))
+        finally:
+            query.message.id = message_id
+
+    @staticmethod
+    def _remove(query, in_flight):
+        """Removes query from in_flight, along with its hedge"""
+        in_flight.pop(query.message.id, None)
+        if query.hedge:
+            in_flight.pop(query.hedge[0], None)
+
+    @staticmethod
+    def _is_response(query, response):
+        if response.id == query.message.id:
+            return query.message.is_response(response)
+        # Response to the hedge, which has another id
+        return bool(response.flags & dns.flags.QR) and response.question == query.message.question
+
+    def _receive(self, sock, in_flight, done):
+        """Reads every datagram waiting on sock and matches them to queries in flight"""
+        while True:
+            try:
+                wire, address = sock.recvfrom(65535)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                # e.g. ICMP port unreachable from a previous send. Waiting queries will time out.
+                logging.debug('Error reading DNS responses - ' + str(e))
+                return
+
+            try:
+                response = dns.message.from_wire(wire)
+            except dns.exception.DNSException:
+                continue
+
+            query = in_flight.get(response.id)
+            if not query or not self._is_response(query, response):
+                # Late response to a query that was already retried, or a spoofed one
+                continue
+
+            if response.id == query.message.id:
+                server, sent, query_sock = query.server, query.sent, query.sock
+            else:
+                _, server, sent, query_sock = query.hedge
+            # IPv6 addresses come with flow info and scope id as well
+            if query_sock is not sock or address[:2] != server:
+                continue
+            # TCP fallback goes to the server that answered
+            query.server = server
+            self._remove(query, in_flight)
+
+            if response.flags & dns.flags.TC:
+                logging.debug('Truncated response for ' + str(query.key) + '. Retrying over TCP.')
+                try:
+                    response = dns.query.tcp(query.message, query.server[0], self.timeout, query.server[1])
+                except (socket.error, dns.exception.DNSException) as e:
+                    logging.debug('TCP query failed for ' + str(query.key) + ' - ' + str(e))
+                    done[query.index] = self._finish(query, ERROR)
+                    continue
+
+            result = self._result(query, response)
+            if result.status == ERROR:
+                # e.g. SERVFAIL or REFUSED
+                self.pool.failure(server, timed_out=False)
+            else:
+                self.pool.success(server, time.time() - sent)
+            done[query.index] = result
+
+    @classmethod
+    def _result(cls, query, response):
+        rcode = response.rcode()
+        if rcode == dns.rcode.NXDOMAIN:
+            return cls._finish(query, NXDOMAIN)
+        if rcode != dns.rcode.NOERROR:
+            return cls._finish(query, ERROR)
+
+        rdtype = query.message.question[0].rdtype
+        rrsets = [rrset for rrset in response.answer if rrset.rdtype == rdtype]
+        if not rrsets:
+            return cls._finish(query, NOANSWER)
+        return cls._finish(query, OK, rrsets, min(rrset.ttl for rrset in rrsets))
+
+    @staticmethod
+    def _finish(query, status, rrsets=(), ttl=None):
+        return Result(query.key, status, list(rrsets), ttl, query.tries, time.time() - query.started, query.packets)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+Optional persistent cache for lookup results, kept in a SQLite database.
+
+Lookups check the cache through cache.get and cache.put, which do nothing
+until cache.enable is called, so the cache is off unless asked for.
+Every source has its own expiry (see max_ages). DNS entries use the TTL
+of the record, and NXDOMAIN/NoAnswer results are cached as negatives.
+"""
+import cPickle as pickle
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+default_path = os.path.join(os.path.expanduser('~'), '.cache', 'instarecon', 'cache.sqlite')
+
+# Expiry in seconds for each source
+max_ages = {
+    'dns': 3600,                    # Only used if the answer doesn't have a TTL
+    'dns_negative': 3600,           # NXDOMAIN and NoAnswer
+    'whois_domain': 3 * 24 * 3600,
+    'whois_ip': 7 * 24 * 3600,
+    'shodan': 24 * 3600,
+    'google': 24 * 3600,
+}
+
+# Default size limit of the database, in bytes of cached values
+default_max_size = 100 * 1024 * 1024
+
+# Returned by get when there's no valid entry. None can't be used, as it is a valid cached value
+MISS = object()
+
+store = None
+
+
+class LookupCache(object):
+    """
+    SQLite backed cache of lookup results, safe to share between threads.
+
+    Keyword arguments:
+    path -- Str path of the SQLite database. Parent directories are created if needed.
+    max_age -- Int upper bound in seconds for the expiry of any entry, regardless of its source or TTL.
+    max_size -- Int size in bytes of cached values. Oldest entries are evicted once this is exceeded.
+    """
+
+    # How many writes happen between checks on the size of the database
+    eviction_interval = 500
+
+    def __init__(self, path=None, max_age=None, max_size=None):
+        self.path = os.path.expanduser(path or default_path)
+        self.max_age = max_age
+        self.max_size = max_size or default_max_size
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'source TEXT, key TEXT, value BLOB, size INTEGER, created REAL, expires REAL, '
+            'PRIMARY KEY (source, key))'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_created ON entries (created)')
+        self.evict()
+
+    def get(self, source, key):
+        """Returns value cached for source and key, or MISS if there's none or it expired"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value, expires FROM entries WHERE source = ? AND key = ?', (source, key)
+            ).fetchone()
+
+        if row and row[1] > time.time():
+            logging.debug('Cache hit for ' + source + ' ' + key)
+            return pickle.loads(str(row[0]))
+        return MISS
+
+    def set(self, source, key, value, max_age=None):
+        """
+        Caches value for source and key. Expires after max_age seconds,
+        or the default for source in max_ages. Both are capped by self.max_age.
+        """
+        if max_age is None:
+            max_age = max_ages.get(source, 0)
+        if self.max_age is not None:
+            max_age = min(max_age, self.max_age)
+        if max_age <= 0:
+            return
+
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                (source, key, sqlite3.Binary(data), len(data), now, now + max_age)
+            )
+            self._writes += 1
+            check_size = self._writes % self.eviction_interval == 0
+
+        if check_size:
+            self.evict()
+
+    def evict(self):
+        """Removes expired entries, and then oldest entries until the cache is within self.max_size"""
+        with self._lock:
+            self._db.execute('DELETE FROM entries WHERE expires <= ?', (time.time(),))
+
+            size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if size > self.max_size:
+                logging.info('Cache is ' + str(size) + ' bytes, evicting oldest entries')
+                rows = self._db.execute('SELECT rowid, size FROM entries ORDER BY created')
+                to_delete = []
+                for rowid, row_size in rows:
+                    if size <= self.max_size:
+                        break
+                    to_delete.append((rowid,))
+                    size -= row_size
+                self._db.executemany('DELETE FROM entries WHERE rowid = ?', to_delete)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def enable(path=None, max_age=None, max_size=None):
+    """Starts caching lookups in the SQLite database at path (default is ~/.cache/instarecon)"""
+    global store
+    disable()
+    store = LookupCache(path, max_age, max_size)
+    logging.info('Caching lookups in ' + store.path)
+    return store
+
+
+def disable():
+    global store
+    if store:
+        store.close()
+    store = None
+
+
+def get(source, key):
+    if store:
+        return store.get(source, key)
+    return MISS
+
+
+def put(source, key, value, max_age=None):
+    if store:
+        store.set(source, key, value, max_age)
+
+
+class Uncached(object):
+    """Result that cached returns without caching it, e.g. as it's incomplete"""
+
+    __slots__ = ('result',)
+
+    def __init__(self, result):
+        self.result = result
+
+
+def key(name, *args):
+    """Key that cached uses for a call to the function called name with args"""
+    return name + repr(args)
+
+
+def cached(source):
+    """
+    Decorator that caches results of a lookup function in source, keyed by its arguments.
+    Only results that evaluate to True are cached, so failed lookups are retried on the next run.
+    func returns its result wrapped in Uncached when it shouldn't be cached either.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            call_key = key(func.__name__, *args)
+
+            result = get(source, call_key)
+            if result is not MISS:
+                return result
+
+            result = func(*args)
+            if isinstance(result, Uncached):
+                return result.result
+            if result:
+                put(source, call_key, result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Append-only journal of finished work, so an interrupted scan can be resumed.
+
+Records are pickled one after the other, the same way the lookup cache stores
+results, and flushed as soon as they're written. A run that's killed while
+writing leaves at most one truncated record at the end, which is ignored when
+the journal is read back. Records are:
+
+    ('passed', str target)                     -- target passed to the run, one record for each
+    ('passed_done',)                           -- every target passed to the run was recorded
+    ('target', str target, Host or Network)    -- target that was fully scanned
+    ('block', str network, str block, list)    -- block of a network sweep that was fully
+                                                  swept, with (str ip, reverse domains) found
+"""
+import cPickle as pickle
+import logging
+import os
+import threading
+
+
+class Journal(object):
+    """
+    Checkpoint journal of a scan. Safe to share between threads.
+
+    Keyword arguments:
+    path -- Str path of the journal file. ~ is expanded.
+    resume -- Bool, read what a previous run recorded in path and append to it. Otherwise path is truncated.
+    targets -- List of str targets passed to the run that recorded the journal, or None
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = os.path.expanduser(path)
+        self.targets = None
+        self._targets_done = False
+        self._finished = {}
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+        if resume and os.path.exists(self.path):
+            self._read()
+            # Anything after the last complete record is dropped, so new records don't follow a truncated one
+            self._file = open(self.path, 'r+b')
+            self._file.seek(self._end)
+            self._file.truncate()
+        else:
+            # Raises IOError straight away if path isn't writable
+            self._file = open(self.path, 'wb')
+
+        # Targets are only recorded by the run that starts the journal
+        self._recording = self.targets is None
+
+    def _read(self):
+        self._end = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError, AttributeError, ImportError, IndexError) as e:
+                    logging.warning('Ignoring incomplete record at the end of checkpoint ' + self.path + ' - ' + str(e))
+                    break
+                self._end = f.tell()
+
+                if record[0] == 'passed':
+                    if self.targets is None:
+                        self.targets = []
+                    self.targets.append(record[1])
+                elif record[0] == 'passed_done':
+                    self._targets_done = True
+                elif record[0] == 'target':
+                    self._finished[record[1]] = record[2]
+                    self._blocks.pop(record[1], None)
+                elif record[0] == 'block':
+                    self._blocks.setdefault(record[1], {})[record[2]] = record[3]
+
+        logging.info('Checkpoint ' + self.path + ' has ' + str(len(self._finished)) + ' finished targets and ' +
+                     str(sum(len(blocks) for blocks in self._blocks.itervalues())) + ' swept blocks')
+        if self.targets is not None and not self._targets_done:
+            logging.warning('Checkpoint ' + self.path + ' only has the first ' + str(len(self.targets)) +
+                            ' targets of the interrupted run, pass them again to scan the rest')
+
+    def _write(self, record):
+        with self._lock:
+            pickle.dump(record, self._file, pickle.HIGHEST_PROTOCOL)
+            self._file.flush()
+
+    def add_passed_target(self, target):
+        """Records str target as passed to this run, so it can be resumed without passing it again"""
+        if self._recording:
+            self._write(('passed', target))
+
+    def passed_targets_done(self):
+        """Records that every target passed to this run was recorded"""
+        if self._recording:
+            self._recording = False
+            self._write(('passed_done',))
+
+    def add_targets(self, targets):
+        """Records every one of targets (str) passed to this run"""
+        for target in targets:
+            self.add_passed_target(target)
+        self.passed_targets_done()
+
+    def add_target(self, target):
+        """Records that target was fully scanned, with all of its results"""
+        with self._lock:
+            self._finished[str(target)] = target
+            self._blocks.pop(str(target), None)
+        self._write(('target', str(target), target))
+
+    def finished(self, target):
+        """The Host or Network that target was scanned as in a previous run, or None if it wasn't finished"""
+        with self._lock:
+            return self._finished.get(str(target))
+
+    def add_block(self, network, block, found):
+        """Records that block of network was swept, finding found (list of (ip, reverse domains))"""
+        found = [(str(ip), list(reverse_domains)) for ip, reverse_domains in found]
+        with self._lock:
+            self._blocks.setdefault(str(network), {})[str(block)] = found
+        self._write(('block', str(network), str(block), found))
+
+    def swept_blocks(self, network):
+        """Dict of str block:list of (ip, reverse domains) found, for each block of network already swept"""
+        with self._lock:
+            return dict(self._blocks.get(str(network), {}))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
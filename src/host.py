@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 import dns.name  # http://www.dnspython.org/docs/1.12.0/
-import ipaddress as ipa  # https://docs.python.org/3/library/ipaddress.html
 import logging
+import threading
 
-from ip import IP
+from ip import IP, lazy_collection
 import lookup
 
 class Host(object):
@@ -24,22 +24,47 @@ class Host(object):
     whois_domain -- str representation of the Whois query
     linkedin_page -- Str of LinkedIn url that contains domain in html
     urls -- dict of protocol:pathnames found in google results for this domain
+    subdomain_urls -- dict of normalised subdomain:urls found in google results for each of self.google_subdomains
     related_hosts -- Set of Hosts that may be related to host, as they're part of the same cidrs
     subdomains -- Set of Hosts for each related Host found that is a subdomain of self.domain
     google_subdomains -- set of Hosts found through google dorks
     cidrs -- set of ipa.IPv4Network objects related to each ip.cidrs
+    errors -- List of lookup.LookupFailed for each lookup that couldn't be done
     """
 
-    def __init__(self, domain=None, ips=(), reverse_domains=(), strict=False):
+    __slots__ = (
+        'domain', '_ips', '_resolved', 'type', 'whois_domain', 'linkedin_page', '_key', '_hash',
+        '_mx', '_ns', '_urls', '_subdomain_urls', '_related_hosts', '_subdomains', '_google_subdomains', '_cidrs',
+        '_errors',
+    )
+
+    mx = lazy_collection('_mx', set)
+    ns = lazy_collection('_ns', set)
+    urls = lazy_collection('_urls', dict)
+    subdomain_urls = lazy_collection('_subdomain_urls', dict)
+    related_hosts = lazy_collection('_related_hosts', set)
+    subdomains = lazy_collection('_subdomains', set)
+    google_subdomains = lazy_collection('_google_subdomains', set)
+    cidrs = lazy_collection('_cidrs', set)
+    errors = lazy_collection('_errors', list)
+
+    def __init__(self, domain=None, ips=None, reverse_domains=(), strict=False):
         self.domain = None
-        self.ips = []
+        self._ips = []
+        # Whether self.domain's A records were looked up, even if it had none
+        self._resolved = False
 
         # Type check - depends on what parameters have been passed
         if domain:
             self.type = 'domain'
 
             self.domain = domain
-            self._get_ips()
+            if ips is not None:
+                # IPs already resolved for domain e.g. by lookup.bulk_resolve, even if it had none
+                self._ips = [IP(str(ip)) for ip in ips]
+                self._resolved = True
+            else:
+                self.lookup_dns_a()
 
             # Check if domain can be resolved only if strict flag is True
             if strict and not self.ips:
@@ -50,20 +75,32 @@ class Host(object):
             self.type = 'ip'
 
             # IP raises ValueError if passed an invalid value
-            self.ips = [IP(str(ip), reverse_domains) for ip in ips]
+            self._ips = [IP(str(ip), reverse_domains) for ip in ips]
         else:
             raise ValueError
 
-        self.mx = set()
-        self.ns = set()
+        self._set_key()
+
         self.whois_domain = None
         self.linkedin_page = None
-        self.urls = {}
 
-        self.related_hosts = set()
-        self.subdomains = set()
-        self.google_subdomains = set()
-        self.cidrs = set()
+    def _set_key(self):
+        """Identity of self for __hash__ and __eq__, worked out once as hosts are kept in sets"""
+        if self.type == 'domain':
+            self._key = ('domain', self.domain)
+        elif self.type == 'ip':
+            self._key = ('ip', ','.join([ip.ip for ip in self._ips]))
+        self._hash = hash(self._key)
+
+    @property
+    def ips(self):
+        return self._ips
+
+    @ips.setter
+    def ips(self, ips):
+        self._ips = ips
+        if self.type == 'ip':
+            self._set_key()
 
     def __str__(self):
         if self.type == 'domain':
@@ -72,16 +109,13 @@ class Host(object):
             return str(self.ips[0])
 
     def __hash__(self):
-        if self.type == 'domain':
-            return hash(('domain', self.domain))
-        elif self.type == 'ip':
-            return hash(('ip', ','.join([str(ip) for ip in self.ips])))
+        return self._hash
 
     def __eq__(self, other):
-        if self.type == 'domain':
-            return self.domain == other.domain
-        elif self.type == 'ip':
-            return self.ips == other.ips
+        return self._key == getattr(other, '_key', None)
+
+    def __ne__(self, other):
+        return not self == other
 
     def lookup_dns(self):
         """
@@ -91,17 +125,28 @@ class Host(object):
         2) Reverse DNS lookup on each self.ips
         """
         if self.type == 'domain':
-            self._get_ips()
+            self.lookup_dns_a()
         self.lookup_dns_rev_all()
         return self
 
+    def lookup_dns_a(self):
+        """Direct DNS lookup on self.domain, unless it was already resolved (even to nothing). Returns self."""
+        try:
+            self._get_ips()
+        except lookup.LookupFailed as e:
+            # Left unresolved, so it's looked up again next time
+            self.add_error(e)
+        return self
+
     def _get_ips(self):
         """
         Does direct DNS lookup to get IPs from self.domains.
-        Used internally by self.lookup_dns()
+        Used internally by self.lookup_dns_a()
+        Raises lookup.LookupFailed if the lookup couldn't be done.
         """
-        if self.domain and not self.ips:
+        if self.domain and not self._resolved:
             ips = lookup.direct_dns(self.domain)
+            self._resolved = True
             if ips:
                 self.ips = [IP(str(ip)) for ip in ips]
 
@@ -110,9 +155,13 @@ class Host(object):
         DNS lookup to find MX entries i.e. mail servers responsible for self.domain
         """
         if self.domain:
-            mx_list = lookup.mx_dns(self.domain)
+            try:
+                mx_list = lookup.mx_dns(self.domain)
+            except lookup.LookupFailed as e:
+                self.add_error(e)
+                return self
             if mx_list:
-                self.mx.update([Host(domain=mx).lookup_dns() for mx in mx_list])
+                self.mx.update(self._resolve_hosts(mx_list))
                 self._add_to_subdomains_if_valid(self.mx)
         return self
 
@@ -121,21 +170,52 @@ class Host(object):
         DNS lookup to find NS entries i.e. name/DNS servers responsible for self.domain
         """
         if self.domain:
-            ns_list = lookup.ns_dns(self.domain)
+            try:
+                ns_list = lookup.ns_dns(self.domain)
+            except lookup.LookupFailed as e:
+                self.add_error(e)
+                return self
             if ns_list:
-                self.ns.update([Host(domain=ns).lookup_dns() for ns in ns_list])
+                self.ns.update(self._resolve_hosts(ns_list))
                 self._add_to_subdomains_if_valid(self.ns)
         return self
 
     def lookup_dns_rev_all(self):
         """
-        Reverse DNS lookup on each IP in self.ips
+        Reverse DNS lookup on each IP in self.ips, all in flight at once
         """
-        if self.ips:
-            for ip in self.ips:
-                ip.lookup_rev_dns()
+        self._lookup_dns_rev_bulk([self])
         return self
 
+    @staticmethod
+    def _resolve_hosts(domains):
+        """
+        Returns a Host for each domain in domains, with direct and reverse DNS lookups done.
+        Hosts come from host_registry, so a domain found by several targets is only resolved once.
+        """
+        return host_registry.resolve(domains)
+
+    @staticmethod
+    def _lookup_dns_rev_bulk(hosts, known=None):
+        """
+        Reverse DNS lookups on each IP of each Host in hosts, through lookup.bulk_resolve.
+        IPs in known (dict of str ip:reverse domains) get their reverse domains from it instead.
+        """
+        known = known or {}
+        ips = {}
+        for host in hosts:
+            for ip in host.ips:
+                if ip.ip in known:
+                    ip.rev_domains = list(known[ip.ip])
+                else:
+                    ips.setdefault(ip.ip, []).append(ip)
+
+        if ips:
+            for ip_str, rev_domains in lookup.bulk_resolve(sorted(ips), 'PTR'):
+                if rev_domains:
+                    for ip in ips[ip_str]:
+                        ip.rev_domains = [domain.rstrip('.') for domain in rev_domains]
+
     def lookup_whois_domain(self):
         """
         Whois lookup on self.domain. Saved in self.whois_domain as string,
@@ -143,7 +223,10 @@ class Host(object):
         This makes it hard to index it, almost a project on its on.
         """
         if self.domain:
-            self.whois_domain = lookup.whois_domain(self.domain)
+            try:
+                self.whois_domain = lookup.whois_domain(self.domain)
+            except lookup.LookupFailed as e:
+                self.add_error(e)
         return self
 
     def lookup_whois_ip_all(self):
@@ -151,50 +234,49 @@ class Host(object):
         IP Whois lookups on each ip within self.ips
         Saved in each ip.whois_ip as dict, since this is how it is returned by ipwhois library.
         """
-        for ip1 in self.ips:
-            cidr_found = False
-
-            for ip2 in self.ips:
-                if cidr_found:
-                    break
-                if ip1!=ip2:
-                    for cidr in ip2.cidrs:
-                        if ipa.ip_address(unicode(ip1.ip)) in cidr:  # cidr already IPv4.Network obj
-                            # If cidr is already in Host, we won't call whois_ip again.
-                            # Note cidr already found is not saved in new ips, as it isn't really necessary
-                            ip1.whois_ip = ip2.whois_ip
-                            ip1.cidrs = ip2.cidrs
-                            cidr_found = True
-                            logging.info('Results for ' + str(ip1) + ' already found in ip ' + str(ip2) + '. CIDR is ' + str(cidr))
-                            break
-
-            if not cidr_found:
-                logging.debug('Performing Whois IP lookup for ' + str(ip1))
-                ip1.lookup_whois_ip()
-
         for ip in self.ips:
-            [self.cidrs.add(cidr) for cidr in ip.cidrs]
+            # IPs within a network already known to ip.whois_index won't be looked up again
+            logging.debug('Performing Whois IP lookup for ' + str(ip))
+            try:
+                ip.lookup_whois_ip()
+            except lookup.LookupFailed as e:
+                self.add_error(e)
+
+        self.cidrs = IP._remove_overlaping_cidrs(self.cidrs.union(*[ip.cidrs for ip in self.ips]))
         return self
 
     def lookup_shodan_all(self):
         """
-        Shodan lookups for each ip within self.ips.
+        Shodan lookups for each ip within self.ips, batched into as few queries as possible.
         Saved in ip.shodan as dict.
         """
-        for ip in self.ips:
-            ip.lookup_shodan()
+        if self.ips:
+            try:
+                results = lookup.shodan_hosts([ip.ip for ip in self.ips])
+            except lookup.LookupFailed as e:
+                self.add_error(e)
+                return self
+            for ip in self.ips:
+                ip.shodan = results.get(ip.ip)
         return self
 
     def add_related_host(self, new_host):
         self.related_hosts.add(new_host)
         self._add_to_subdomains_if_valid([new_host])
 
+    def add_error(self, error):
+        """Records error (e.g. a lookup.LookupFailed) of a lookup on self, so the rest of the scan goes on"""
+        logging.warning(str(error))
+        self.errors.append(error)
+
     def google_lookups(self):
         """Does all Google queries"""
 
-        self.google_linkedin_page()
-
-        self.lookup_google_subdomains()
+        for google_lookup in (self.google_linkedin_page, self.lookup_google_subdomains):
+            try:
+                google_lookup()
+            except lookup.LookupFailed as e:
+                self.add_error(e)
 
         return self
 
@@ -209,18 +291,20 @@ class Host(object):
         # Dict of subdomain_str:GoogleDomainResult for each subdomain found
         subdomains = lookup.google_subdomains(self.domain)
 
-        subdomains_as_hosts = set([])
-
-        for sub_str, google_results in subdomains.iteritems():
-                if sub_str == self.domain:
-                    self.urls = sorted(google_results.urls)
-                else:
-                    try:
-                        sub = Host(domain=sub_str).lookup_dns()
-                        sub.urls = google_results.urls
-                        subdomains_as_hosts.add(sub)
-                    except ValueError as e: # in case it can't be resolved
-                        pass
+        domain_key = HostRegistry.key(self.domain)
+        sub_strs = []
+        for sub_str, google_results in sorted(subdomains.iteritems()):
+            key = HostRegistry.key(sub_str)
+            if key == domain_key:
+                self.urls = sorted(google_results.urls)
+            else:
+                sub_strs.append(sub_str)
+                # Hosts from host_registry are shared with other targets, so urls are kept on self instead
+                urls = self.subdomain_urls.setdefault(key, {})
+                for proto, paths in google_results.urls.iteritems():
+                    urls.setdefault(proto, set()).update(paths)
+
+        subdomains_as_hosts = set(self._resolve_hosts(sub_strs))
 
         # Hold subdomains in self.google_subdomains
         self.google_subdomains.update(subdomains_as_hosts)
@@ -284,9 +368,10 @@ class Host(object):
         self.google_lookups()
 
     @staticmethod
-    def _print_domains(hosts):
+    def _print_domains(hosts, urls=None):
         # Static method that prints a list of domains with its respective ips and rev_domains
         # domains should be a list of Hosts
+        # urls, if passed, is a dict of normalised domain:urls to print instead of each host.urls
         if hosts:
             ret = ''
             for host in hosts:
@@ -297,9 +382,12 @@ class Host(object):
                 if ips:
                     ret = ''.join([ret, '\n\t', ips.replace('\n', '\n\t')])
 
-                urls = host.print_all_urls()
-                if urls:
-                    ret = ''.join([ret, '\n\t', urls.replace('\n','\n\t')])
+                if urls is None:
+                    host_urls = host.print_all_urls()
+                else:
+                    host_urls = Host._print_urls(host.domain, urls.get(HostRegistry.key(host.domain)))
+                if host_urls:
+                    ret = ''.join([ret, '\n\t', host_urls.replace('\n','\n\t')])
 
                 ret = ''.join([ret, '\n'])
 
@@ -314,18 +402,26 @@ class Host(object):
             return '\n'.join([str(cidr) for cidr in self.cidrs])
 
     def print_all_urls(self):
-        if self.urls:
+        return self._print_urls(self.domain, self.urls)
+
+    def print_subdomain_urls(self, sub):
+        # Print urls found in google for sub, a Host in self.subdomains
+        return self._print_urls(sub.domain, self.subdomain_urls.get(HostRegistry.key(sub.domain)))
+
+    @staticmethod
+    def _print_urls(domain, urls):
+        if urls:
             ret = ''
-            for proto, paths in self.urls.iteritems():
+            for proto, paths in urls.iteritems():
                 for path in sorted(paths):
-                    ret = ''.join([ret, '\n', proto, self.domain, path])
+                    ret = ''.join([ret, '\n', proto, domain, path])
             return ret.rstrip().lstrip()
 
     def print_subdomains(self):
-        return self._print_domains(sorted(self.subdomains, key=lambda x: x.domain))
+        return self._print_domains(sorted(self.subdomains, key=lambda x: x.domain), self.subdomain_urls)
 
     def print_google_subdomains(self):
-        return self._print_domains(sorted(self.google_subdomains, key=lambda x: x.domain))
+        return self._print_domains(sorted(self.google_subdomains, key=lambda x: x.domain), self.subdomain_urls)
 
     def print_all_ns(self):
         # Print all NS records
@@ -356,6 +452,43 @@ class Host(object):
         ret = [ip.print_shodan() for ip in self.ips if ip.shodan]
         return '\n'.join(ret).lstrip().rstrip()
 
+    def as_records(self):
+        """
+        Generator that yields a JSON Lines record (dict) for each IP within self.ips,
+        one for self, and one for each subdomain. Fields are taken straight from the
+        lookup results rather than the text printed.
+        """
+        for ip in self.ips:
+            yield ip.as_record(self)
+
+        yield {
+            'type': 'host',
+            'target': str(self),
+            'domain': self.domain,
+            'ips': [ip.ip for ip in self.ips],
+            'ns': [self._domain_record(ns) for ns in sorted(self.ns, key=lambda x: x.domain)],
+            'mx': [self._domain_record(mx) for mx in sorted(self.mx, key=lambda x: x.domain)],
+            'whois_domain': self.whois_domain,
+            'linkedin_page': self.linkedin_page,
+            'urls': self.urls,
+            'cidrs': sorted(str(cidr) for cidr in self.cidrs),
+            'errors': [str(error) for error in self.errors],
+        }
+
+        for sub in sorted(self.subdomains, key=lambda x: x.domain):
+            record = self._domain_record(sub)
+            record.update({
+                'type': 'subdomain',
+                'target': str(self),
+                'reverse_domains': [list(ip.rev_domains) for ip in sub.ips],
+                'urls': self.subdomain_urls.get(HostRegistry.key(sub.domain), {}),
+            })
+            yield record
+
+    @staticmethod
+    def _domain_record(host):
+        return {'domain': host.domain, 'ips': [ip.ip for ip in host.ips]}
+
     def print_as_csv_lines(self):
         """Generator that yields each IP within self.ips as a csv line."""
 
@@ -404,8 +537,9 @@ class Host(object):
                     else:
                         line.append('')
                     line += [ip.ip, ','.join(ip.rev_domains)]
-                    if sub.urls:
-                        line += [sub.print_all_urls()]
+                    urls = self.print_subdomain_urls(sub)
+                    if urls:
+                        line += [urls]
                     yield line
 
 
@@ -419,3 +553,87 @@ class Host(object):
                     ','.join([str(ip) for ip in host.ips]),
                     ','.join([','.join(ip.rev_domains) for ip in host.ips]),
                 ]
+
+
+class HostRegistry(object):
+    """
+    Hosts found by lookups during a run (NS and MX entries, and subdomains found in
+    Google), keyed by normalised domain. A domain that turns up for several targets,
+    e.g. a nameserver they share, is resolved once and the same Host is shared by
+    every target that found it.
+
+    The reverse domains of each IP of those hosts are kept as well, keyed by IP, so
+    they're not looked up again by other hosts or by network sweeps.
+
+    A domain being resolved by one thread is waited for by the others that need it,
+    instead of being resolved again. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self._hosts = {}
+        self._reverse_domains = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hosts)
+
+    @staticmethod
+    def key(domain):
+        return domain.rstrip('.').lower()
+
+    def resolve(self, domains):
+        """List of Host for each domain in domains, in the same order. Domains not seen before are resolved in bulk."""
+        keys = [self.key(domain) for domain in domains]
+
+        new = []
+        waiting = []
+        with self._lock:
+            for domain, key in zip(domains, keys):
+                if key in self._hosts:
+                    continue
+                elif key in self._pending:
+                    waiting.append(self._pending[key])
+                else:
+                    self._pending[key] = threading.Event()
+                    new.append(domain)
+            known = dict(self._reverse_domains)
+
+        try:
+            if new:
+                hosts = [Host(domain=domain, ips=ips) for domain, ips in lookup.bulk_resolve(new, 'A')]
+                Host._lookup_dns_rev_bulk(hosts, known)
+                with self._lock:
+                    for host in hosts:
+                        self._hosts[self.key(host.domain)] = host
+                        for ip in host.ips:
+                            self._reverse_domains[ip.ip] = ip.rev_domains
+        finally:
+            with self._lock:
+                for domain in new:
+                    self._pending.pop(self.key(domain)).set()
+
+        for event in waiting:
+            event.wait()
+
+        with self._lock:
+            missing = [domain for domain, key in zip(domains, keys) if key not in self._hosts]
+        if missing:
+            # The thread resolving them failed
+            self.resolve(missing)
+
+        with self._lock:
+            return [self._hosts[key] for key in keys]
+
+    def reverse_domains(self):
+        """Dict of str ip:list of reverse domains, for each IP of each Host in the registry"""
+        with self._lock:
+            return dict(self._reverse_domains)
+
+    def clear(self):
+        with self._lock:
+            self._hosts = {}
+            self._reverse_domains = {}
+
+# Shared by every Host in this process, i.e. for the whole run
+host_registry = HostRegistry()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+Reads the targets of a scan from argv, files and stdin, without holding more
+than a bounded number of them in memory.
+
+Targets are deduplicated with an external sort: up to sort_chunk_size unique
+targets are kept in memory at once, and each full chunk is written sorted to
+a temporary file, to be merged back with the others at the end. IPs and
+networks sort by address, so a network that's within another one that was
+passed (or an IP within one) comes right after it and can be dropped as it
+streams past, and no address is swept twice. Domains come after them, in
+alphabetical order.
+"""
+import cPickle as pickle
+import heapq
+import logging
+import socket
+import struct
+import sys
+import tempfile
+
+import ipaddress as ipa  # https://docs.python.org/3/library/ipaddress.html
+
+# Unique targets held in memory before a sorted run of them is written to a temporary file
+sort_chunk_size = 100000
+
+IP = 'ip'
+NETWORK = 'network'
+DOMAIN = 'domain'
+
+
+def read_lines(paths):
+    """
+    Generator of the targets in each file of paths, one per line, read lazily.
+    - reads stdin. Blank lines and anything after a # are skipped.
+    """
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path)
+        try:
+            for line in f:
+                line = line.split('#')[0].strip()
+                if line:
+                    yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def classify(text):
+    """
+    Returns (kind, canonical str) of target text, only from its syntax: IP for an address,
+    NETWORK for a range (e.g. 8.8.8.0/24, host bits are dropped), and DOMAIN for anything else.
+    """
+    key = _sort_key(text)
+    return key[5], key[6]
+
+
+def _sort_key(text):
+    """
+    Key of target text, that sorts IPs and networks by address (containing networks first),
+    and then domains: (0 for addresses 1 for domains, version, first address as int,
+    prefix length, last address as int, kind, canonical str)
+    """
+    text = text.strip()
+
+    # Addresses are only digits and dots, or have colons (IPv6), which domains never do
+    if ':' not in text and not text.replace('.', '').replace('/', '').isdigit():
+        return (1, 0, 0, 0, 0, DOMAIN, text.rstrip('.').lower())
+
+    if '/' not in text:
+        try:
+            # Much faster than ipa.ip_address, for what's usually the bulk of a long list
+            address = struct.unpack('!I', socket.inet_pton(socket.AF_INET, text))[0]
+            return (0, 4, address, 32, address, IP, socket.inet_ntoa(struct.pack('!I', address)))
+        except (socket.error, ValueError):
+            pass
+
+    try:
+        if '/' in text:
+            network = ipa.ip_network(unicode(text), strict=False)
+            kind = NETWORK
+        else:
+            network = ipa.ip_network(ipa.ip_address(unicode(text)))
+            kind = IP
+    except ValueError:
+        return (1, 0, 0, 0, 0, DOMAIN, text.rstrip('.').lower())
+
+    canonical = str(network) if kind == NETWORK else str(network.network_address)
+    return (0, network.version, int(network.network_address), network.prefixlen,
+            int(network.broadcast_address), kind, canonical)
+
+
+def _sorted_unique_keys(texts):
+    """
+    Generator of the _sort_key of each unique target in texts, in order.
+    At most sort_chunk_size of them are held in memory, the rest wait in temporary files.
+    """
+    chunk = set()
+    runs = []
+    try:
+        for text in texts:
+            if not text.strip():
+                continue
+            chunk.add(_sort_key(text))
+            if len(chunk) >= sort_chunk_size:
+                runs.append(_write_run(sorted(chunk)))
+                chunk = set()
+
+        if runs:
+            logging.info('Merging ' + str(len(runs)) + ' sorted runs of targets')
+        merged = heapq.merge(sorted(chunk), *[_read_run(run) for run in runs])
+
+        previous = None
+        for key in merged:
+            if key != previous:
+                yield key
+                previous = key
+    finally:
+        for run in runs:
+            run.close()
+
+
+def _write_run(keys):
+    run = tempfile.TemporaryFile()
+    for key in keys:
+        pickle.dump(key, run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            return
+
+
+def _collapse(keys):
+    """
+    Drops each key of an IP or network within a network right before it. keys must be in
+    the order _sorted_unique_keys yields them, as CIDR ranges either nest or don't overlap
+    at all, so only the last kept network is needed.
+    """
+    covering = None
+    for key in keys:
+        if key[0] == 0:
+            if covering is not None and covering[1] == key[1] and key[4] <= covering[4]:
+                logging.info('Skipping ' + key[6] + ', already within ' + covering[6])
+                continue
+            if key[5] == NETWORK:
+                covering = key
+        yield key
+
+
+def targets(texts):
+    """
+    Generator of (kind, canonical str) of each target to scan from texts: deduplicated, and
+    without IPs and networks within another network in texts, so no address is swept twice.
+    """
+    for key in _collapse(_sorted_unique_keys(texts)):
+        yield key[5], key[6]
@@ -1,12 +1,38 @@
 #!/usr/bin/env python
-import itertools
+import logging
 import sys
+import threading
 import time
 
 import ipaddress as ipa  # https://docs.python.org/3/library/ipaddress.html
 
 import lookup
 
+_lazy_lock = threading.Lock()
+
+def lazy_collection(slot, factory):
+    """
+    Property for a collection kept in slot, which is only created by factory the first time it's used.
+    Most Hosts and IPs never fill most of their collections, so this saves allocating them.
+    """
+    def getter(self):
+        try:
+            return getattr(self, slot)
+        except AttributeError:
+            # Lookups of one host can run concurrently, and must end up with the same collection
+            with _lazy_lock:
+                try:
+                    return getattr(self, slot)
+                except AttributeError:
+                    value = factory()
+                    setattr(self, slot, value)
+                    return value
+
+    def setter(self, value):
+        setattr(self, slot, value)
+
+    return property(getter, setter)
+
 class IP(object):
     """
     IP and information specific to it. Hosts contain multiple IPs,
@@ -20,6 +46,11 @@ class IP(object):
     shodan -- Dict containing Shodan results
     """
 
+    __slots__ = ('ip', 'rev_domains', '_whois_ip', '_cidrs', 'shodan', '_hash')
+
+    whois_ip = lazy_collection('_whois_ip', dict)
+    cidrs = lazy_collection('_cidrs', set)
+
     def __init__(self, ip, rev_domains=()):
 
         #Will raise an exception in case ip is not a valid address
@@ -27,19 +58,21 @@ class IP(object):
 
         self.ip = str(ip)
         self.rev_domains = rev_domains
-        self.whois_ip = {}
-        self.cidrs = set()
         self.shodan = None
+        self._hash = hash(('ip', self.ip))
 
     def __str__(self):
-        return str(self.ip)
+        return self.ip
 
     def __hash__(self):
-        return hash(('ip', self.ip))
+        return self._hash
 
     def __eq__(self, other):
         return self.ip == other.ip
 
+    def __ne__(self, other):
+        return not self == other
+
     def lookup_rev_dns(self):
         rev_domains = None
         rev_domains = lookup.reverse_dns(self.ip)
@@ -51,40 +84,68 @@ class IP(object):
         self.shodan = lookup.shodan(str(self))
 
     def lookup_whois_ip(self):
+        # Any network learned from a previous lookup, from any Host or Network, is reused
+        indexed = whois_index.lookup(self.ip)
+        if indexed:
+            cidr, self.whois_ip, self.cidrs = indexed
+            logging.info('Results for ' + str(self) + ' already found in whois index. CIDR is ' + str(cidr))
+            return self
+
         self.whois_ip = lookup.whois_ip(str(self))
 
         if self.whois_ip:
             if 'nets' in self.whois_ip:
                 if self.whois_ip['nets']:
                     cidrs = []
+                    address = ipa.ip_address(unicode(self.ip))
+                    # Cidrs of the most specific net containing self.ip, which is the one the results describe
+                    most_specific = []
+                    most_specific_prefixlen = -1
 
                     for net in self.whois_ip['nets']:
                         net_cidrs = [ipa.ip_network(unicode(cidr.rstrip().lstrip())) for cidr in net['cidr'].split(',') if cidr]
                         cidrs += net_cidrs
 
+                        for cidr in net_cidrs:
+                            if cidr.version == address.version and address in cidr and cidr.prefixlen > most_specific_prefixlen:
+                                most_specific = net_cidrs
+                                most_specific_prefixlen = cidr.prefixlen
+
                     self.cidrs = self._remove_overlaping_cidrs(cidrs)
+                    # Broader nets (e.g. the ISP's a customer's net is in) aren't indexed,
+                    # as other IPs in them may belong to someone else
+                    whois_index.add(most_specific, self.whois_ip, self.cidrs)
         return self
 
     @staticmethod
     def _remove_overlaping_cidrs(cidrs):
         """
         Takes list of cidrs and removes duplicates or overlapping networks.
+
+        Two CIDRs are either disjoint or one contains the other, so after sorting
+        by network address (largest network first on ties) any CIDR that starts
+        before the end of the last one kept is contained in it. O(n log n).
         """
-        cidrs = set(cidrs)
-        # iter_cidrs won't be changed because it is used for iteration
-        iter_cidrs = [i for i in cidrs]
-        for a,b in itertools.combinations(iter_cidrs, 2):
-            if a.overlaps(b):
-                to_be_removed = None
-                if a.num_addresses>=b.num_addresses:
-                    to_be_removed = b
-                else:
-                    to_be_removed = a
-                try:
-                    cidrs.remove(to_be_removed)
-                except ValueError:
-                    pass
-        return cidrs
+        ret = set()
+        last = None
+        for cidr in sorted(set(cidrs), key=lambda c: (c.version, int(c.network_address), c.prefixlen)):
+            if last and last.version == cidr.version and cidr.network_address <= last.broadcast_address:
+                continue
+            ret.add(cidr)
+            last = cidr
+        return ret
+
+    def as_record(self, target):
+        """Dict of everything known about self, as a JSON Lines record of target"""
+        return {
+            'type': 'ip',
+            'target': str(target),
+            'ip': self.ip,
+            'reverse_domains': list(self.rev_domains),
+            'whois_ip': self.whois_ip or None,
+            'shodan': self.shodan,
+            'cidrs': sorted(str(cidr) for cidr in self.cidrs),
+        }
 
     def print_ip(self):
         ret = str(self.ip)
@@ -167,3 +228,62 @@ class IP(object):
                         'Banner: {}'.format(item['data'].replace('\n', '\n\t').rstrip()),
                     ])
             return result.rstrip().lstrip()
+
+
+class WhoisIndex(object):
+    """
+    Longest prefix match index of every network learned from IP whois lookups,
+    so any IP within a known network gets its whois results without a new lookup.
+
+    Networks are kept in one dict per (version, prefix length), keyed by the
+    network address as an int. A lookup checks each prefix length present in the
+    index from the longest to the shortest, so its cost doesn't grow with the
+    number of networks.
+    """
+
+    def __init__(self):
+        self._networks = {}
+        self._prefixes = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(networks) for networks in self._networks.itervalues())
+
+    def add(self, cidrs, whois_ip, related_cidrs=None):
+        """
+        Indexes each ipa.IPv4Network/IPv6Network in cidrs, as holding whois_ip.
+        related_cidrs are the cidrs given back with each match (default is cidrs).
+        """
+        if related_cidrs is None:
+            related_cidrs = cidrs
+        with self._lock:
+            for cidr in cidrs:
+                prefix = (cidr.version, cidr.prefixlen)
+                if prefix not in self._networks:
+                    self._networks[prefix] = {}
+                    self._prefixes = sorted(self._networks, reverse=True)
+                self._networks[prefix][int(cidr.network_address)] = (cidr, whois_ip, related_cidrs)
+
+    def lookup(self, ip):
+        """
+        Returns (cidr, whois_ip, cidrs) for the most specific indexed network containing ip,
+        or None if ip isn't in any of them.
+        """
+        address = ipa.ip_address(unicode(ip))
+        address_int = int(address)
+
+        for version, prefixlen in self._prefixes:
+            if version != address.version:
+                continue
+            host_bits = address.max_prefixlen - prefixlen
+            match = self._networks[(version, prefixlen)].get(address_int >> host_bits << host_bits)
+            if match:
+                return match
+
+    def clear(self):
+        with self._lock:
+            self._networks = {}
+            self._prefixes = []
+
+# Shared by every IP in this process
+whois_index = WhoisIndex()
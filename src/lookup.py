@@ -3,27 +3,74 @@
 """
 Module wraps all lookups done by InstaRecon and returns results only.
 
-Raises lookup.NoInternetAccess.
+Lookups that fail because their provider can't be reached raise lookup.LookupFailed.
 
 """
+import collections
+import itertools
 import logging
-from random import randint, choice
+from random import uniform
 import re
 import socket
+import threading
 import time
 
+import dns.name
+import dns.rdatatype
 import dns.resolver
 import dns.reversename
 import ipaddress as ipa # https://docs.python.org/3/library/ipaddress.html
-import ipwhois as ipw # https://pypi.python.org/pypi/ipwhois
-import pythonwhois as whois # http://cryto.net/pythonwhois/usage.html https://github.com/joepie91/python-whois
-import requests
-import shodan  as shodan_api # https://shodan.readthedocs.org/en/latest/index.html
-
-dns_resolver = dns.resolver.Resolver()
-dns_resolver.timeout = 2
-dns_resolver.lifetime = 2
+
+import bulk_dns
+import cache
+import metrics
+import resilience
+from resolver_pool import ResolverPool
+import whois_client
+
+# Providers are imported the first time they're used, as importing all of them takes longer than
+# a short scan, and most runs only need some of them:
+# ipwhois - https://pypi.python.org/pypi/ipwhois
+# pythonwhois - http://cryto.net/pythonwhois/usage.html https://github.com/joepie91/python-whois
+# requests
+# shodan - https://shodan.readthedocs.org/en/latest/index.html
+
+
+class LazyResolver(object):
+    """
+    Stands in for a dns.resolver.Resolver, which is only created (reading resolv.conf)
+    when one of its attributes is first used, then gets or sets its attributes.
+
+    Keyword arguments:
+    settings -- attributes set on the Resolver once it's created e.g. timeout=2
+    """
+
+    def __init__(self, **settings):
+        object.__setattr__(self, '_settings', settings)
+        object.__setattr__(self, '_resolver', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def resolver(self):
+        with self._lock:
+            if self._resolver is None:
+                resolver = dns.resolver.Resolver()
+                for name, value in self._settings.iteritems():
+                    setattr(resolver, name, value)
+                object.__setattr__(self, '_resolver', resolver)
+            return self._resolver
+
+    def __getattr__(self, name):
+        return getattr(self.resolver(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolver(), name, value)
+
+dns_resolver = LazyResolver(timeout=2, lifetime=2)
 dns_maximum_retries = 3
+# Nameservers as (ip, port) set by configure_nameservers. If None, those of dns_resolver are used
+nameservers = None
+# Seconds after which a bulk query that wasn't answered is also sent to a second nameserver, or None not to
+dns_hedge_after = None
 dns_exceptions = (
     dns.resolver.NoAnswer,
     dns.resolver.NXDOMAIN,
@@ -34,10 +81,120 @@ dns_exceptions = (
 
 shodan_key = None
 
+# Number of DNS queries kept in flight by bulk_resolve and rev_dns_on_cidr
+rev_dns_workers = 100
+# Network sweeps are checkpointed in blocks of this prefix length
+sweep_block_prefix = 24
+
+# Google search endpoint, and how far google_subdomains goes in each round
+google_search_url = 'http://google.com/search'
+google_max_pages = 5
+# Google ignores anything after 32 words in a query, and site:*.domain is one of them
+google_max_excluded = 30
+# Times a blocked request is retried (after backing off) before giving up
+google_block_retries = 3
+
+# IPs in each Shodan host query made by shodan_hosts, and most pages of results fetched by shodan_net
+shodan_batch_size = 50
+shodan_max_pages = 10
+
+# Shared by every domain whois lookup, so each registrable domain is only looked up once per run
+domain_whois = whois_client.WhoisClient()
+
+# Connections kept alive for each host by the shared HTTP session
+http_pool_size = 10
+
 headers = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36',
 }
 
+_http_session = None
+_shodan_clients = {}
+_clients_lock = threading.Lock()
+_resolver_pool = None
+
+
+def http_session():
+    """
+    Returns the requests.Session shared by every HTTP lookup, so connections are
+    kept alive and reused instead of paying for a new TCP/TLS handshake each time.
+    headers are applied to it once. Sessions are fine to share between threads,
+    as urllib3 connection pools are thread safe.
+    """
+    import requests
+
+    global _http_session
+    with _clients_lock:
+        if _http_session is None:
+            _http_session = requests.Session()
+            _http_session.headers.update(headers)
+            _mount_pool(_http_session)
+        return _http_session
+
+def shodan_client():
+    """Returns a shodan_api.Shodan client for shodan_key, created once and shared between threads"""
+    import shodan as shodan_api
+
+    with _clients_lock:
+        client = _shodan_clients.get(shodan_key)
+        if client is None:
+            client = shodan_api.Shodan(shodan_key)
+            # Shodan client has its own requests.Session, which gets the same pool size
+            if hasattr(client, '_session'):
+                _mount_pool(client._session)
+            _shodan_clients[shodan_key] = client
+        return client
+
+def configure_http(pool_size=None):
+    """Sets the pool size of HTTP connections. Sessions and clients are recreated on next use."""
+    global http_pool_size, _http_session
+    with _clients_lock:
+        if pool_size:
+            http_pool_size = pool_size
+        _http_session = None
+        _shodan_clients.clear()
+
+def _mount_pool(session):
+    import requests.adapters
+
+    adapter = requests.adapters.HTTPAdapter(pool_connections=http_pool_size, pool_maxsize=http_pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+
+def configure_nameservers(servers, hedge_after=None):
+    """
+    Sets the nameservers every DNS lookup is spread across.
+
+    Keyword arguments:
+    servers -- List of (str ip, int port), e.g. from resolver_pool.parse_nameservers
+    hedge_after -- Float seconds after which a bulk query is also sent to a second nameserver, or None not to
+    """
+    global nameservers, dns_hedge_after
+    nameservers = list(servers)
+    dns_hedge_after = hedge_after
+    dns_resolver.nameservers = [ip for ip, _ in nameservers]
+
+def resolver_pool():
+    """
+    ResolverPool of the nameservers set by configure_nameservers, or else of dns_resolver.
+    The same pool, and what it learned about each server, is kept until the nameservers change.
+    """
+    global _resolver_pool
+    servers = nameservers or [(ns, dns_resolver.port) for ns in dns_resolver.nameservers]
+    with _clients_lock:
+        if _resolver_pool is None or _resolver_pool.servers != servers:
+            _resolver_pool = ResolverPool(servers)
+        return _resolver_pool
+
+def _server_resolver(server):
+    """dns.resolver.Resolver that only queries server, with the timeouts of dns_resolver"""
+    resolver = dns.resolver.Resolver(configure=False)
+    resolver.nameservers = [server[0]]
+    resolver.port = server[1]
+    resolver.timeout = dns_resolver.timeout
+    resolver.lifetime = dns_resolver.lifetime
+    return resolver
 
 def direct_dns(name):
     return dns_lookup_manager(name,'A') or None
@@ -46,27 +203,56 @@ def reverse_dns(ip, suppress_warning=False):
     return dns_lookup_manager(ip, 'PTR', suppress_warning) or None
 
 def mx_dns(name):
-    return [str(mx.exchange).rstrip('.') for mx in dns_lookup_manager(name,'MX')] or None
+    return [mx.rstrip('.') for mx in dns_lookup_manager(name,'MX')] or None
 
 def ns_dns(name):
-    return [str(ns).rstrip('.') for ns in dns_lookup_manager(name,'NS')] or None
+    return [ns.rstrip('.') for ns in dns_lookup_manager(name,'NS')] or None
 
 def dns_lookup_manager(target, lookup_type, suppress_warning=False):
+    """
+    Does DNS lookups of lookup_type (A, PTR, MX or NS) on target, on a nameserver picked by
+    resolver_pool. Timeouts are retried on another nameserver.
+    Returns list of str for each record (address, or domain name for PTR, MX and NS records).
+    Results are cached for as long as their TTL if the lookup cache is enabled.
+    Raises LookupFailed if every try timed out, or the DNS circuit is open.
+    """
+    cache_key = lookup_type + ' ' + target
+    records = cache.get('dns', cache_key)
+    if records is not cache.MISS:
+        metrics.record('dns', lookup_type, metrics.CACHED)
+        return records
+
+    circuit = _allow('dns', lookup_type, target)
+
+    pool = resolver_pool()
+    server = None
+    start = time.time()
     tries=0
     while tries < dns_maximum_retries:
+        server = pool.choose(exclude=(server,))
+        resolver = _server_resolver(server)
+        metrics.query('dns', lookup_type)
+        sent = time.time()
         try:
 
             if lookup_type == 'A':
-                return dns_resolver.query(target)
+                answer = resolver.query(target)
             
             elif lookup_type == 'PTR':
-                return dns_resolver.query(dns.reversename.from_address(target), 'PTR')
+                answer = resolver.query(dns.reversename.from_address(target), 'PTR')
             
             elif lookup_type == 'MX':
-                return dns_resolver.query(target, 'MX')
+                answer = resolver.query(target, 'MX')
 
             elif lookup_type == 'NS':
-                return dns_resolver.query(target, 'NS')
+                answer = resolver.query(target, 'NS')
+
+            pool.success(server, time.time() - sent)
+            records = _records_as_text(answer, lookup_type)
+            cache.put('dns', cache_key, records, answer.rrset.ttl if answer.rrset else None)
+            metrics.record('dns', lookup_type, metrics.OK, time.time() - start)
+            circuit.success()
+            return records
 
         except dns_exceptions as e:
             message = lookup_type + ' lookup failed for ' + target + ' - ' + str(e.__class__.__name__)
@@ -75,57 +261,293 @@ def dns_lookup_manager(target, lookup_type, suppress_warning=False):
             else:
                 logging.info(message)
 
+            if isinstance(e, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+                cache.put('dns', cache_key, [], cache.max_ages['dns_negative'])
+
+            if isinstance(e, dns.resolver.NXDOMAIN):
+                outcome = metrics.NXDOMAIN
+            elif isinstance(e, dns.resolver.NoAnswer):
+                outcome = metrics.NOANSWER
+            else:
+                outcome = metrics.ERROR
+
+            if isinstance(e, dns.resolver.NoNameservers):
+                # e.g. SERVFAIL or REFUSED
+                pool.failure(server, timed_out=False)
+            else:
+                pool.success(server, time.time() - sent)
+            metrics.record('dns', lookup_type, outcome, time.time() - start)
+            # The resolver answered, even if with nothing
+            circuit.success()
+
             # Needs to be here, as otherwise while will continue trying to scan the same host
-            return ()
+            return []
 
         except dns.exception.Timeout as e:
+            pool.failure(server)
             tries += 1
             if tries < dns_maximum_retries:
                 logging.info('Timeout resolving ' + target + '. Retrying.')
+                metrics.retry('dns', lookup_type)
+                time.sleep(resilience.backoff(tries - 1))
             else:
+                metrics.record('dns', lookup_type, metrics.TIMEOUT, time.time() - start)
+                circuit.failure()
                 logging.info(str(dns_maximum_retries)+ ' timeouts resolving ' + target + '. Internet connection alright?')
-                test_internet_connection()
-                logging.warning(lookup_type + ' lookup failed for ' + target + ' - ' + str(e.__class__.__name__))
-                return()
+                if not resilience.connectivity.online():
+                    raise LookupFailed('dns', target, lookup_type + ' - No internet access')
+                raise LookupFailed('dns', target, lookup_type + ' - ' + str(e.__class__.__name__))
+
+def _records_as_text(rdatas, lookup_type):
+    """Converts a dns.resolver.Answer or any iterable of rdata into a list of str, so it can be cached"""
+    if lookup_type == 'A':
+        return [rdata.address for rdata in rdatas]
+    elif lookup_type == 'MX':
+        return [rdata.exchange.to_text() for rdata in rdatas]
+    else:
+        return [rdata.target.to_text() for rdata in rdatas]
 
-def whois_domain(name):
-    try:
-        query = whois.get_whois(name)
-        if 'raw' in query:
-            return query['raw'][0].split('<<<')[0].lstrip().rstrip().encode('utf-8')
+def bulk_resolve(names, rdtype='A', in_flight=None):
+    """
+    Resolves many names at once through a bulk_dns.BulkResolver, keeping up to
+    in_flight queries (default is rev_dns_workers) in flight on the nameservers
+    of resolver_pool. names are IPs for PTR lookups.
 
-    except socket.gaierror as e:
-        logging.warning('Whois lookup failed for ' + name)
+    Yields (name, records) in the same order as names, where records is a list
+    of str as returned by dns_lookup_manager. Results go through the lookup cache.
+    """
+    resolver = bulk_dns.BulkResolver(
+        resolver_pool(),
+        timeout=dns_resolver.timeout,
+        retries=dns_maximum_retries,
+        max_in_flight=in_flight or rev_dns_workers,
+        hedge_after=dns_hedge_after,
+    )
 
-def whois_ip(ip):
-    if ip_is_valid(ip):
+    # Names answered by the cache are held here, in order, until the names queried before them are resolved
+    pending = collections.deque()
+
+    def queries():
+        for name in names:
+            records = cache.get('dns', rdtype + ' ' + name)
+            pending.append((name, records))
+            if records is cache.MISS:
+                try:
+                    qname = dns.reversename.from_address(name) if rdtype == 'PTR' else dns.name.from_text(name)
+                except (dns.exception.DNSException, ValueError) as e:
+                    logging.info(rdtype + ' lookup failed for ' + name + ' - ' + str(e.__class__.__name__))
+                    metrics.record('dns', rdtype, metrics.ERROR)
+                    pending[-1] = (name, [])
+                    continue
+                yield name, qname, dns.rdatatype.from_text(rdtype)
+            else:
+                metrics.record('dns', rdtype, metrics.CACHED)
+
+    connection_tested = False
+
+    for result in resolver.resolve(queries()):
+        while pending[0][1] is not cache.MISS:
+            yield pending.popleft()
+        name = pending.popleft()[0]
+
+        # bulk_dns statuses are the same as metrics outcomes
+        metrics.record('dns', rdtype, result.status, result.elapsed)
+        if result.tries > 1:
+            metrics.retry('dns', rdtype, result.tries - 1)
+        metrics.query('dns', rdtype, result.sent)
+
+        if result.status == bulk_dns.OK:
+            records = _records_as_text(itertools.chain(*result.rrsets), rdtype)
+            cache.put('dns', rdtype + ' ' + name, records, result.ttl)
+        else:
+            records = []
+            logging.info(rdtype + ' lookup failed for ' + name + ' - ' + result.status)
+            if result.status in (bulk_dns.NXDOMAIN, bulk_dns.NOANSWER):
+                cache.put('dns', rdtype + ' ' + name, records, cache.max_ages['dns_negative'])
+            elif result.status == bulk_dns.TIMEOUT and not connection_tested:
+                # Only logs, as the sweep goes on either way
+                resilience.connectivity.online()
+                connection_tested = True
+
+        yield name, records
+
+    while pending:
+        yield pending.popleft()
+
+def whois_domain(name):
+    """
+    Raw whois text for the registrable domain of name (e.g. example.co.uk for www.example.co.uk).
+    The raw text isn't parsed, as it's all that is printed. See whois_domain_parsed.
+    """
+    raw = _whois_registrable_domain(domain_whois.registrable_domain(name))
+    if raw:
+        return raw[0].split('<<<')[0].lstrip().rstrip().encode('utf-8')
+
+def whois_domain_parsed(name):
+    """Whois for the registrable domain of name, parsed by pythonwhois into a dict. Uses the same raw results as whois_domain."""
+    import pythonwhois as whois
+
+    raw = _whois_registrable_domain(domain_whois.registrable_domain(name))
+    if raw:
+        return whois.parse.parse_raw_whois(raw, normalized=True)
+
+@cache.cached('whois_domain')
+def _whois_registrable_domain(domain):
+    """List of raw whois responses for domain, most specific first"""
+    circuit = _allow('whois', 'domain', domain)
+    with metrics.timer('whois', 'domain') as timer:
         try:
-            return ipw.IPWhois(ip).lookup_whois()
+            ret = domain_whois.get_raw(domain)
+            circuit.success()
+            return ret
 
-        except ipw.WhoisLookupError as e:
-            raise KeyboardInterrupt
+        except socket.error as e:
+            timer.outcome = metrics.TIMEOUT if isinstance(e, socket.timeout) else metrics.ERROR
+            circuit.failure()
+            raise LookupFailed('whois', domain, str(e) or e.__class__.__name__)
 
-        except ipw.IPDefinedError as e:
-            logging.warning(e)
+        except whois_client.WhoisError as e:
+            timer.outcome = metrics.ERROR
+            logging.warning('Whois lookup failed for ' + domain + ' - ' + str(e))
+
+@cache.cached('whois_ip')
+def whois_ip(ip):
+    import ipwhois as ipw
+
+    if ip_is_valid(ip):
+        circuit = _allow('ipwhois', 'ip', ip)
+        with metrics.timer('ipwhois', 'ip') as timer:
+            try:
+                ret = ipw.IPWhois(ip).lookup_whois()
+                circuit.success()
+                return ret
+
+            except ipw.IPDefinedError as e:
+                timer.outcome = metrics.NOANSWER
+                logging.warning(e)
+
+            except _ipwhois_errors(ipw) as e:
+                # e.g. ASNRegistryError or HTTPLookupError when offline, as well as WhoisLookupError
+                timer.outcome = metrics.ERROR
+                circuit.failure()
+                raise LookupFailed('ipwhois', ip, e.__class__.__name__ + ' - ' + str(e))
     else:
         logging.warning('No Whois IP for ' + ip + ' as it doesn\'t seem to be an IP on the internet')
 
+def _ipwhois_errors(ipw):
+    """Base of the exceptions ipwhois raises (ipwhois >= 1.0), or a tuple of each of them in older versions"""
+    base = getattr(ipw.exceptions, 'BaseIpwhoisException', None)
+    if base is not None:
+        return base
+    return tuple(error for error in vars(ipw.exceptions).itervalues()
+                 if isinstance(error, type) and issubclass(error, Exception))
+
+@cache.cached('shodan')
 def shodan(ip):
     if ip_is_valid(ip):
+        return _shodan_request(lambda: shodan_client().host(str(ip)), ip, 'host')
+    else:
+        logging.warning('No Shodan for ' + ip + ' as it doesn\'t seem to be an IP on the internet')
+
+def shodan_hosts(ips):
+    """
+    Shodan lookups on many IPs, with one host query for each batch of shodan_batch_size IPs
+    instead of one per IP. Results are shared with shodan() through the lookup cache.
+
+    Returns dict of str ip: dict of Shodan results, for each IP Shodan has information on.
+    """
+    results = {}
+    to_lookup = []
+
+    for ip in ips:
+        ip = str(ip)
+        if not ip_is_valid(ip):
+            logging.warning('No Shodan for ' + ip + ' as it doesn\'t seem to be an IP on the internet')
+            continue
+        cached = cache.get('shodan', cache.key('shodan', ip))
+        if cached is not cache.MISS:
+            results[ip] = cached
+        elif ip not in to_lookup:
+            to_lookup.append(ip)
+
+    for i in range(0, len(to_lookup), shodan_batch_size):
+        batch = to_lookup[i:i + shodan_batch_size]
+        response = _shodan_request(lambda: shodan_client().host(batch), ', '.join(batch), 'host')
+
+        # Shodan returns a dict instead of a list when only one IP was found
+        if isinstance(response, dict):
+            response = [response]
+
+        for host in response or ():
+            results[host['ip_str']] = host
+            cache.put('shodan', cache.key('shodan', host['ip_str']), host)
+
+    return results
+
+@cache.cached('shodan')
+def shodan_net(cidr):
+    """
+    Shodan results for every host within cidr, from one paged net:<cidr> search
+    instead of a host query per IP. Banners are grouped by IP into dicts shaped
+    like the results of shodan(), although Shodan minifies search banners.
+
+    Returns dict of str ip: dict of Shodan results.
+    """
+    hosts = {}
+    page = 1
+
+    while page <= shodan_max_pages:
+        response = _shodan_request(lambda: shodan_client().search('net:' + str(cidr), page=page), str(cidr), 'search')
+        if not response or not response.get('matches'):
+            break
+
+        for banner in response['matches']:
+            host = hosts.setdefault(banner['ip_str'], {
+                'ip_str': banner['ip_str'],
+                'org': banner.get('org'),
+                'os': banner.get('os'),
+                'isp': banner.get('isp'),
+                'hostnames': banner.get('hostnames', []),
+                'data': [],
+            })
+            host['data'].append(banner)
+
+        # Shodan returns 100 results per page
+        if page * 100 >= response.get('total', 0):
+            break
+        page += 1
+
+    logging.info('Shodan found ' + str(len(hosts)) + ' hosts in ' + str(cidr) + ' with ' + str(page) + ' queries')
+    return hosts
+
+def _shodan_request(request, target, lookup_type):
+    """
+    Calls request, which does a Shodan query of lookup_type (host or search) on target,
+    handling errors the same way for every Shodan lookup
+    """
+    import shodan as shodan_api
+
+    circuit = _allow('shodan', lookup_type, target)
+    with metrics.timer('shodan', lookup_type) as timer:
         try:
-            api = shodan_api.Shodan(shodan_key)
-            return api.host(str(ip))
-        
+            ret = request()
+            circuit.success()
+            return ret
+
         except socket.gaierror as e:
-            logging.warning('Shodan lookup failed for ' + ip)
-        
+            timer.outcome = metrics.ERROR
+            circuit.failure()
+            raise LookupFailed('shodan', target, str(e))
+
         except shodan_api.exception.APIError as e:
             if e.value == u'Unable to connect to Shodan':
-                raise KeyboardInterrupt
-                # Other possible is 'No information available for that IP.' or 'Invalid API key'
+                timer.outcome = metrics.ERROR
+                circuit.failure()
+                raise LookupFailed('shodan', target, e.value)
+            # Shodan answered, e.g. 'No information available for that IP.' or 'Invalid API key'
+            circuit.success()
+            timer.outcome = metrics.NOANSWER if e.value.startswith('No information available') else metrics.ERROR
             logging.warning(e)
-    else:
-        logging.warning('No Shodan for ' + ip + ' as it doesn\'t seem to be an IP on the internet')
 
 def ip_is_valid(ip):
     ip = ipa.ip_address(unicode(ip))
@@ -138,74 +560,109 @@ def ip_is_valid(ip):
         ip.is_unspecified
     )
 
-def rev_dns_on_cidr(cidr):
+def rev_dns_on_cidr(cidr, workers=None):
     """
-    Reverse DNS lookups on each IP within a CIDR. cidrneeds to be ipa.IPv4Networks.
-    Yields valid ip, and then reverse_domains. Yields KeyboardInterrupt in case of KeyboardInterrupt.
+    Reverse DNS lookups on each IP within a CIDR. cidr needs to be ipa.IPv4Network.
+    Lookups are pipelined through bulk_resolve with up to workers queries in flight (default is rev_dns_workers).
+    Yields valid ip, and then reverse_domains, in address order.
     """
     if not isinstance(cidr, ipa.IPv4Network):
        raise ValueError
 
     else:
-        for ip in cidr:
-            lookup_result = None
+        for ip, lookup_result in bulk_resolve((str(ip) for ip in cidr), 'PTR', workers):
+            if lookup_result:
+                reverse_domains = [domain.rstrip('.') for domain in lookup_result]
+                yield ipa.ip_address(unicode(ip)), reverse_domains
 
-            lookup_result = reverse_dns(str(ip), suppress_warning=True)
+def sweep_blocks(cidr):
+    """Blocks of sweep_block_prefix (or cidr itself if it's smaller) that a sweep of cidr is checkpointed in"""
+    return list(cidr.subnets(new_prefix=max(cidr.prefixlen, sweep_block_prefix)))
+
+def rev_dns_on_blocks(cidr, workers=None, skip=(), known=None):
+    """
+    Same as rev_dns_on_cidr, but yields each block of sweep_blocks(cidr) once every address
+    within it was looked up, with a list of (valid ip, reverse_domains) found in it.
+    Blocks whose str is in skip aren't looked up. Lookups are pipelined across blocks.
+    IPs in known (dict of str ip:reverse domains already looked up) aren't queried again.
+    """
+    if not isinstance(cidr, ipa.IPv4Network):
+       raise ValueError
+
+    known = known or {}
+    blocks = [block for block in sweep_blocks(cidr) if str(block) not in skip]
+    results = bulk_resolve((ip for block in blocks for ip in itertools.imap(str, block) if ip not in known), 'PTR', workers)
+
+    for block in blocks:
+        found = []
+        for ip in itertools.imap(str, block):
+            if ip in known:
+                lookup_result = known[ip]
+            else:
+                lookup_result = next(results)[1]
             if lookup_result:
-                reverse_domains = [str(domain).rstrip('.') for domain in lookup_result]
-                yield ip, reverse_domains
+                found.append((ipa.ip_address(unicode(ip)), [domain.rstrip('.') for domain in lookup_result]))
+        yield block, found
 
+@cache.cached('google')
 def google_linkedin_page(name):
     """
     Uses a google query to find a possible LinkedIn page related to name (usually self.domain)
 
     Google query is "site:linkedin.com/company name", and first result is used
     """
-    request = 'http://google.com/search?num=10&q=site:linkedin.com/company%20"' + name + '"'
-    
-    try:
-        google_search = requests.get(request)
-        google_results = re.findall('<cite>(.+?)<\/cite>', google_search.text)
+    html = _google_search('site:linkedin.com/company "' + name + '"', num=10)
+
+    if html:
+        google_results = re.findall('<cite>(.+?)<\/cite>', html)
         for url in google_results:
             if 'linkedin.com/company/' in url:
                 return re.sub('<.*?>', '', url)
 
-    except requests.ConnectionError as e:
-        logging.warning(e)
-        test_internet_connection()
-
+@cache.cached('google')
 def google_subdomains(name):
     """
     This method uses google dorks to get as many subdomains from google as possible
     Returns a dictionary with key=str(subdomain), value=GoogleDomainResult object
+
+    Each round excludes the subdomains with most results found so far and pages
+    through the results, until a page brings no new url. Rounds stop as soon
+    as one of them adds no new subdomain, or if Google keeps blocking requests.
+    Results found before Google blocked requests are returned, but aren't cached.
     """
 
     google_results = {}
-    results_in_last_iteration = -1
-
-    while len(google_results) > results_in_last_iteration:
 
-        time.sleep(randint(0, 4) + randint(0, 1000) * 0.001)
+    while True:
+        results_before_round = len(google_results)
 
-        # Make this funct keep iterating until there are new results
-        results_in_last_iteration = len(google_results)
-
-        #Order google_results by .count, as we want only the top 8 subs with more results
+        # Order google_results by .count, as we want to exclude the subs with more results
         list_of_sub_ordered_by_count = sorted(google_results, key = lambda sub: google_results[sub].count, reverse=True)
-
-        google_results = _update_google_results(
-            _google_subdomain_lookup(
-                name,
-                [sub for sub in list_of_sub_ordered_by_count if sub != name],
-                100,
-                0
-            ),
-            google_results
-        )
-
-        logging.debug('New subdomain(s) found: ' + str(len(google_results)-len(list_of_sub_ordered_by_count)))
+        subs_to_avoid = [sub for sub in list_of_sub_ordered_by_count if sub != name][:google_max_excluded]
+
+        urls_seen = set()
+        start = 0
+        for page in range(google_max_pages):
+            urls = _google_subdomain_lookup(name, subs_to_avoid, 100, start)
+            if urls is None:
+                logging.debug('Finished google lookups early with '+str(len(google_results))+' subdomains discovered.')
+                return cache.Uncached(google_results)
+
+            # Last page reached, or Google is just repeating results
+            if not set(urls) - urls_seen:
+                break
+            urls_seen.update(urls)
+            # Google doesn't always honour num, so the next page starts after the results actually returned
+            start += len(urls)
+
+            google_results = _update_google_results(urls, google_results)
+
+        logging.debug('New subdomain(s) found: ' + str(len(google_results) - results_before_round))
         [logging.debug(sub + ' - ' + str(google_results[sub].count)) for sub in sorted(google_results, key = lambda sub: google_results[sub].count, reverse=True)]
 
+        if len(google_results) == results_before_round:
+            break
+
     logging.debug('Finished google lookups with '+str(len(google_results))+' subdomains discovered.')
 
     return google_results
@@ -253,33 +710,109 @@ def _google_subdomain_lookup(domain, subs_to_avoid=(), num=100, counter=0):
     Reaches out to google using the following query:
     site:*.domain -site:subdomain_to_avoid1 -site:subdomain_to_avoid2 -site:subdomain_to_avoid3...
 
-    Returns list of unique subdomain strings
-    """
-    request = ''.join([
-        'http://google.com/search?hl=en&meta=&num=',
-        str(num),
-        '&start=',
-        str(counter),
-        '&q=',
-        'site%3A%2A%2E',
-        domain,
-    ])
-    
-    logging.info('Subs removed from next query: ' + ', '.join(subs_to_avoid[:8]))
-
-    if subs_to_avoid:
-        for subdomain in subs_to_avoid[:8]:
-            request = ''.join([request, '%20%2Dsite%3A', str(subdomain)])
-
-    try:
+    counter is the index of the first result, for pagination.
+    Returns list of urls found, or None if Google couldn't be reached or is blocking requests.
+    """
+    logging.info('Subs removed from next query: ' + ', '.join(subs_to_avoid))
+
+    query = ' '.join(['site:*.' + domain] + ['-site:' + str(subdomain) for subdomain in subs_to_avoid])
+
+    html = _google_search(query, num, counter)
+
+    if html is not None:
         # Content within cite had url shortening features where '/.../' would appear in the middle of the url
-        #return re.findall('<cite>(.+?)<\/cite>', requests.get(request).text)
+        #return re.findall('<cite>(.+?)<\/cite>', html)
+
+        return re.findall('<h3 class\=\"r\"><a href=\"/url\?q\=(.+?)\&amp', html)
+
+def _google_search(query, num=100, start=0):
+    """
+    Does a Google search paced by google_pacer. Requests that get blocked are
+    retried up to google_block_retries times, each after google_pacer backs off.
+
+    Returns html of the results page, or None if it couldn't be retrieved.
+    """
+    import requests
+
+    params = {'hl': 'en', 'meta': '', 'num': num, 'start': start, 'q': query}
+    circuit = _allow('google', 'search', query)
+
+    for attempt in range(google_block_retries + 1):
+        google_pacer.wait()
+
+        # Each request is recorded, without the time spent waiting on google_pacer
+        request_start = time.time()
+        try:
+            response = http_session().get(google_search_url, params=params)
+
+        except requests.ConnectionError as e:
+            metrics.record('google', 'search', metrics.ERROR, time.time() - request_start)
+            circuit.failure()
+            raise LookupFailed('google', query, str(e))
+
+        if _google_is_blocking(response):
+            metrics.record('google', 'search', metrics.BLOCKED, time.time() - request_start)
+            if attempt < google_block_retries:
+                metrics.retry('google', 'search')
+            google_pacer.back_off()
+            logging.warning('Google seems to be blocking requests. Waiting ' + str(round(google_pacer.delay, 1)) + 's between requests.')
+            continue
+
+        metrics.record('google', 'search', metrics.OK, time.time() - request_start)
+        circuit.success()
+        google_pacer.speed_up()
+        return response.text
+
+    logging.error('Google kept blocking requests, giving up on query ' + query)
+
+def _google_is_blocking(response):
+    """Google answers with 429/503 or a CAPTCHA page (under /sorry/) when it thinks requests are automated"""
+    if response.status_code in (429, 503):
+        return True
+    if '/sorry/' in response.url:
+        return True
+    text = response.text
+    return 'unusual traffic from your computer network' in text or 'g-recaptcha' in text
+
+class Pacer(object):
+    """
+    Adaptive delay between requests to a provider, shared by every thread.
+
+    The delay shrinks while responses are healthy and grows exponentially when the
+    provider starts blocking requests. Each wait is jittered, so requests don't
+    arrive at regular intervals.
+
+    Keyword arguments:
+    delay -- Float seconds between requests to start with
+    min_delay -- Float lowest delay reached by speed_up
+    max_delay -- Float highest delay reached by back_off
+    """
+
+    def __init__(self, delay=2.0, min_delay=0.5, max_delay=120.0):
+        self.delay = delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._next_request = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            request_at = max(now, self._next_request)
+            self._next_request = request_at + self.delay * uniform(0.5, 1.5)
+        if request_at > now:
+            time.sleep(request_at - now)
+
+    def speed_up(self):
+        with self._lock:
+            self.delay = max(self.min_delay, self.delay * 0.8)
 
-        return re.findall('<h3 class\=\"r\"><a href=\"/url\?q\=(.+?)\&amp', requests.get(request).text)
-        
-    except requests.ConnectionError as e:
-        logging.warning(e)
-        test_internet_connection()
+    def back_off(self):
+        with self._lock:
+            self.delay = min(self.max_delay, max(self.delay, self.min_delay, 1.0) * 2)
+            self._next_request = time.time() + self.delay
+
+google_pacer = Pacer()
 
 class GoogleDomainResult(object):
     """
@@ -290,6 +823,9 @@ class GoogleDomainResult(object):
             Example - {'http://':{'/','/home','/test/asd.html'}}
     count -- Integer for how many times this was found in google
     """
+
+    __slots__ = ('urls', 'count')
+
     def __init__(self):
         self.urls = {}
         self.count = 0
@@ -298,27 +834,33 @@ class GoogleDomainResult(object):
         self.urls.setdefault(g_protocol, set()).add(g_pathname)
         self.count += 1
 
-def test_internet_connection():
-    '''
-    Reaches out to public well known DNS servers to check if machine has internet access.
-    This exists because sometimes you might get arbitraty timeouts as replies but have internet connection.
-
-    Raises NoInternetAccess if the test fails.
-    '''
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(2)
-    possible_targets = [
-        '8.8.8.8',
-        '8.8.4.4',
-        '139.130.4.5',
-    ]
-    try:
-        target = choice(possible_targets)
-        logging.info('Testing internet connection by trying to reach out to host ' + target)
-        s.connect((target,53))
-        s.close()
-    except (socket.timeout, socket.error, socket.gaierror) as e:
-        raise NoInternetAccess
-
-class NoInternetAccess(Exception):
-    pass
\ No newline at end of file
+def _allow(provider, lookup_type, target):
+    """
+    Returns the CircuitBreaker of provider.
+    Raises LookupFailed without doing the lookup if its circuit is open.
+    """
+    circuit = resilience.breaker(provider)
+    if not circuit.allow():
+        metrics.record(provider, lookup_type, metrics.SKIPPED)
+        raise LookupFailed(provider, target, 'skipped, too many recent failures')
+    return circuit
+
+class LookupFailed(Exception):
+    """
+    A lookup couldn't be done because its provider couldn't be reached, or it's
+    been failing. Only the target's own results are lost, so it's recorded on it.
+
+    Keyword arguments:
+    provider -- Str provider e.g. shodan
+    target -- Str target of the lookup
+    reason -- Str why it failed
+    """
+
+    def __init__(self, provider, target, reason):
+        Exception.__init__(self, provider, target, reason)
+        self.provider = provider
+        self.target = target
+        self.reason = reason
+
+    def __str__(self):
+        return self.provider + ' lookup failed for ' + str(self.target) + ' - ' + self.reason
\ No newline at end of file
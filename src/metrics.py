@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+Counters and latency histograms for every lookup, per provider and lookup type.
+
+Lookups report each call through metrics.record (or metrics.timer), retries
+through metrics.retry, and each query actually sent to a server through
+metrics.query. Everything is kept in memory in the process wide registry,
+and exported at the end of a run as JSON or Prometheus text format.
+"""
+import json
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets (Prometheus style, the last one is +Inf)
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+# Outcomes of a lookup
+OK = 'ok'
+NXDOMAIN = 'nxdomain'
+NOANSWER = 'noanswer'
+TIMEOUT = 'timeout'
+ERROR = 'error'
+BLOCKED = 'blocked'
+CACHED = 'cached'
+# Not done, as the provider's circuit breaker is open
+SKIPPED = 'skipped'
+
+
+class LookupMetrics(object):
+    """Call, outcome, retry and query counters and latency histogram of one provider and lookup type"""
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        # Requests sent on the wire, including retries and hedged copies. Cached lookups send none.
+        self.queries = 0
+        self.outcomes = {}
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * len(buckets)
+
+    def add(self, outcome, seconds):
+        self.calls += 1
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        if seconds is not None:
+            self.latency_sum += seconds
+            for i, bound in enumerate(buckets):
+                if seconds <= bound:
+                    self.latency_buckets[i] += 1
+                    break
+
+    def as_dict(self):
+        observed = sum(self.latency_buckets)
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'queries': self.queries,
+            'outcomes': dict(self.outcomes),
+            'latency': {
+                'count': observed,
+                'sum': round(self.latency_sum, 6),
+                'mean': round(self.latency_sum / observed, 6) if observed else None,
+                # Upper bound: count. Not cumulative, each bucket only counts latencies above the previous bound
+                'buckets': dict((_bound(bound), count) for bound, count in zip(buckets, self.latency_buckets)),
+            },
+        }
+
+
+class Registry(object):
+    """LookupMetrics for each (provider, lookup type), safe to share between threads"""
+
+    def __init__(self):
+        self.started = time.time()
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, provider, lookup_type):
+        key = (provider, lookup_type)
+        if key not in self._metrics:
+            self._metrics[key] = LookupMetrics()
+        return self._metrics[key]
+
+    def record(self, provider, lookup_type, outcome, seconds=None):
+        with self._lock:
+            self._get(provider, lookup_type).add(outcome, seconds)
+
+    def retry(self, provider, lookup_type, count=1):
+        with self._lock:
+            self._get(provider, lookup_type).retries += count
+
+    def query(self, provider, lookup_type, count=1):
+        with self._lock:
+            self._get(provider, lookup_type).queries += count
+
+    def as_dict(self):
+        with self._lock:
+            lookups = {}
+            for (provider, lookup_type), metrics in self._metrics.iteritems():
+                lookups.setdefault(provider, {})[lookup_type] = metrics.as_dict()
+        return {
+            'started': self.started,
+            'duration': round(time.time() - self.started, 6),
+            'lookups': lookups,
+        }
+
+    def as_prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = [
+            '# HELP instarecon_lookups_total Lookups done, by outcome.',
+            '# TYPE instarecon_lookups_total counter',
+        ]
+        with self._lock:
+            metrics = sorted(self._metrics.iteritems())
+
+            for (provider, lookup_type), m in metrics:
+                for outcome, count in sorted(m.outcomes.iteritems()):
+                    lines.append('instarecon_lookups_total' + _labels(provider, lookup_type, outcome=outcome) + ' ' + str(count))
+
+            lines += [
+                '# HELP instarecon_lookup_retries_total Lookups retried, e.g. after a timeout.',
+                '# TYPE instarecon_lookup_retries_total counter',
+            ]
+            for (provider, lookup_type), m in metrics:
+                lines.append('instarecon_lookup_retries_total' + _labels(provider, lookup_type) + ' ' + str(m.retries))
+
+            lines += [
+                '# HELP instarecon_lookup_queries_total Queries sent to servers, including retries and hedged copies.',
+                '# TYPE instarecon_lookup_queries_total counter',
+            ]
+            for (provider, lookup_type), m in metrics:
+                lines.append('instarecon_lookup_queries_total' + _labels(provider, lookup_type) + ' ' + str(m.queries))
+
+            lines += [
+                '# HELP instarecon_lookup_duration_seconds Time taken by each lookup.',
+                '# TYPE instarecon_lookup_duration_seconds histogram',
+            ]
+            for (provider, lookup_type), m in metrics:
+                cumulative = 0
+                for bound, count in zip(buckets, m.latency_buckets):
+                    cumulative += count
+                    lines.append('instarecon_lookup_duration_seconds_bucket' + _labels(provider, lookup_type, le=_bound(bound)) + ' ' + str(cumulative))
+                lines.append('instarecon_lookup_duration_seconds_sum' + _labels(provider, lookup_type) + ' ' + repr(m.latency_sum))
+                lines.append('instarecon_lookup_duration_seconds_count' + _labels(provider, lookup_type) + ' ' + str(cumulative))
+
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._metrics = {}
+            self.started = time.time()
+
+
+def _bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def _labels(provider, lookup_type, **extra):
+    labels = [('provider', provider), ('type', lookup_type)] + sorted(extra.items())
+    return '{' + ','.join('{}="{}"'.format(key, value) for key, value in labels) + '}'
+
+
+class timer(object):
+    """
+    Context manager that records a lookup with how long its block took.
+    The outcome is OK unless the block sets another one, or raises (ERROR).
+
+        with metrics.timer('google', 'search') as t:
+            ...
+            t.outcome = metrics.TIMEOUT
+    """
+
+    def __init__(self, provider, lookup_type):
+        self.provider = provider
+        self.lookup_type = lookup_type
+        self.outcome = OK
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.outcome = ERROR
+        record(self.provider, self.lookup_type, self.outcome, time.time() - self.start)
+
+
+# Shared by every lookup in this process
+registry = Registry()
+
+
+def record(provider, lookup_type, outcome, seconds=None):
+    registry.record(provider, lookup_type, outcome, seconds)
+
+
+def retry(provider, lookup_type, count=1):
+    registry.retry(provider, lookup_type, count)
+
+
+def query(provider, lookup_type, count=1):
+    registry.query(provider, lookup_type, count)
+
+
+def export(path):
+    """Writes metrics to path, in Prometheus text format if it ends with .prom or .txt, otherwise as JSON"""
+    with open(path, 'w') as f:
+        if path.endswith(('.prom', '.txt')):
+            f.write(registry.as_prometheus())
+        else:
+            json.dump(registry.as_dict(), f, indent=2, sort_keys=True)
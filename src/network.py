@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 import ipaddress as ipa  # https://docs.python.org/3/library/ipaddress.html
 
+import logging
+
+from ip import lazy_collection
+from sweep import SweepResults
 import lookup
 
 class Network(object):
@@ -9,9 +13,14 @@ class Network(object):
 
     Keywork arguments:
     cidr -- ipa.IPv4Network object
-    related_hosts -- set of valid Hosts found by scanning each cidr in cidrs
+    related_hosts -- SweepResults of valid hosts found by scanning cidr, iterated as Hosts
+    errors -- List of lookup.LookupFailed for each lookup that couldn't be done
     """
 
+    __slots__ = ('cidr', 'related_hosts', 'type', '_hash', '_errors')
+
+    errors = lazy_collection('_errors', list)
+
     def __init__(self, cidr):
         """
         cidr parameter should be an ipaddress.IPv4Network
@@ -20,31 +29,91 @@ class Network(object):
             raise ValueError
         # Raises ValueError if cidr is not a valid network
         self.cidr = ipa.ip_network(unicode(cidr), strict=False)
-        self.related_hosts = set()
+        self.related_hosts = SweepResults()
         self.type = 'network'
+        self._hash = hash(('cidr', self.cidr))
 
     def __str__(self):
         return str(self.cidr)
 
     def __hash__(self):
-        return hash(('cidr', self.cidr))
+        return self._hash
 
     def __eq__(self, other):
         return self.cidr == other.cidr
 
     def add_related_host(self, new_host):
-        self.related_hosts.add(new_host)
+        self.related_hosts.add_host(new_host)
+
+    def add_related_ip(self, ip, reverse_domains=()):
+        """Same as add_related_host, without building a Host for ip"""
+        self.related_hosts.add(ip, reverse_domains)
+
+    def add_error(self, error):
+        logging.warning(str(error))
+        self.errors.append(error)
+
+    def lookup_shodan(self):
+        """
+        Shodan results for every host in self.cidr, retrieved in bulk by lookup.shodan_net.
+        Saved in self.related_hosts, so it shows in ip.shodan of each related host.
+        Hosts Shodan knows about that had no reverse domain are added as well.
+        """
+        try:
+            results = lookup.shodan_net(self.cidr)
+        except lookup.LookupFailed as e:
+            self.add_error(e)
+            return self
+        for ip, shodan in results.iteritems():
+            self.related_hosts.set_shodan(ip, shodan)
+        return self
+
+    def print_all_shodan(self):
+        # Print Shodan entries of every related host, in address order
+        ret = [host.print_all_shodan() for host in self.related_hosts if host.ips[0].shodan]
+        return '\n\n'.join(ret)
+
+    def sweep_record(self, ip, reverse_domains):
+        """JSON Lines record of ip, found with reverse_domains while sweeping self"""
+        return {
+            'type': 'sweep_hit',
+            'target': str(self.cidr),
+            'ip': str(ip),
+            'reverse_domains': list(reverse_domains),
+        }
+
+    def as_records(self, sweep_hits=False):
+        """
+        Generator that yields a JSON Lines record for each related host with Shodan results,
+        followed by one for self. Sweep hits are recorded as they're found, see sweep_record,
+        so they're only yielded first if sweep_hits (e.g. for a network swept before resuming).
+        """
+        if sweep_hits:
+            for i in xrange(len(self.related_hosts)):
+                yield self.sweep_record(self.related_hosts.ip(i), self.related_hosts.reverse_domains(i))
+
+        for i in xrange(len(self.related_hosts)):
+            if self.related_hosts.addresses[i] in self.related_hosts.shodan:
+                yield self.related_hosts.host(i).ips[0].as_record(self)
+
+        yield {
+            'type': 'network',
+            'target': str(self.cidr),
+            'hosts': len(self.related_hosts),
+            'errors': [str(error) for error in self.errors],
+        }
 
     def print_as_csv_lines(self):
         """Overrides method from Host. Yields each Host in related_hosts as csv line"""
         yield ['Target: ' + str(self.cidr)]
 
         if self.related_hosts:
-            yield ['IP', 'Reverse domains', ]
+            yield ['IP', 'Reverse domains', 'Shodan']
             for host in self.related_hosts:
                 yield [
                     ', '.join([str(ip) for ip in host.ips]),
                     ', '.join([', '.join(ip.rev_domains) for ip in host.ips]),
+                    host.print_all_shodan(),
                 ]
         else:
             yield ['No results']
\ No newline at end of file
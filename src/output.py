@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Output helpers used by InstaRecon: per-thread stdout capture and streaming file writers.
+"""
+import csv
+import json
+import os
+import sys
+import threading
+from StringIO import StringIO
+
+
+class ThreadLocalStdout(object):
+    """
+    File-like object that replaces sys.stdout while targets are scanned concurrently.
+
+    Threads that called capture() have everything they print saved to their own
+    buffer, which is handed back by release(). Any other thread writes straight
+    through to the original stream.
+
+    Keyword arguments:
+    stream -- file-like object that is written to when a thread isn't capturing
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def capture(self):
+        self._local.buffer = StringIO()
+        self._local.softspace = 0
+
+    def release(self):
+        """Stops capturing output for the current thread and returns what was printed"""
+        buf = getattr(self._local, 'buffer', None)
+        self._local.buffer = None
+        return buf.getvalue() if buf else ''
+
+    def _current(self):
+        return getattr(self._local, 'buffer', None) or self.stream
+
+    def write(self, data):
+        self._current().write(data)
+
+    def writelines(self, lines):
+        self._current().writelines(lines)
+
+    def flush(self):
+        self.stream.flush()
+
+    # The print statement keeps track of spacing through the softspace attribute,
+    # which has to be per thread as well, otherwise concurrent prints affect each other
+    @property
+    def softspace(self):
+        return getattr(self._local, 'softspace', 0)
+
+    @softspace.setter
+    def softspace(self, value):
+        self._local.softspace = value
+
+
+class captured_stdout(object):
+    """
+    Context manager that installs a ThreadLocalStdout as sys.stdout and restores it on exit.
+    """
+
+    def __enter__(self):
+        self.original = sys.stdout
+        sys.stdout = ThreadLocalStdout(self.original)
+        return sys.stdout
+
+    def __exit__(self, *exc_info):
+        sys.stdout = self.original
+
+
+class CsvWriter(object):
+    """
+    Streams csv output to filename as targets finish, instead of building it all in memory.
+
+    The file is opened (and truncated) once, so an IOError is raised straight away
+    if it isn't writable. Rows for each target are flushed as soon as they are
+    written, so anything completed before a crash or Ctrl-C stays on disk.
+
+    Keyword arguments:
+    filename -- Str path of the csv file. ~ is expanded.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        self._file = open(self.filename, 'wb')
+        self._writer = csv.writer(self._file)
+        self._lock = threading.Lock()
+
+    def write_target(self, target):
+        """Writes target.print_as_csv_lines() followed by an empty separator line"""
+        with self._lock:
+            for line in target.print_as_csv_lines():
+                self._writer.writerow(line)
+            self._writer.writerow(['\n'])
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class JsonLinesWriter(object):
+    """
+    Streams records (dicts) to filename as JSON Lines, one object per line, flushed as
+    soon as each is written so whatever reads the file can keep up with the scan.
+
+    Keyword arguments:
+    filename -- Str path of the output file. ~ is expanded.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        self._file = open(self.filename, 'wb')
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = _json_line(record)
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def write_target(self, target):
+        """Writes each record of target.as_records()"""
+        self.write_records(target.as_records())
+
+    def write_records(self, records):
+        """Writes each record in records in one go, so other threads' records don't come in between"""
+        lines = ''.join(_json_line(record) for record in records)
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _json_line(record):
+    try:
+        return json.dumps(record, sort_keys=True, default=_json_default) + '\n'
+    except UnicodeDecodeError:
+        # Banners and whois text aren't always UTF-8
+        return json.dumps(record, sort_keys=True, default=_json_default, encoding='latin-1') + '\n'
+
+
+def _json_default(value):
+    """Sets become sorted lists, and anything else JSON doesn't know (e.g. ipaddress objects) a str"""
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return str(value)
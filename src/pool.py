@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Thread pool helpers used by InstaRecon to run blocking lookups concurrently.
+
+Lookups are network bound (DNS, whois, HTTP), so plain threads are enough.
+"""
+import logging
+import sys
+import threading
+from Queue import Queue, Empty
+
+# Seconds to block on a queue at a time. Queue.get() without a timeout
+# can't be interrupted by Ctrl-C in Python 2.
+_poll_interval = 0.5
+
+_stop = object()
+
+
+def imap_unordered(func, iterable, workers=10, window=None):
+    """
+    Generator that applies func to each item of iterable using up to workers threads.
+
+    Yields (item, result) tuples as soon as each call completes. At most window
+    items (default is 4 * workers) are handed to the workers at once, which
+    bounds how far ahead of the consumer they are allowed to go.
+
+    Exceptions raised by func are re-raised in the consumer when the
+    respective item is reached.
+    """
+    workers = max(1, int(workers))
+    window = max(workers, int(window or workers * 4))
+
+    tasks = Queue()
+    results = Queue()
+
+    def worker():
+        while True:
+            item = tasks.get()
+            if item is _stop:
+                return
+            try:
+                results.put((item, func(item), None))
+            except BaseException as e:
+                results.put((item, None, e))
+
+    threads = []
+    for _ in range(workers):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    iterator = iter(iterable)
+    done = 0
+    in_flight = 0
+    exhausted = False
+
+    try:
+        while True:
+            # Keep the window full
+            while not exhausted and in_flight < window:
+                try:
+                    tasks.put(next(iterator))
+                    in_flight += 1
+                except StopIteration:
+                    exhausted = True
+
+            if not in_flight:
+                break
+
+            try:
+                item, result, error = results.get(True, _poll_interval)
+            except Empty:
+                continue
+            in_flight -= 1
+            done += 1
+            if error is not None:
+                raise error
+            yield item, result
+
+    finally:
+        for _ in threads:
+            tasks.put(_stop)
+        # Idle workers exit straight away. Waiting for them avoids noisy
+        # tracebacks from daemon threads during interpreter shutdown.
+        if not in_flight:
+            for t in threads:
+                t.join()
+        logging.debug('Thread pool of ' + str(workers) + ' workers finished after ' + str(done) + ' items')
+
+
+def prefetch(iterable):
+    """
+    Generator that yields the items of iterable, which is iterated by a thread of its own
+    as fast as it can, so items are ready however slowly they're consumed. Exceptions
+    raised by iterable are re-raised in the consumer.
+    """
+    items = Queue()
+
+    def producer():
+        try:
+            for item in iterable:
+                items.put((item, None))
+            items.put((_stop, None))
+        except BaseException as e:
+            items.put((None, e))
+
+    t = threading.Thread(target=producer)
+    t.daemon = True
+    t.start()
+
+    while True:
+        try:
+            item, error = items.get(True, _poll_interval)
+        except Empty:
+            continue
+        if error is not None:
+            raise error
+        if item is _stop:
+            return
+        yield item
+
+
+def run_graph(tasks, workers=None):
+    """
+    Runs tasks that depend on each other concurrently, each in a thread of its own
+    as soon as every task it depends on is done. Blocks until all of them are done.
+
+    Keyword arguments:
+    tasks -- List of (str name, callable, list of str names of tasks it depends on)
+    workers -- Int maximum number of tasks running at once (default is all of them)
+
+    Tasks that depend on one that raised an exception are skipped. Once every
+    other task is done, the first exception raised is re-raised, with its traceback.
+    Returns list of names of the tasks that completed, in the order they did.
+    """
+    names = set(name for name, _, _ in tasks)
+    for name, _, depends_on in tasks:
+        for dependency in depends_on:
+            if dependency not in names:
+                raise ValueError('Task ' + name + ' depends on unknown task ' + dependency)
+
+    workers = max(1, int(workers or len(tasks) or 1))
+    waiting = list(tasks)
+    completed = []
+    failed = set()
+    error = None
+    running = 0
+    results = Queue()
+
+    def run(name, func):
+        try:
+            func()
+            results.put((name, None))
+        except BaseException:
+            results.put((name, sys.exc_info()))
+
+    while waiting or running:
+        # Tasks depending on a failed one can never run
+        for task in [task for task in waiting if failed.intersection(task[2])]:
+            waiting.remove(task)
+            failed.add(task[0])
+            logging.debug('Skipping task ' + task[0] + ' as a task it depends on failed')
+
+        for task in [task for task in waiting if all(dependency in completed for dependency in task[2])]:
+            if running >= workers:
+                break
+            waiting.remove(task)
+            t = threading.Thread(target=run, args=task[:2])
+            t.daemon = True
+            t.start()
+            running += 1
+
+        if not running:
+            if waiting:
+                raise ValueError('Tasks depend on each other in a cycle: ' + ', '.join(task[0] for task in waiting))
+            break
+
+        try:
+            name, exc_info = results.get(True, _poll_interval)
+        except Empty:
+            continue
+        running -= 1
+        if exc_info is None:
+            completed.append(name)
+        else:
+            failed.add(name)
+            error = error or exc_info
+
+    if error is not None:
+        raise error[0], error[1], error[2]
+    return completed
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Wall and CPU time of each phase of each target's scan, used by InstaRecon --profile.
+With --profile-stats, each phase also runs under cProfile, in whichever thread
+does it, and the stats of all of them are merged.
+
+CPU time is the CPU time of the thread doing the phase where the OS can tell
+(Linux), so targets scanned concurrently don't add to each other's. Elsewhere
+it's the CPU time of the whole process.
+"""
+import cProfile
+import pstats
+import resource
+import sys
+import threading
+import time
+
+# resource.RUSAGE_THREAD is missing from Python 2, but Linux supports it
+_rusage_thread = getattr(resource, 'RUSAGE_THREAD', 1 if sys.platform.startswith('linux') else None)
+
+
+def cpu_time():
+    """CPU time in seconds (user and system) used by the current thread, or the process if that isn't available"""
+    if _rusage_thread is not None:
+        usage = resource.getrusage(_rusage_thread)
+    else:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class PhaseProfiler(object):
+    """
+    Records wall and CPU time of each phase of each target. Safe to share between threads.
+
+    Keyword arguments:
+    records -- list of (str target, str phase, float wall seconds, float CPU seconds)
+    call_stats -- Bool, also run each phase under cProfile
+    stats -- pstats.Stats merged from the cProfile of every phase, or None until one is done
+    """
+
+    def __init__(self, call_stats=False):
+        self.records = []
+        self.call_stats = call_stats
+        self.stats = None
+        self._lock = threading.Lock()
+
+    def phase(self, target, name):
+        """Context manager that records the time its block takes as phase name of target"""
+        return _Phase(self, str(target), name)
+
+    def add(self, target, phase, wall, cpu):
+        with self._lock:
+            self.records.append((target, phase, wall, cpu))
+
+    def add_stats(self, profile):
+        """Merges profile (cProfile.Profile) of a phase into self.stats"""
+        profile.create_stats()
+        if not profile.stats:
+            # pstats can't load a profile without calls
+            return
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    def dump_stats(self, path):
+        """
+        Saves self.stats to path, to be read with pstats. Raises IOError if it can't be written.
+        Returns False without saving anything if no phase was profiled.
+        """
+        with self._lock:
+            if self.stats is None:
+                return False
+            self.stats.dump_stats(path)
+            return True
+
+    def phases(self):
+        """Returns list of (phase, calls, wall, cpu, max wall) in the order phases were first seen"""
+        totals = {}
+        order = []
+        with self._lock:
+            for _, phase, wall, cpu in self.records:
+                if phase not in totals:
+                    totals[phase] = [0, 0.0, 0.0, 0.0]
+                    order.append(phase)
+                total = totals[phase]
+                total[0] += 1
+                total[1] += wall
+                total[2] += cpu
+                total[3] = max(total[3], wall)
+        return [tuple([phase] + totals[phase]) for phase in order]
+
+    def targets(self):
+        """Returns list of (target, wall, cpu, dict of phase: wall), slowest first"""
+        totals = {}
+        with self._lock:
+            for target, phase, wall, cpu in self.records:
+                total = totals.setdefault(target, [0.0, 0.0, {}])
+                total[0] += wall
+                total[1] += cpu
+                total[2][phase] = total[2].get(phase, 0.0) + wall
+        return sorted([(target, wall, cpu, phases) for target, (wall, cpu, phases) in totals.iteritems()],
+                      key=lambda x: -x[1])
+
+    def summary(self, top=10):
+        """Table of the time taken by each phase, and by the top slowest targets"""
+        phases = self.phases()
+        if not phases:
+            return '# No phases were profiled'
+
+        lines = ['# Time by phase', '{:<12} {:>6} {:>10} {:>10} {:>10} {:>10}'.format(
+            'Phase', 'Calls', 'Wall (s)', 'CPU (s)', 'Mean (s)', 'Max (s)')]
+        for phase, calls, wall, cpu, max_wall in sorted(phases, key=lambda x: -x[2]):
+            lines.append('{:<12} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                phase, calls, wall, cpu, wall / calls, max_wall))
+
+        names = [phase[0] for phase in phases]
+        lines += ['', '# Slowest targets', ('{:<30} {:>10} {:>10}' + ' {:>12}' * len(names)).format(
+            'Target', 'Wall (s)', 'CPU (s)', *names)]
+        for target, wall, cpu, by_phase in self.targets()[:top]:
+            lines.append(('{:<30} {:>10.3f} {:>10.3f}' + ' {:>12}' * len(names)).format(
+                target[:30], wall, cpu, *['{:.3f}'.format(by_phase[name]) if name in by_phase else '-' for name in names]))
+
+        return '\n'.join(lines)
+
+
+class _Phase(object):
+    """Context manager returned by PhaseProfiler.phase"""
+
+    def __init__(self, profiler, target, name):
+        self.profiler = profiler
+        self.target = target
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.cpu = cpu_time()
+        if self.profiler.call_stats:
+            # cProfile only profiles the thread that enables it
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler.call_stats:
+            self.profile.disable()
+            self.profiler.add_stats(self.profile)
+        self.profiler.add(self.target, self.name, time.time() - self.wall, cpu_time() - self.cpu)
+
+
+class _NoPhase(object):
+    """Stands in for _Phase when not profiling"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+no_phase = _NoPhase()
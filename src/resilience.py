@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Keeps one failing provider or a flaky connection from taking a whole scan down.
+
+- CircuitBreaker: after failure_threshold consecutive failures, calls to a
+  provider are skipped for reset_timeout seconds, then one call is let through
+  to test it again.
+- backoff: exponential delays with full jitter between retries.
+- Connectivity: whether the machine can reach the internet, checked at most
+  once every ttl seconds and shared by every thread.
+"""
+import logging
+import random
+import socket
+import threading
+import time
+
+# Consecutive failures that open a provider's circuit, and seconds it stays open
+default_failure_threshold = 5
+default_reset_timeout = 30
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+def backoff(attempt, base=0.1, cap=2.0):
+    """Seconds to wait before retry number attempt (from 0): random between 0 and base * 2^attempt, at most cap"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker for one provider. Safe to share between threads.
+
+    Keyword arguments:
+    name -- Str name of the provider, used in logs
+    failure_threshold -- Int consecutive failures that open the circuit
+    reset_timeout -- Float seconds the circuit stays open before a call is let through again
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or default_failure_threshold
+        self.reset_timeout = reset_timeout or default_reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call can be made. Once reset_timeout passes, only the first caller gets through (half-open)."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                logging.info(self.name + ' circuit half-open, trying one lookup')
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info(self.name + ' is answering again, circuit closed')
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.time()
+                logging.warning(self.name + ' failed ' + str(self.failures) + ' times in a row, skipping its lookups for ' + str(self.reset_timeout) + 's')
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(provider):
+    """CircuitBreaker shared by every lookup of provider"""
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider)
+        return _breakers[provider]
+
+
+def reset():
+    """Closes every circuit and forgets the connectivity state"""
+    with _breakers_lock:
+        _breakers.clear()
+    connectivity.clear()
+
+
+class Connectivity(object):
+    """
+    Whether the internet can be reached, found by connecting to one of targets.
+    The answer is cached for ttl seconds, and threads asking while a check is
+    running wait for it instead of starting their own.
+
+    Keyword arguments:
+    targets -- List of (str host, int port) that are tried in random order, until one connects
+    ttl -- Float seconds a result is cached for
+    timeout -- Float seconds to wait for each connection
+    """
+
+    def __init__(self, targets, ttl=10, timeout=2):
+        self.targets = list(targets)
+        self.ttl = ttl
+        self.timeout = timeout
+        self._online = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def online(self):
+        with self._lock:
+            if self._online is None or time.time() - self._checked_at >= self.ttl:
+                self._online = self._check()
+                self._checked_at = time.time()
+            return self._online
+
+    def _check(self):
+        for target in random.sample(self.targets, len(self.targets)):
+            logging.info('Testing internet connection by trying to reach out to host ' + target[0])
+            try:
+                socket.create_connection(target, self.timeout).close()
+                return True
+            except socket.error:
+                continue
+        logging.warning('No internet access, couldn\'t reach any of ' + ', '.join(host for host, _ in self.targets))
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._online = None
+
+
+# Well known public DNS servers
+connectivity = Connectivity([('8.8.8.8', 53), ('8.8.4.4', 53), ('139.130.4.5', 53)])
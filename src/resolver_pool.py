@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+Pool of nameservers that DNS queries are spread across, weighted by how each
+one has been doing.
+
+Each server keeps a moving average of its latency and error rate, and is
+picked with probability inversely proportional to both, so fast healthy
+servers take most of the load while slower ones still get enough queries to
+notice if they get better. A server that times out eject_after times in a row
+is ejected for eject_time seconds, after which it's tried again (and ejected
+again straight away if that fails too).
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+import ipaddress as ipa  # https://docs.python.org/3/library/ipaddress.html
+
+# Weight of each new sample in the moving averages
+smoothing = 0.2
+# How much an error rate of 1 multiplies a server's expected latency by
+error_penalty = 10
+# Latency assumed for servers that haven't answered anything yet
+initial_latency = 0.05
+
+
+class ServerStats(object):
+    """Health of one nameserver in a ResolverPool"""
+
+    __slots__ = ('server', 'latency', 'error_rate', 'failures', 'ejected_until', 'queries', 'errors', 'ejections')
+
+    def __init__(self, server):
+        self.server = server
+        self.latency = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.ejected_until = 0
+        self.queries = 0
+        self.errors = 0
+        self.ejections = 0
+
+    def weight(self, default_latency):
+        latency = self.latency if self.latency is not None else default_latency
+        return 1.0 / (max(latency, 0.001) * (1 + error_penalty * self.error_rate))
+
+    def as_dict(self):
+        return {
+            'server': format_server(self.server),
+            'latency': round(self.latency, 6) if self.latency is not None else None,
+            'error_rate': round(self.error_rate, 4),
+            'queries': self.queries,
+            'errors': self.errors,
+            'ejections': self.ejections,
+        }
+
+
+class ResolverPool(object):
+    """
+    Nameservers that queries are spread across. Safe to share between threads.
+
+    Keyword arguments:
+    servers -- List of (str ip, int port) of each nameserver
+    eject_after -- Int consecutive timeouts after which a server is ejected
+    eject_time -- Float seconds an ejected server isn't queried for
+    """
+
+    def __init__(self, servers, eject_after=3, eject_time=30):
+        if not servers:
+            raise ValueError('No nameservers to query')
+        self.servers = list(servers)
+        self.eject_after = eject_after
+        self.eject_time = eject_time
+        self._stats = dict((server, ServerStats(server)) for server in self.servers)
+        self._lock = threading.Lock()
+
+    def choose(self, exclude=()):
+        """
+        Returns (ip, port) of the server to send the next query to, picked at random
+        weighted by latency and error rate among servers that aren't ejected or in exclude.
+        If every other server is ejected, the one that comes back the soonest is returned.
+        """
+        now = time.time()
+        with self._lock:
+            stats = [s for s in self._stats.itervalues() if s.server not in exclude] or self._stats.values()
+            healthy = [s for s in stats if s.ejected_until <= now]
+            if not healthy:
+                return min(stats, key=lambda s: s.ejected_until).server
+
+            known = [s.latency for s in self._stats.itervalues() if s.latency is not None]
+            default_latency = sum(known) / len(known) if known else initial_latency
+            weights = [s.weight(default_latency) for s in healthy]
+
+        pick = random.uniform(0, sum(weights))
+        for s, weight in zip(healthy, weights):
+            pick -= weight
+            if pick <= 0:
+                return s.server
+        return healthy[-1].server
+
+    def success(self, server, seconds):
+        """Records that server answered a query in seconds"""
+        with self._lock:
+            s = self._stats.get(server)
+            if s is None:
+                return
+            s.queries += 1
+            s.failures = 0
+            s.latency = seconds if s.latency is None else s.latency + smoothing * (seconds - s.latency)
+            s.error_rate -= smoothing * s.error_rate
+
+    def failure(self, server, timed_out=True):
+        """Records that server timed out, or answered with an error (e.g. SERVFAIL) if not timed_out"""
+        with self._lock:
+            s = self._stats.get(server)
+            if s is None:
+                return
+            s.queries += 1
+            s.errors += 1
+            s.error_rate += smoothing * (1 - s.error_rate)
+            if timed_out:
+                s.failures += 1
+                if s.failures >= self.eject_after and len(self._stats) > 1:
+                    s.ejected_until = time.time() + self.eject_time
+                    s.ejections += 1
+                    logging.warning('Nameserver ' + format_server(server) + ' timed out ' + str(s.failures) + ' times in a row, not querying it for ' + str(self.eject_time) + 's')
+
+    def ejected(self):
+        """List of servers currently ejected"""
+        now = time.time()
+        with self._lock:
+            return [s.server for s in self._stats.itervalues() if s.ejected_until > now]
+
+    def stats(self):
+        """List of dicts with the health of each server, in the order servers were given"""
+        with self._lock:
+            return [self._stats[server].as_dict() for server in self.servers]
+
+
+def parse_server(text, port=53):
+    """
+    Returns (ip, port) of a nameserver written as ip, ip:port or [ipv6]:port.
+    Raises ValueError if text isn't one of these, or port isn't between 1 and 65535.
+    """
+    text = text.strip()
+    if text.startswith('['):
+        host, _, rest = text[1:].partition(']')
+        if rest:
+            port = int(rest.lstrip(':'))
+    elif text.count(':') == 1:
+        host, port = text.split(':')
+        port = int(port)
+    else:
+        host = text
+    if not 0 < port < 65536:
+        raise ValueError('Port out of range in ' + text)
+    return str(ipa.ip_address(unicode(host))), port
+
+
+def parse_nameservers(values, port=53):
+    """
+    List of (ip, port) from values passed to -n. Each value is a comma separated list
+    of nameservers, or the path of a file with one nameserver per line (# starts a comment).
+    Duplicates are dropped. Raises ValueError if any of them isn't a valid nameserver.
+    """
+    servers = []
+    for value in values:
+        if os.path.isfile(value):
+            with open(value) as f:
+                entries = [line.split('#')[0] for line in f]
+        else:
+            entries = value.split(',')
+
+        for entry in entries:
+            if entry.strip():
+                server = parse_server(entry, port)
+                if server not in servers:
+                    servers.append(server)
+    return servers
+
+
+def format_server(server):
+    ip, port = server
+    if ':' in ip:
+        ip = '[' + ip + ']'
+    return ip if port == 53 else ip + ':' + str(port)
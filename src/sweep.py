@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Compact storage for the results of reverse DNS sweeps on networks.
+
+A /16 sweep can find tens of thousands of hosts, and a Host wrapping an IP
+for each of them carries empty sets and dicts for everything a domain scan
+fills in. SweepResults keeps only what a sweep finds: addresses packed as
+uint32 in an array, and reverse domains in a single byte buffer indexed by
+offsets. Host and IP objects are built on the fly when results are printed
+or exported.
+"""
+import array
+import bisect
+
+import ipaddress as ipa  # https://docs.python.org/3/library/ipaddress.html
+
+from host import Host
+
+
+class SweepResults(object):
+    """
+    IPv4 addresses found in a sweep, in address order, with their reverse domains and Shodan results.
+
+    Iterating yields a new Host for each address. Those are views: changes made
+    to them aren't saved, use add or set_shodan instead.
+
+    Keyword arguments:
+    addresses -- array of uint32 addresses, sorted
+    shodan -- dict of uint32 address:Shodan results, for addresses that have any
+    """
+
+    def __init__(self):
+        self.addresses = array.array('I')
+        # Reverse domains of addresses[i] are _names[_starts[i]:_ends[i]], separated by newlines
+        self._starts = array.array('I')
+        self._ends = array.array('I')
+        self._names = bytearray()
+        self.shodan = {}
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __nonzero__(self):
+        return len(self.addresses) > 0
+
+    def __iter__(self):
+        for i in xrange(len(self.addresses)):
+            yield self.host(i)
+
+    def __contains__(self, ip):
+        return self._index(self._pack(ip)) is not None
+
+    @staticmethod
+    def _pack(ip):
+        ip = ipa.ip_address(unicode(ip))
+        if ip.version != 4:
+            raise ValueError('Only IPv4 addresses can be stored in SweepResults')
+        return int(ip)
+
+    def _index(self, address):
+        i = bisect.bisect_left(self.addresses, address)
+        if i < len(self.addresses) and self.addresses[i] == address:
+            return i
+
+    def add(self, ip, reverse_domains=(), shodan=None):
+        """
+        Adds ip with its reverse domains. If ip was already added, reverse domains
+        are replaced when given, and shodan is set when given.
+        Sweeps add addresses in order, which is a plain append.
+        """
+        address = self._pack(ip)
+        i = self._index(address)
+
+        if i is None:
+            start = len(self._names)
+            self._names.extend('\n'.join(reverse_domains))
+            if not self.addresses or address > self.addresses[-1]:
+                self.addresses.append(address)
+                self._starts.append(start)
+                self._ends.append(len(self._names))
+            else:
+                i = bisect.bisect_left(self.addresses, address)
+                self.addresses.insert(i, address)
+                self._starts.insert(i, start)
+                self._ends.insert(i, len(self._names))
+
+        elif reverse_domains:
+            # Previous names stay in the buffer, which is fine as replacing them is rare
+            self._starts[i] = len(self._names)
+            self._names.extend('\n'.join(reverse_domains))
+            self._ends[i] = len(self._names)
+
+        if shodan is not None:
+            self.shodan[address] = shodan
+
+    def add_host(self, host):
+        """Adds each IP of host, with its reverse domains and Shodan results"""
+        for ip in host.ips:
+            self.add(ip.ip, ip.rev_domains, ip.shodan)
+
+    def set_shodan(self, ip, shodan):
+        self.add(ip, shodan=shodan)
+
+    def reverse_domains(self, i):
+        names = self._names[self._starts[i]:self._ends[i]]
+        return [str(name) for name in names.split('\n')] if names else []
+
+    def ip(self, i):
+        return str(ipa.IPv4Address(self.addresses[i]))
+
+    def host(self, i):
+        """New Host for the address at index i"""
+        host = Host(ips=[self.ip(i)], reverse_domains=self.reverse_domains(i))
+        host.ips[0].shodan = self.shodan.get(self.addresses[i])
+        return host
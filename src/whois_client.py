@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+Domain whois client used by lookup.whois_domain.
+
+Names are normalised to their registrable domain with the bundled public suffix
+list, so subdomains, NS and MX hosts of the same domain share a single lookup per
+run. Referrals are followed the same way pythonwhois does, but root servers are
+remembered per TLD, and each whois server gets a limited number of concurrent
+connections and a minimum interval between queries.
+
+Whois servers close the connection after each response (RFC 3912), so connections
+can't be kept alive. Limiting and pacing them per server is what keeps us from
+being throttled.
+
+Raises socket.error, socket.gaierror or WhoisError.
+"""
+import logging
+import os
+import re
+import socket
+import threading
+import time
+
+public_suffix_list_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'public_suffix_list.dat')
+
+# Sometimes IANA simply won't give us the right root WHOIS server (same as in pythonwhois)
+root_server_exceptions = {
+    '.ac.uk': 'whois.ja.net',
+    '.ps': 'whois.pnina.ps',
+    '.buzz': 'whois.nic.buzz',
+    '.moe': 'whois.nic.moe',
+}
+
+_referral = re.compile(r'(refer|whois server|referral url|registrar whois):\s*([^\s]+\.[^\s]+)', re.IGNORECASE)
+
+
+class WhoisError(Exception):
+    pass
+
+
+class PublicSuffixList(object):
+    """
+    Rules of the public suffix list (https://publicsuffix.org), used to find registrable domains.
+    Only the ICANN section is used, as private suffixes (e.g. herokuapp.com) are whois'd as regular domains.
+
+    Keyword arguments:
+    path -- Str path of public_suffix_list.dat
+    """
+
+    def __init__(self, path=public_suffix_list_path):
+        self.rules = set()
+        self.exceptions = set()
+
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('// ===END ICANN DOMAINS==='):
+                    break
+                if not line or line.startswith('//'):
+                    continue
+                rule = line.decode('utf-8').encode('idna') if '*' not in line else line
+                if rule.startswith('!'):
+                    self.exceptions.add(rule[1:])
+                else:
+                    self.rules.add(rule)
+
+    def public_suffix(self, name):
+        labels = name.lower().rstrip('.').split('.')
+
+        for i in range(len(labels)):
+            candidate = '.'.join(labels[i:])
+            if candidate in self.exceptions:
+                return '.'.join(labels[i + 1:])
+            if candidate in self.rules:
+                return candidate
+            if i + 1 < len(labels) and '*.' + '.'.join(labels[i + 1:]) in self.rules:
+                return candidate
+
+        # Unlisted TLDs are public suffixes as well
+        return labels[-1]
+
+    def registrable_domain(self, name):
+        """Returns the registrable domain of name e.g. www.example.co.uk -> example.co.uk, or None if name is a public suffix"""
+        name = name.lower().rstrip('.')
+        suffix = self.public_suffix(name)
+        if name == suffix:
+            return None
+        labels = name[:-len(suffix) - 1].split('.')
+        return '.'.join([labels[-1], suffix])
+
+
+class WhoisClient(object):
+    """
+    Whois client that looks up each registrable domain once, and shares the raw result.
+
+    Keyword arguments:
+    connections_per_server -- Int maximum concurrent connections to each whois server
+    server_interval -- Float minimum seconds between queries to the same whois server
+    timeout -- Float socket timeout in seconds
+    port -- Int port whois servers listen on
+    iana_server -- Str root server queried for the whois server of each TLD
+    """
+
+    def __init__(self, connections_per_server=2, server_interval=1.0, timeout=10, port=43, iana_server='whois.iana.org'):
+        self.connections_per_server = connections_per_server
+        self.server_interval = server_interval
+        self.timeout = timeout
+        self.port = port
+        self.iana_server = iana_server
+
+        self.suffixes = None
+        self._root_servers = {}
+        self._results = {}
+        self._servers = {}
+        self._lock = threading.Lock()
+
+    def registrable_domain(self, name):
+        if self.suffixes is None:
+            self.suffixes = PublicSuffixList()
+        return self.suffixes.registrable_domain(name) or name.lower().rstrip('.')
+
+    def get_raw(self, name):
+        """
+        Returns list of raw responses for the registrable domain of name, most specific first
+        (i.e. the last referral followed), like pythonwhois' raw results.
+        Concurrent calls for the same registrable domain wait for a single lookup.
+        """
+        domain = self.registrable_domain(name)
+
+        with self._lock:
+            entry = self._results.get(domain)
+            if entry is None:
+                entry = self._results[domain] = {'done': threading.Event()}
+                owner = True
+            else:
+                owner = False
+
+        if owner:
+            try:
+                entry['raw'] = self._lookup(domain)
+            except Exception as e:
+                # Hosts waiting on this lookup get the error, later ones will try again
+                entry['error'] = e
+                with self._lock:
+                    del self._results[domain]
+                raise
+            finally:
+                entry['done'].set()
+        else:
+            logging.debug('Whois for ' + name + ' shared with ' + domain)
+            entry['done'].wait()
+            if 'error' in entry:
+                raise entry['error']
+
+        return entry['raw']
+
+    def _lookup(self, domain):
+        if not isinstance(domain, unicode):
+            domain = domain.decode('utf-8')
+        domain = domain.encode('idna')
+        server = self._root_server(domain)
+        responses = []
+        servers_seen = set()
+
+        while server and server not in servers_seen:
+            servers_seen.add(server)
+            response = self.request(server, self._query_for(server, domain))
+
+            if server == 'whois.verisign-grs.com':
+                # VeriSign may return multiple records, only the one for domain is kept
+                for record in response.split('\n\n'):
+                    if re.search('Domain Name: %s\n' % domain.upper(), record):
+                        response = record
+                        break
+
+            responses.insert(0, response)
+            server = self._referral_server(response)
+
+        return responses
+
+    def _root_server(self, domain):
+        for exception, server in root_server_exceptions.iteritems():
+            if domain.endswith(exception):
+                return server
+
+        tld = domain.rsplit('.', 1)[-1]
+        with self._lock:
+            server = self._root_servers.get(tld)
+        if server:
+            return server
+
+        for line in self.request(self.iana_server, tld).splitlines():
+            match = re.match(r'refer:\s*([^\s]+)', line.strip())
+            if match:
+                server = match.group(1)
+                with self._lock:
+                    self._root_servers[tld] = server
+                return server
+
+        raise WhoisError('No root WHOIS server found for domain ' + domain)
+
+    @staticmethod
+    def _referral_server(response):
+        for line in response.splitlines():
+            match = _referral.match(line.strip())
+            # Anything that isn't WHOIS (e.g. HTTP) is ignored
+            if match and '://' not in match.group(2):
+                return match.group(2)
+
+    @staticmethod
+    def _query_for(server, domain):
+        if server == 'whois.jprs.jp':
+            return domain + '/e'  # Suppress Japanese output
+        elif domain.endswith('.de') and server in ('whois.denic.de', 'de.whois-servers.net'):
+            return '-T dn,ace ' + domain
+        elif server == 'whois.verisign-grs.com':
+            return '=' + domain  # Avoid partial matches
+        return domain
+
+    def request(self, server, query):
+        """Sends query to server, within its connection limit and pacing, and returns the response as unicode"""
+        slot, pacing = self._server(server)
+
+        with slot:
+            with pacing['lock']:
+                wait = pacing['next'] - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                pacing['next'] = time.time() + self.server_interval
+
+            logging.debug('Whois query for ' + query + ' on ' + server)
+            sock = socket.create_connection((server, self.port), self.timeout)
+            try:
+                sock.sendall(query + '\r\n')
+                chunks = []
+                while True:
+                    data = sock.recv(4096)
+                    if not data:
+                        break
+                    chunks.append(data)
+            finally:
+                sock.close()
+
+        return ''.join(chunks).decode('utf-8', 'replace')
+
+    def _server(self, server):
+        with self._lock:
+            if server not in self._servers:
+                self._servers[server] = (
+                    threading.BoundedSemaphore(self.connections_per_server),
+                    {'lock': threading.Lock(), 'next': 0},
+                )
+            return self._servers[server]
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+"""
+Local stand-ins for the services InstaRecon talks to, so lookups can be tested offline.
+"""
+import BaseHTTPServer
+import cgi
+import json
+import os
+import random
+import socket
+import SocketServer
+import struct
+import threading
+import time
+import urlparse
+
+import ipaddress
+
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+
+def synthetic_records(qname, rdtype):
+    """
+    Default zone of StubDNSServer:
+    PTR for any address -> host-a-b-c-d.example.com, A for any name -> 192.0.2.x,
+    MX and NS for any name, and Team Cymru's ASN TXT record (as used by ipwhois)
+    for any address under origin.asn.cymru.com. Names starting with nx return NXDOMAIN.
+    """
+    name = qname.to_text()
+    if name.startswith('nx'):
+        return None
+    if rdtype == dns.rdatatype.PTR:
+        octets = list(reversed(name.split('.in-addr.arpa')[0].split('.')))
+        return ['host-' + '-'.join(octets) + '.example.com.']
+    if rdtype == dns.rdatatype.A:
+        return ['192.0.2.' + str(sum(ord(c) for c in name) % 254 + 1)]
+    if rdtype == dns.rdatatype.MX:
+        return ['10 mx1.example.com.', '20 mx2.example.com.']
+    if rdtype == dns.rdatatype.NS:
+        return ['ns1.example.com.', 'ns2.example.com.']
+    if rdtype == dns.rdatatype.TXT and name.endswith('.origin.asn.cymru.com.'):
+        octets = list(reversed(name.split('.origin.asn.cymru.com')[0].split('.')))
+        return ['"64496 | ' + '.'.join(octets[:3]) + '.0/24 | US | arin | 2008-06-02"']
+    return []
+
+
+class StubDNSServer(object):
+    """
+    Stub authoritative DNS server on 127.0.0.1 (or address), over UDP and TCP on the same port.
+
+    Keyword arguments:
+    records -- function(qname, rdtype) returning list of rdata text, or None for NXDOMAIN
+    latency -- Float seconds each UDP response is delayed by
+    loss -- Float probability of dropping each UDP query
+    truncate -- set of str names that are answered over UDP with the TC flag set
+    ttl -- Int TTL of every record
+    address -- Str loopback address to listen on, e.g. ::1 for IPv6
+    spoof -- Bool, send UDP responses from another port, as a spoofed response would come from
+    """
+
+    def __init__(self, records=synthetic_records, latency=0, loss=0, truncate=(), ttl=300, address='127.0.0.1',
+                 spoof=False):
+        self.records = records
+        self.latency = latency
+        self.loss = loss
+        self.truncate = set(truncate)
+        self.ttl = ttl
+        self.queries = 0
+        self.tcp_queries = 0
+        self._lock = threading.Lock()
+
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        self.udp = socket.socket(family, socket.SOCK_DGRAM)
+        self.udp.bind((address, 0))
+        self.port = self.udp.getsockname()[1]
+
+        self.reply = self.udp
+        if spoof:
+            self.reply = socket.socket(family, socket.SOCK_DGRAM)
+            self.reply.bind((address, 0))
+
+        self.tcp = socket.socket(family, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind((address, self.port))
+        self.tcp.listen(16)
+
+        self._running = True
+        for target in (self._serve_udp, self._serve_tcp):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+
+    def _response(self, wire, tcp=False):
+        query = dns.message.from_wire(wire)
+        response = dns.message.make_response(query)
+        question = query.question[0]
+
+        if not tcp and question.name.to_text().rstrip('.') in self.truncate:
+            response.flags |= dns.flags.TC
+            return response.to_wire()
+
+        rdatas = self.records(question.name, question.rdtype)
+        if rdatas is None:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif rdatas:
+            response.answer.append(dns.rrset.from_text_list(
+                question.name, self.ttl, 'IN', question.rdtype, rdatas))
+        return response.to_wire()
+
+    def _serve_udp(self):
+        while self._running:
+            try:
+                wire, address = self.udp.recvfrom(65535)
+            except socket.error:
+                return
+            with self._lock:
+                self.queries += 1
+            if self.loss and random.random() < self.loss:
+                continue
+            response = self._response(wire)
+            if self.latency:
+                threading.Timer(self.latency, self._sendto, (response, address)).start()
+            else:
+                self._sendto(response, address)
+
+    def _sendto(self, response, address):
+        try:
+            self.reply.sendto(response, address)
+        except socket.error:
+            pass
+
+    def _serve_tcp(self):
+        while self._running:
+            try:
+                conn, _ = self.tcp.accept()
+            except socket.error:
+                return
+            try:
+                length = struct.unpack('!H', _recv_exactly(conn, 2))[0]
+                with self._lock:
+                    self.tcp_queries += 1
+                response = self._response(_recv_exactly(conn, length), tcp=True)
+                conn.sendall(struct.pack('!H', len(response)) + response)
+            except (socket.error, EOFError):
+                pass
+            finally:
+                conn.close()
+
+    def close(self):
+        self._running = False
+        self.udp.close()
+        self.reply.close()
+        self.tcp.close()
+
+
+def _recv_exactly(conn, length):
+    data = ''
+    while len(data) < length:
+        chunk = conn.recv(length - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def synthetic_whois(query):
+    """
+    Default responses of StubWhoisServer, which acts as the IANA root server, domain
+    registries and ARIN: TLD queries refer to localhost, ARIN queries (n + address)
+    get an ARIN style record for the /24 of address, and anything else gets a
+    domain record.
+    """
+    if query.startswith('n + '):
+        octets = query[len('n + '):].split('.')[:3]
+        network = '.'.join(octets)
+        return (
+            'NetRange:       ' + network + '.0 - ' + network + '.255\n'
+            'CIDR:           ' + network + '.0/24\n'
+            'NetName:        STUB-' + '-'.join(octets) + '\n'
+            'NetHandle:      NET-' + '-'.join(octets) + '-0-1\n'
+            'NetType:        Direct Assignment\n'
+            'OriginAS:       AS64496\n'
+            'RegDate:        2008-06-02\n'
+            'Updated:        2012-06-22\n'
+            '\n'
+            'OrgName:        Stub Networks\n'
+            'OrgId:          STUB\n'
+            'Address:        1 Example Street\n'
+            'City:           Example\n'
+            'StateProv:      CA\n'
+            'PostalCode:     90000\n'
+            'Country:        US\n'
+        )
+    if '.' not in query:
+        return 'domain:       ' + query.upper() + '\nrefer:        localhost\n'
+    return 'Domain Name: ' + query.upper() + '\nRegistrar: Stub Registrar\n\n>>> Last update <<<\n'
+
+
+class StubWhoisServer(object):
+    """
+    Stub whois server on 127.0.0.1.
+
+    Keyword arguments:
+    responses -- function(query) returning the response text
+    latency -- Float seconds each response is delayed by
+    """
+
+    def __init__(self, responses=synthetic_whois, latency=0):
+        self.responses = responses
+        self.latency = latency
+        self.queries = []
+        self._lock = threading.Lock()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+
+        self._running = True
+        t = threading.Thread(target=self._serve)
+        t.daemon = True
+        t.start()
+
+    def _serve(self):
+        while self._running:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            t = threading.Thread(target=self._answer, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def _answer(self, conn):
+        try:
+            query = ''
+            while not query.endswith('\r\n'):
+                chunk = conn.recv(1024)
+                if not chunk:
+                    return
+                query += chunk
+            query = query.strip()
+            with self._lock:
+                self.queries.append(query)
+
+            if self.latency:
+                time.sleep(self.latency)
+            conn.sendall(self.responses(query))
+        except socket.error:
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self._running = False
+        self.sock.close()
+
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(fixtures, name)) as f:
+        return f.read()
+
+
+class StubHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded HTTP server on 127.0.0.1 that answers GET requests with handler.
+
+    Keyword arguments:
+    handler -- function(path, params) returning (status, content_type, body).
+               params is a dict of query string parameters, with one value each.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = 0
+        self.connections = 0
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _StubHTTPRequestHandler)
+        self.port = self.server_address[1]
+        self.url = 'http://127.0.0.1:' + str(self.port)
+
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _StubHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Keep-alive, so connection reuse can be checked. Responses are written in one go,
+    # otherwise delayed ACKs add ~40ms to each request on a kept-alive connection
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict((key, values[-1]) for key, values in urlparse.parse_qs(url.query, keep_blank_values=True).iteritems())
+        self.server.requests += 1
+
+        status, content_type, body = self.server.handler(url.path, params)
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class GoogleStub(object):
+    """
+    Handler for StubHTTPServer that replays Google search result fixtures.
+
+    Results of site:*.domain queries are urls, ordered by how common their subdomain is,
+    minus those excluded with -site:. Each page has at most page_size of them.
+    The first block_first requests get a CAPTCHA page instead, as do those after block_after requests.
+
+    Keyword arguments:
+    urls -- list of str urls that can be found for the domain
+    page_size -- Int maximum results in each page, regardless of the num parameter
+    block_first -- Int number of requests answered with a CAPTCHA page
+    block_after -- Int number of requests answered before every other one gets a CAPTCHA page, or None
+    """
+
+    def __init__(self, urls, page_size=10, block_first=0, block_after=None):
+        self.urls = urls
+        self.page_size = page_size
+        self.block_first = block_first
+        self.block_after = block_after
+        self.requests = 0
+        self.page = read_fixture('google_results.html')
+        self.result = read_fixture('google_result.html')
+
+    def __call__(self, path, params):
+        self.requests += 1
+        if self.block_first or (self.block_after is not None and self.requests > self.block_after):
+            self.block_first = max(0, self.block_first - 1)
+            return 503, 'text/html', read_fixture('google_sorry.html')
+
+        terms = params.get('q', '').split()
+        excluded = set(term[len('-site:'):] for term in terms if term.startswith('-site:'))
+        start = int(params.get('start', 0))
+        num = min(int(params.get('num', 10)), self.page_size)
+
+        matches = [url for url in self.urls if urlparse.urlparse(url).hostname not in excluded]
+        results = ''.join(
+            self.result.format(url=url, title=cgi.escape(url), cite=cgi.escape(url))
+            for url in matches[start:start + num]
+        )
+        return 200, 'text/html', self.page.format(query=cgi.escape(params.get('q', '')), results=results)
+
+
+class ShodanStub(object):
+    """
+    Handler for StubHTTPServer that replays Shodan API JSON for host and search queries.
+
+    Keyword arguments:
+    ips -- list of str IPs Shodan has information on. Each gets the banner in shodan_banner.json.
+    """
+
+    def __init__(self, ips):
+        self.ips = ips
+        self.banner = read_fixture('shodan_banner.json')
+
+    def _host(self, ip):
+        banner = json.loads(self.banner.replace('{ip}', ip))
+        host = dict((key, banner[key]) for key in ('ip_str', 'org', 'isp', 'os', 'hostnames', 'asn'))
+        host['ports'] = [banner['port']]
+        host['data'] = [banner]
+        return host
+
+    def __call__(self, path, params):
+        if path == '/shodan/host/search':
+            network = ipaddress.ip_network(unicode(params['query'].split('net:')[1]))
+            matches = [ip for ip in self.ips if ipaddress.ip_address(unicode(ip)) in network]
+            page = int(params.get('page', 1))
+            body = {
+                'total': len(matches),
+                'matches': [self._host(ip)['data'][0] for ip in matches[(page - 1) * 100:page * 100]],
+            }
+        elif path.startswith('/shodan/host/'):
+            hosts = [self._host(ip) for ip in path[len('/shodan/host/'):].split(',') if ip in self.ips]
+            if not hosts:
+                body = {'error': 'No information available for that IP.'}
+            else:
+                body = hosts[0] if len(hosts) == 1 else hosts
+        else:
+            return 404, 'application/json', json.dumps({'error': 'Not found'})
+
+        return 200, 'application/json', json.dumps(body)
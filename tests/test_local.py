@@ -1,17 +1,36 @@
 #!/usr/bin/env python
 import itertools
+import json
 import logging
 import os
+import pstats
 import random
+import shutil
+import subprocess
 import sys
+import tempfile
+import time
+import traceback
 import unittest
 
 import ipaddress as ipa
 
-from src.host import Host
-from src.ip import IP
+from src.host import Host, host_registry
+from src.ip import IP, WhoisIndex, whois_index
 from src.network import Network
+from src.sweep import SweepResults
+import src.cache as cache
+import src.checkpoint as checkpoint
+import src.ingest as ingest
+import src.metrics as metrics
 import src.lookup as lookup
+import src.output as output
+import src.pool as pool
+import src.profiling as profiling
+import src.resilience as resilience
+import src.resolver_pool as resolver_pool
+import src.whois_client as whois_client
+from tests.stubs import GoogleStub, ShodanStub, StubDNSServer, StubHTTPServer, StubWhoisServer
 
 lookup.shodan_key = os.getenv('SHODAN_KEY')
 
@@ -125,11 +144,898 @@ class BNetworkTestCase(unittest.TestCase):
 
     def test_property_types(self):
         self.assertIsInstance(self.network.cidr, ipa.IPv4Network)
-        self.assertIsInstance(self.network.related_hosts, set)
+        self.assertIsInstance(self.network.related_hosts, SweepResults)
+
+    def test_related_hosts_packed_in_address_order(self):
+        network = Network('10.0.0.0/24')
+        network.add_related_ip(ipa.ip_address(u'10.0.0.9'), ['b.example.com', 'c.example.com'])
+        network.add_related_ip('10.0.0.20', ['d.example.com'])
+        network.related_hosts.set_shodan('10.0.0.3', {'ip_str': '10.0.0.3'})
+        network.add_related_host(Host(ips=['10.0.0.1'], reverse_domains=['a.example.com']))
+
+        self.assertEquals(len(network.related_hosts), 4)
+        self.assertIn('10.0.0.3', network.related_hosts)
+        hosts = list(network.related_hosts)
+        self.assertEquals([str(host) for host in hosts], ['10.0.0.1', '10.0.0.3', '10.0.0.9', '10.0.0.20'])
+        self.assertEquals(hosts[2].ips[0].rev_domains, ['b.example.com', 'c.example.com'])
+        self.assertEquals(hosts[1].ips[0].rev_domains, [])
+        self.assertEquals(hosts[1].ips[0].shodan, {'ip_str': '10.0.0.3'})
 
     # def test_reverse_dns_lookup(self):
     #     InstaRecon.reverse_dns_on_cidr(self.network)
     #     self.assertTrue(self.network.related_hosts)
 
+class DPoolTestCase(unittest.TestCase):
+
+    def test_imap_unordered_reraises_errors(self):
+        def fail_on_five(x):
+            if x == 5:
+                raise ValueError
+            return x
+
+        self.assertRaises(ValueError, list, pool.imap_unordered(fail_on_five, range(10), workers=4))
+
+    def test_imap_unordered_returns_everything(self):
+        results = pool.imap_unordered(lambda x: x + 1, range(100), workers=8)
+        self.assertEquals(sorted(result for _, result in results), range(1, 101))
+
+    def test_run_graph_respects_dependencies(self):
+        done = []
+
+        def task(name, delay=0.1):
+            def run():
+                time.sleep(delay)
+                done.append(name)
+            return run
+
+        start = time.time()
+        completed = pool.run_graph([
+            ('ips', task('ips'), []),
+            ('whois_ip', task('whois_ip'), ['ips']),
+            ('shodan', task('shodan'), ['ips']),
+            ('ns', task('ns'), []),
+            ('google', task('google', 0.2), []),
+        ])
+        # Longest chain is two tasks of 0.1s
+        self.assertLess(time.time() - start, 0.3)
+        self.assertEquals(set(completed), set(['ips', 'whois_ip', 'shodan', 'ns', 'google']))
+        self.assertTrue(done.index('ips') < done.index('whois_ip'))
+
+        def fail():
+            raise ValueError
+        self.assertRaises(ValueError, pool.run_graph, [('ips', fail, []), ('shodan', task('skipped'), ['ips']), ('ns', task('ns2'), [])])
+        time.sleep(0.05)
+        self.assertNotIn('skipped', done)
+        self.assertIn('ns2', done)
+
+        # The traceback goes back to where the task raised, not to run_graph
+        try:
+            pool.run_graph([('ips', fail, [])])
+        except ValueError:
+            self.assertEquals(traceback.extract_tb(sys.exc_info()[2])[-1][2], 'fail')
+        else:
+            self.fail('run_graph didn\'t re-raise')
+
+    def test_thread_local_stdout_keeps_blocks_apart(self):
+        with output.captured_stdout() as stdout:
+            def print_block(name):
+                stdout.capture()
+                for i in range(20):
+                    print name, i
+                    time.sleep(0.001)
+                return stdout.release()
+
+            blocks = dict(pool.imap_unordered(print_block, ['a', 'b', 'c'], workers=3))
+
+        for name, block in blocks.iteritems():
+            self.assertEquals(block, ''.join('{} {}\n'.format(name, i) for i in range(20)))
+
+class EOutputTestCase(unittest.TestCase):
+
+    def test_csv_writer_flushes_each_target(self):
+        network = Network('192.0.2.0/30')
+        network.add_related_host(Host(ips=['192.0.2.1'], reverse_domains=['a.example.com']))
+
+        with tempfile.NamedTemporaryFile() as f:
+            writer = output.CsvWriter(f.name)
+            writer.write_target(network)
+            # Readable before the writer is closed
+            self.assertIn('a.example.com', open(f.name).read())
+            writer.write_target(Network('198.51.100.0/30'))
+            writer.close()
+            self.assertIn('Target: 198.51.100.0/30', open(f.name).read())
+
+    def test_jsonl_records_from_lookup_results(self):
+        host = Host(domain='example.com', ips=['93.184.216.34'])
+        ip = host.ips[0]
+        ip.whois_ip = {'asn': '15133', 'nets': [{'cidr': '93.184.216.0/24'}]}
+        ip.cidrs = set([ipa.ip_network(u'93.184.216.0/24')])
+        ip.shodan = {'ip_str': '93.184.216.34', 'data': [{'port': 80, 'data': 'Server: caf\xe9'}]}
+        host.mx.add(Host(domain='mx.example.com', ips=['93.184.216.35']))
+        sub = Host(domain='www.example.com', ips=['93.184.216.36'])
+        host.subdomain_urls['www.example.com'] = {'http://': set(['/b', '/a'])}
+        host.subdomains.add(sub)
+        network = Network('192.0.2.0/30')
+
+        with tempfile.NamedTemporaryFile() as f:
+            writer = output.JsonLinesWriter(f.name)
+            writer.write(network.sweep_record(ipa.ip_address(u'192.0.2.1'), ['a.example.com']))
+            self.assertEquals(len(open(f.name).readlines()), 1)
+            writer.write_target(host)
+            writer.close()
+            records = [json.loads(line) for line in open(f.name)]
+
+        self.assertEquals([record['type'] for record in records], ['sweep_hit', 'ip', 'host', 'subdomain'])
+        self.assertEquals(records[1]['whois_ip']['asn'], '15133')
+        self.assertEquals(records[1]['cidrs'], ['93.184.216.0/24'])
+        self.assertEquals(records[1]['shodan']['data'][0]['port'], 80)
+        self.assertEquals(records[2]['mx'], [{'domain': 'mx.example.com', 'ips': ['93.184.216.35']}])
+        self.assertEquals(records[3]['urls'], {'http://': ['/a', '/b']})
+
+class FCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        cache.enable(os.path.join(self.directory, 'cache.sqlite'))
+
+    def tearDown(self):
+        cache.disable()
+        shutil.rmtree(self.directory)
+
+    def test_cached_lookup_runs_once(self):
+        calls = []
+
+        @cache.cached('whois_ip')
+        def fake_lookup(ip):
+            calls.append(ip)
+            return {'query': ip}
+
+        self.assertEquals(fake_lookup('192.0.2.1'), {'query': '192.0.2.1'})
+        self.assertEquals(fake_lookup('192.0.2.1'), {'query': '192.0.2.1'})
+        self.assertEquals(calls, ['192.0.2.1'])
+
+    def test_cache_option_doesnt_take_a_target(self):
+        stub = StubDNSServer()
+        try:
+            out = subprocess.check_output(
+                [sys.executable, 'scripts/instarecon.py', '-n', '127.0.0.1:' + str(stub.port), '--cache', '198.51.100.0/24'],
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                env=dict(os.environ, PYTHONPATH='.', HOME=self.directory))
+        finally:
+            stub.close()
+
+        self.assertIn('# Scanned 1/1 hosts', out)
+        self.assertEquals(stub.queries, 256)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, '.cache', 'instarecon', 'cache.sqlite')))
+
+    def test_negative_and_expired_entries(self):
+        cache.put('dns', 'A nx.example.com', [], 60)
+        self.assertEquals(cache.get('dns', 'A nx.example.com'), [])
+
+        cache.store.max_age = 0
+        cache.put('dns', 'A example.com', ['192.0.2.1'], 60)
+        self.assertIs(cache.get('dns', 'A example.com'), cache.MISS)
+
+class GWhoisIndexTestCase(unittest.TestCase):
+
+    def test_longest_prefix_match(self):
+        index = WhoisIndex()
+        index.add({ipa.ip_network(u'54.192.0.0/12')}, {'asn': 'wide'})
+        index.add({ipa.ip_network(u'54.206.0.0/16')}, {'asn': 'narrow'})
+
+        self.assertEquals(index.lookup('54.206.1.1')[1], {'asn': 'narrow'})
+        self.assertEquals(index.lookup('54.193.1.1')[1], {'asn': 'wide'})
+        self.assertIsNone(index.lookup('8.8.8.8'))
+        self.assertIsNone(index.lookup('2001:db8::1'))
+
+    def test_ips_reuse_indexed_whois(self):
+        cidrs = {ipa.ip_network(u'203.0.113.0/24')}
+        whois_index.add(cidrs, {'asn': '64496', 'nets': []})
+        try:
+            ip = IP('203.0.113.77').lookup_whois_ip()
+            self.assertEquals(ip.whois_ip['asn'], '64496')
+            self.assertEquals(ip.cidrs, cidrs)
+        finally:
+            whois_index.clear()
+
+    def test_only_most_specific_net_indexed(self):
+        queries = []
+
+        def whois_ip(ip):
+            queries.append(ip)
+            if ipa.ip_address(unicode(ip)) in ipa.ip_network(u'8.8.8.0/24'):
+                return {'asn': '15169', 'nets': [{'cidr': '8.0.0.0/9'}, {'cidr': '8.8.8.0/24'}]}
+            return {'asn': '3356', 'nets': [{'cidr': '8.0.0.0/9'}]}
+
+        saved = lookup.whois_ip
+        lookup.whois_ip = whois_ip
+        try:
+            google = IP('8.8.8.8').lookup_whois_ip()
+            self.assertEquals(google.cidrs, {ipa.ip_network(u'8.0.0.0/9')})
+            self.assertEquals(IP('8.8.8.9').lookup_whois_ip().whois_ip['asn'], '15169')
+            # Only within the parent net, so it isn't Google's
+            self.assertEquals(IP('8.1.2.3').lookup_whois_ip().whois_ip['asn'], '3356')
+            self.assertEquals(queries, ['8.8.8.8', '8.1.2.3'])
+        finally:
+            lookup.whois_ip = saved
+            whois_index.clear()
+
+class HBulkDNSTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubDNSServer(loss=0.05, truncate=['big.example.com'])
+        self.retries = lookup.dns_maximum_retries
+        lookup.dns_maximum_retries = 5
+        self.nameservers = lookup.dns_resolver.nameservers
+        self.port = lookup.dns_resolver.port
+        self.timeout = lookup.dns_resolver.timeout
+        lookup.dns_resolver.nameservers = ['127.0.0.1']
+        lookup.dns_resolver.port = self.stub.port
+        lookup.dns_resolver.timeout = 0.2
+
+    def tearDown(self):
+        self.stub.close()
+        lookup.dns_maximum_retries = self.retries
+        lookup.dns_resolver.nameservers = self.nameservers
+        lookup.dns_resolver.port = self.port
+        lookup.dns_resolver.timeout = self.timeout
+        host_registry.clear()
+
+    def test_bulk_resolve_keeps_order_and_retries(self):
+        names = ['host{}.example.com'.format(i) for i in range(300)] + ['nx.example.com', 'big.example.com']
+        results = list(lookup.bulk_resolve(names, 'A'))
+
+        self.assertEquals([name for name, _ in results], names)
+        self.assertEquals(dict(results)['nx.example.com'], [])
+        for name, records in results[:300:30] + results[-1:]:
+            self.assertEquals(records, lookup.direct_dns(name))
+        self.assertTrue(self.stub.tcp_queries)
+
+    def test_rev_dns_on_cidr(self):
+        results = list(lookup.rev_dns_on_cidr(ipa.ip_network(u'198.51.100.0/24'), 50))
+        self.assertEquals(len(results), 256)
+        self.assertEquals(results[5], (ipa.ip_address(u'198.51.100.5'), ['host-198-51-100-5.example.com']))
+
+    def test_ipv6_nameserver(self):
+        stub = StubDNSServer(address='::1', truncate=['big.example.com'])
+        lookup.dns_resolver.nameservers = ['127.0.0.1', '::1']
+        lookup.dns_resolver.port = stub.port
+        self.stub.close()
+        try:
+            names = ['host{}.example.com'.format(i) for i in range(20)] + ['big.example.com']
+            results = list(lookup.bulk_resolve(names, 'A'))
+            self.assertTrue(all(records for _, records in results))
+            self.assertTrue(stub.tcp_queries)
+        finally:
+            stub.close()
+
+    def test_responses_from_other_addresses_ignored(self):
+        stub = StubDNSServer(spoof=True)
+        lookup.dns_resolver.port = stub.port
+        lookup.dns_maximum_retries = 1
+        self.stub.close()
+        try:
+            results = list(lookup.bulk_resolve(['host{}.example.com'.format(i) for i in range(5)], 'A'))
+            self.assertEquals(stub.queries, 5)
+            self.assertFalse(any(records for _, records in results))
+        finally:
+            stub.close()
+
+    def test_host_ns_and_mx_resolved_in_bulk(self):
+        host = Host('example.com').lookup_dns().lookup_dns_ns().lookup_dns_mx()
+        self.assertEquals(sorted(ns.domain for ns in host.ns), ['ns1.example.com', 'ns2.example.com'])
+        for mx in host.mx:
+            self.assertTrue(mx.ips)
+            self.assertTrue(mx.ips[0].rev_domains[0].startswith('host-192-0-2-'))
+
+class IGoogleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # 25 subdomains, the first ones with far more urls than the last ones
+        urls = []
+        for i in range(25):
+            urls += ['http://sub{}.example.com/page{}'.format(i, j) for j in range(50 - 2 * i)]
+
+        self.google = GoogleStub(urls, page_size=10)
+        self.server = StubHTTPServer(self.google)
+        self.search_url = lookup.google_search_url
+        self.pacer = lookup.google_pacer
+        lookup.google_search_url = self.server.url + '/search'
+        lookup.google_pacer = lookup.Pacer(delay=0, min_delay=0, max_delay=0.05)
+
+    def tearDown(self):
+        self.server.close()
+        lookup.google_search_url = self.search_url
+        lookup.google_pacer = self.pacer
+
+    def test_subdomains_found_through_pagination(self):
+        results = lookup.google_subdomains('example.com')
+        self.assertEquals(sorted(results), sorted('sub{}.example.com'.format(i) for i in range(25)))
+        self.assertEquals(results['sub0.example.com'].urls['http://'], set('/page{}'.format(j) for j in range(50)))
+
+    def test_backs_off_when_blocked(self):
+        self.google.block_first = 2
+        results = lookup.google_subdomains('example.com')
+        self.assertEquals(self.google.block_first, 0)
+        self.assertEquals(len(results), 25)
+
+        self.google.block_first = lookup.google_block_retries + 1
+        self.assertEquals(lookup._google_subdomain_lookup('example.com'), None)
+
+    def test_partial_results_not_cached(self):
+        directory = tempfile.mkdtemp()
+        cache.enable(os.path.join(directory, 'cache.sqlite'))
+        try:
+            self.google.block_after = 3
+            partial = lookup.google_subdomains('example.com')
+            self.assertTrue(0 < len(partial) < 25)
+            self.assertIs(cache.get('google', cache.key('google_subdomains', 'example.com')), cache.MISS)
+
+            self.google.block_after = None
+            self.assertEquals(len(lookup.google_subdomains('example.com')), 25)
+            self.assertEquals(len(cache.get('google', cache.key('google_subdomains', 'example.com'))), 25)
+        finally:
+            cache.disable()
+            shutil.rmtree(directory)
+
+    def test_requests_share_pooled_connections(self):
+        lookup.configure_http()
+        results = list(pool.imap_unordered(
+            lambda page: lookup._google_subdomain_lookup('example.com', (), 10, page * 10), range(20), workers=4))
+
+        self.assertEquals(len(set(url for _, urls in results for url in urls)), 200)
+        self.assertLessEqual(self.server.connections, 4)
+
+class JShodanTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.ips = ['93.184.216.{}'.format(i) for i in range(1, 300, 2) if i < 256] + ['93.184.217.5']
+        self.server = StubHTTPServer(ShodanStub(self.ips))
+        self.shodan_key = lookup.shodan_key
+        lookup.shodan_key = 'test'
+        lookup.configure_http()
+        lookup.shodan_client().base_url = self.server.url
+
+    def tearDown(self):
+        self.server.close()
+        lookup.shodan_key = self.shodan_key
+        lookup.configure_http()
+
+    def test_network_shodan_in_one_paged_search(self):
+        network = Network('93.184.216.0/24')
+        network.add_related_host(Host(ips=['93.184.216.1'], reverse_domains=['a.example.com']))
+        network.lookup_shodan()
+
+        self.assertEquals(self.server.requests, 2)
+        self.assertEquals(len(network.related_hosts), 128)
+        for host in network.related_hosts:
+            self.assertEquals(host.ips[0].shodan['ip_str'], str(host.ips[0]))
+        self.assertIn('Port: 80', network.print_all_shodan())
+
+    def test_host_shodan_batched(self):
+        host = Host(ips=['93.184.216.1'])
+        host.ips += [IP(ip) for ip in ['93.184.216.3', '93.184.216.4', '93.184.217.5']]
+        host.lookup_shodan_all()
+
+        self.assertEquals(self.server.requests, 1)
+        self.assertEquals([bool(ip.shodan) for ip in host.ips], [True, True, False, True])
+
+class KWhoisTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubWhoisServer(latency=0.05)
+        self.client = lookup.domain_whois
+        lookup.domain_whois = whois_client.WhoisClient(server_interval=0, port=self.server.port, iana_server='127.0.0.1')
+
+    def tearDown(self):
+        self.server.close()
+        lookup.domain_whois = self.client
+
+    def test_registrable_domains(self):
+        suffixes = whois_client.PublicSuffixList()
+        self.assertEquals(suffixes.registrable_domain('www.example.co.uk'), 'example.co.uk')
+        self.assertEquals(suffixes.registrable_domain('a.b.example.com.'), 'example.com')
+        self.assertEquals(suffixes.registrable_domain('a.b.c.kawasaki.jp'), 'b.c.kawasaki.jp')
+        self.assertEquals(suffixes.registrable_domain('city.kawasaki.jp'), 'city.kawasaki.jp')
+        self.assertEquals(suffixes.registrable_domain('co.uk'), None)
+
+    def test_one_lookup_per_registrable_domain(self):
+        names = ['example.com', 'www.example.com', 'ns1.example.com', 'mx.mail.example.com', 'example.org']
+        raw = dict(pool.imap_unordered(lookup.whois_domain, names, workers=5))
+        results = [raw[name] for name in names]
+
+        self.assertTrue(results[0].startswith('Domain Name: EXAMPLE.COM\nRegistrar: Stub Registrar'))
+        self.assertEquals(len(set(results[:4])), 1)
+        self.assertEquals(sorted(self.server.queries), ['com', 'example.com', 'example.org', 'org'])
+        self.assertEquals(lookup.whois_domain_parsed('www.example.org')['registrar'], ['Stub Registrar'])
+
+class LHostSlotsTestCase(unittest.TestCase):
+
+    def test_identity_and_lazy_collections(self):
+        host = Host(ips=['10.0.0.1'], reverse_domains=['a.example.com'])
+        self.assertEquals(host, Host(ips=['10.0.0.1']))
+        self.assertNotEquals(host, Host(ips=['10.0.0.2']))
+        self.assertEquals(len(set([host, Host(ips=['10.0.0.1']), Host('example.com', ips=['10.0.0.1'])])), 2)
+
+        host.ips += [IP('10.0.0.2')]
+        self.assertEquals(host, Host(ips=['10.0.0.1', '10.0.0.2']))
+        self.assertEquals(hash(host), hash(Host(ips=['10.0.0.1', '10.0.0.2'])))
+
+        self.assertFalse(hasattr(host, '__dict__'))
+        self.assertFalse(hasattr(host, '_subdomains'))
+        host.subdomains.add(Host('www.example.com', ips=['10.0.0.3']))
+        self.assertEquals(len(host.subdomains), 1)
+        self.assertFalse(hasattr(host.ips[0], '_cidrs'))
+
+class MStartupTestCase(unittest.TestCase):
+
+    def test_providers_imported_lazily(self):
+        loaded = subprocess.check_output([sys.executable, '-c', (
+            'import sys, src.lookup\n'
+            'print sorted(m for m in ("ipwhois", "pythonwhois", "requests", "shodan") if m in sys.modules)\n'
+            'print src.lookup.dns_resolver._resolver'
+        )])
+        self.assertEquals(loaded.split(), ['[]', 'None'])
+
+class NMetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubDNSServer()
+        self.nameservers = lookup.dns_resolver.nameservers
+        self.port = lookup.dns_resolver.port
+        lookup.dns_resolver.nameservers = ['127.0.0.1']
+        lookup.dns_resolver.port = self.stub.port
+        metrics.registry.clear()
+
+    def tearDown(self):
+        self.stub.close()
+        lookup.dns_resolver.nameservers = self.nameservers
+        lookup.dns_resolver.port = self.port
+        metrics.registry.clear()
+
+    def test_dns_outcomes_counted(self):
+        list(lookup.bulk_resolve(['a.example.com', 'nx.example.com', 'b.example.com'], 'A'))
+        lookup.dns_lookup_manager('nx2.example.com', 'MX', suppress_warning=True)
+
+        lookups = metrics.registry.as_dict()['lookups']['dns']
+        self.assertEquals(lookups['A']['outcomes'], {'ok': 2, 'nxdomain': 1})
+        self.assertEquals(lookups['A']['latency']['count'], 3)
+        self.assertEquals(lookups['MX']['outcomes'], {'nxdomain': 1})
+
+        text = metrics.registry.as_prometheus()
+        self.assertIn('instarecon_lookups_total{provider="dns",type="A",outcome="ok"} 2', text)
+        self.assertIn('instarecon_lookup_duration_seconds_bucket{provider="dns",type="A",le="+Inf"} 3', text)
+
+class OProfilingTestCase(unittest.TestCase):
+
+    def test_phases_and_slowest_targets(self):
+        profiler = profiling.PhaseProfiler()
+        for target, delay in (('fast.example.com', 0), ('slow.example.com', 0.05)):
+            with profiler.phase(target, 'dns'):
+                time.sleep(delay)
+            with profiler.phase(target, 'whois'):
+                sum(range(10000))
+
+        self.assertEquals([phase[:2] for phase in profiler.phases()], [('dns', 2), ('whois', 2)])
+        targets = profiler.targets()
+        self.assertEquals(targets[0][0], 'slow.example.com')
+        self.assertGreaterEqual(targets[0][3]['dns'], 0.05)
+        self.assertLess(targets[0][2], targets[0][1])
+
+        summary = profiler.summary().splitlines()
+        self.assertTrue(summary[2].startswith('dns'))
+        self.assertTrue(summary[-2].startswith('slow.example.com'))
+
+    def test_call_stats_of_phases_in_threads(self):
+        profiler = profiling.PhaseProfiler(call_stats=True)
+        self.assertFalse(profiler.dump_stats(os.devnull))
+
+        def phase():
+            with profiler.phase('example.com', 'dns'):
+                sorted(range(1000))
+
+        pool.run_graph([(str(i), phase, []) for i in range(3)])
+
+        with tempfile.NamedTemporaryFile() as f:
+            self.assertTrue(profiler.dump_stats(f.name))
+            stats = pstats.Stats(f.name).stats
+        calls = [stat[0] for func, stat in stats.iteritems() if func[2] == '<sorted>']
+        self.assertEquals(calls, [3])
+
+class PResilienceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        resilience.reset()
+        self.shodan_key = lookup.shodan_key
+        lookup.shodan_key = 'test'
+        lookup.configure_http()
+        # Nothing listens on port 1, so every Shodan lookup fails to connect
+        lookup.shodan_client().base_url = 'http://127.0.0.1:1'
+
+    def tearDown(self):
+        resilience.reset()
+        lookup.shodan_key = self.shodan_key
+        lookup.configure_http()
+
+    def test_circuit_breaker_opens_and_closes(self):
+        breaker = resilience.CircuitBreaker('test', failure_threshold=2, reset_timeout=0.05)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.05)
+        self.assertTrue(breaker.allow())
+        # Only one lookup is let through while half-open
+        self.assertFalse(breaker.allow())
+        breaker.success()
+        self.assertEquals(breaker.state, resilience.CLOSED)
+
+        for attempt in range(10):
+            self.assertTrue(0 <= resilience.backoff(attempt) <= 2.0)
+
+    def test_failed_lookups_recorded_on_targets(self):
+        hosts = [Host(ips=['93.184.216.' + str(i)]) for i in range(1, 8)]
+        for host in hosts:
+            host.lookup_shodan_all()
+
+        self.assertEquals([len(host.errors) for host in hosts], [1] * 7)
+        self.assertEquals(hosts[0].errors[0].provider, 'shodan')
+        self.assertEquals(resilience.breaker('shodan').state, resilience.OPEN)
+        self.assertIn('skipped', str(hosts[-1].errors[0]))
+
+        network = Network('93.184.216.0/30')
+        network.lookup_shodan()
+        self.assertEquals(len(network.errors), 1)
+
+    def test_ipwhois_errors_recorded_on_targets(self):
+        import ipwhois
+
+        class OfflineIPWhois(object):
+            def __init__(self, ip):
+                pass
+
+            def lookup_whois(self):
+                raise ipwhois.exceptions.ASNRegistryError('ASN registry lookup failed')
+
+        saved = ipwhois.IPWhois
+        ipwhois.IPWhois = OfflineIPWhois
+        try:
+            host = Host(ips=['93.184.216.1', '93.184.216.2']).lookup_whois_ip_all()
+        finally:
+            ipwhois.IPWhois = saved
+
+        # Both IPs are tried, each failure is recorded on the host
+        self.assertEquals([error.provider for error in host.errors], ['ipwhois', 'ipwhois'])
+        self.assertIn('ASNRegistryError', str(host.errors[0]))
+        self.assertEquals(resilience.breaker('ipwhois').failures, 2)
+
+    def test_dns_failures_recorded_on_targets(self):
+        dead = StubDNSServer(loss=1)
+        lookup.configure_nameservers([('127.0.0.1', dead.port)])
+        saved = lookup.dns_maximum_retries, lookup.dns_resolver.timeout, lookup.dns_resolver.lifetime, resilience.connectivity
+        lookup.dns_maximum_retries = 1
+        lookup.dns_resolver.timeout = lookup.dns_resolver.lifetime = 0.1
+        # Nothing listens on port 1, so the internet can't be reached either
+        resilience.connectivity = resilience.Connectivity([('127.0.0.1', 1)])
+        try:
+            host = Host('example.com').lookup_dns_ns().lookup_dns_mx()
+            for attempt in range(2):
+                host.lookup_dns_a()
+            skipped = Host('example.org')
+        finally:
+            lookup.dns_maximum_retries, lookup.dns_resolver.timeout, lookup.dns_resolver.lifetime, resilience.connectivity = saved
+            lookup.nameservers = None
+            dead.close()
+
+        # Timeouts aren't taken for a domain without records, so A is looked up again
+        self.assertEquals([error.provider for error in host.errors], ['dns'] * 5)
+        self.assertEquals(str(host.errors[0]), 'dns lookup failed for example.com - A - No internet access')
+        self.assertEquals(resilience.breaker('dns').state, resilience.OPEN)
+        self.assertIn('skipped', str(skipped.errors[0]))
+
+class QResolverPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.fast = StubDNSServer()
+        self.slow = StubDNSServer(latency=0.3)
+        self.dead = StubDNSServer(loss=1)
+        self.timeout = lookup.dns_resolver.timeout
+        lookup.dns_resolver.timeout = 0.5
+
+    def tearDown(self):
+        for stub in (self.fast, self.slow, self.dead):
+            stub.close()
+        lookup.dns_resolver.timeout = self.timeout
+        lookup.nameservers = None
+        lookup.dns_hedge_after = None
+
+    def test_parse_nameservers(self):
+        path = os.path.join(tempfile.mkdtemp(), 'resolvers.txt')
+        with open(path, 'w') as f:
+            f.write('# Local recursors\n10.0.0.1\n10.0.0.2:5353  # second\n\n[::1]:53\n')
+
+        self.assertEquals(resolver_pool.parse_nameservers(['8.8.8.8,10.0.0.1', path]),
+                          [('8.8.8.8', 53), ('10.0.0.1', 53), ('10.0.0.2', 5353), ('::1', 53)])
+        self.assertRaises(ValueError, resolver_pool.parse_nameservers, ['8.8.8.8,example.com'])
+        self.assertRaises(ValueError, resolver_pool.parse_nameservers, ['127.0.0.1:99999'])
+        self.assertRaises(ValueError, resolver_pool.parse_nameservers, ['[::1]:0'])
+        shutil.rmtree(os.path.dirname(path))
+
+    def test_dead_nameserver_ejected(self):
+        lookup.configure_nameservers([('127.0.0.1', self.fast.port), ('127.0.0.1', self.dead.port)])
+        names = ['host{}.example.com'.format(i) for i in range(100)]
+        results = list(lookup.bulk_resolve(names, 'A', in_flight=10))
+        self.assertTrue(all(records for _, records in results))
+
+        pool = lookup.resolver_pool()
+        self.assertEquals(pool.ejected(), [('127.0.0.1', self.dead.port)])
+        self.assertEquals(pool.choose(), ('127.0.0.1', self.fast.port))
+        self.assertTrue(lookup.direct_dns('single.example.com'))
+
+    def test_ipv6_nameserver_in_pool(self):
+        stub = StubDNSServer(address='::1')
+        try:
+            lookup.configure_nameservers(resolver_pool.parse_nameservers(['[::1]:' + str(stub.port)]))
+            results = list(lookup.bulk_resolve(['host{}.example.com'.format(i) for i in range(20)], 'A'))
+            self.assertTrue(all(records for _, records in results))
+        finally:
+            stub.close()
+
+    def test_slow_queries_hedged(self):
+        lookup.configure_nameservers([('127.0.0.1', self.slow.port), ('127.0.0.1', self.fast.port)], hedge_after=0.05)
+        # Every query goes to the slow server first
+        lookup.resolver_pool().success(('127.0.0.1', self.slow.port), 0.0001)
+        lookup.resolver_pool().success(('127.0.0.1', self.fast.port), 1)
+
+        start = time.time()
+        results = list(lookup.bulk_resolve(['host{}.example.com'.format(i) for i in range(20)], 'A', in_flight=20))
+        self.assertTrue(all(records for _, records in results))
+        self.assertLess(time.time() - start, 0.25)
+
+class RCheckpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubDNSServer()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal')
+
+    def tearDown(self):
+        self.stub.close()
+        shutil.rmtree(self.directory)
+
+    def test_journal_survives_truncated_record(self):
+        journal = checkpoint.Journal(self.path)
+        journal.add_targets(['198.51.100.0/23', '93.184.216.34'])
+        journal.add_target(Host(ips=['93.184.216.34'], reverse_domains=['a.example.com']))
+        journal.add_block(Network('198.51.100.0/23'), '198.51.100.0/24', [('198.51.100.1', ['b.example.com'])])
+        journal.close()
+        with open(self.path, 'ab') as f:
+            f.write('\x80\x02(U\x05block')
+
+        journal = checkpoint.Journal(self.path, resume=True)
+        self.assertEquals(journal.targets, ['198.51.100.0/23', '93.184.216.34'])
+        self.assertEquals(journal.finished('93.184.216.34').ips[0].rev_domains, ['a.example.com'])
+        self.assertEquals(journal.swept_blocks('198.51.100.0/23'), {'198.51.100.0/24': [('198.51.100.1', ['b.example.com'])]})
+        journal.add_target(Network('198.51.100.0/23'))
+        journal.close()
+
+        journal = checkpoint.Journal(self.path, resume=True)
+        self.assertTrue(journal.finished('198.51.100.0/23'))
+        self.assertEquals(journal.swept_blocks('198.51.100.0/23'), {})
+
+    def test_targets_recorded_as_they_are_read(self):
+        subprocess.check_output(
+            [sys.executable, 'scripts/instarecon.py', '-n', '127.0.0.1:' + str(self.stub.port), '--checkpoint', self.path,
+             '198.51.100.0/30', '93.184.216.34', '198.51.100.1'],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=dict(os.environ, PYTHONPATH='.'))
+        self.assertEquals(checkpoint.Journal(self.path, resume=True).targets, ['93.184.216.34', '198.51.100.0/30'])
+
+        # Interrupted before every target was read: only those read so far can be resumed
+        journal = checkpoint.Journal(self.path)
+        journal.add_passed_target('93.184.216.34')
+        journal.close()
+        journal = checkpoint.Journal(self.path, resume=True)
+        self.assertEquals(journal.targets, ['93.184.216.34'])
+        # A resumed run doesn't record them again
+        journal.add_targets(['93.184.216.34', '198.51.100.0/30'])
+        journal.close()
+        self.assertEquals(checkpoint.Journal(self.path, resume=True).targets, ['93.184.216.34'])
+
+    def test_resumed_sweep_skips_swept_blocks(self):
+        journal = checkpoint.Journal(self.path)
+        journal.add_targets(['198.51.100.0/23'])
+        journal.add_block('198.51.100.0/23', '198.51.100.0/24', [('198.51.100.7', ['resumed.example.com'])])
+        journal.close()
+
+        out = subprocess.check_output(
+            [sys.executable, 'scripts/instarecon.py', '-n', '127.0.0.1:' + str(self.stub.port), '--resume', self.path,
+             '-o', os.path.join(self.directory, 'out.csv')],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=dict(os.environ, PYTHONPATH='.'))
+
+        self.assertEquals(self.stub.queries, 256)
+        self.assertIn('host-198-51-101-5.example.com', out)
+        self.assertNotIn('host-198-51-100-5.example.com', out)
+        with open(os.path.join(self.directory, 'out.csv')) as f:
+            csv_output = f.read()
+        self.assertIn('resumed.example.com', csv_output)
+        self.assertIn('host-198-51-101-5.example.com', csv_output)
+        self.assertTrue(checkpoint.Journal(self.path, resume=True).finished('198.51.100.0/23'))
+
+    def test_resumed_network_writes_sweep_hits(self):
+        network = Network('198.51.100.0/24')
+        network.add_related_ip('198.51.100.7', ['resumed.example.com'])
+        journal = checkpoint.Journal(self.path)
+        journal.add_targets(['198.51.100.0/24'])
+        journal.add_target(network)
+        journal.close()
+
+        jsonl = os.path.join(self.directory, 'out.jsonl')
+        subprocess.check_output(
+            [sys.executable, 'scripts/instarecon.py', '-n', '127.0.0.1:' + str(self.stub.port), '--resume', self.path,
+             '--jsonl', jsonl],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=dict(os.environ, PYTHONPATH='.'))
+
+        with open(jsonl) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEquals(self.stub.queries, 0)
+        self.assertEquals([record['type'] for record in records], ['sweep_hit', 'network'])
+        self.assertEquals(records[0]['reverse_domains'], ['resumed.example.com'])
+
+class SHostRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubDNSServer()
+        lookup.configure_nameservers([('127.0.0.1', self.stub.port)])
+        host_registry.clear()
+        metrics.registry.clear()
+
+    def tearDown(self):
+        self.stub.close()
+        lookup.nameservers = None
+        host_registry.clear()
+        metrics.registry.clear()
+
+    def test_shared_ns_and_mx_resolved_once(self):
+        domains = ['site{}.example.com'.format(i) for i in range(10)]
+        hosts = [host for _, host in pool.imap_unordered(
+            lambda domain: Host(domain, ips=['192.0.2.1']).lookup_dns_ns().lookup_dns_mx(), domains, workers=5)]
+
+        ns1 = [ns for ns in hosts[0].ns if ns.domain == 'ns1.example.com'][0]
+        for host in hosts:
+            self.assertEquals(host.ns, hosts[0].ns)
+            self.assertIs([ns for ns in host.ns if ns.domain == 'ns1.example.com'][0], ns1)
+
+        # A lookups of ns1, ns2, mx1 and mx2 only once, instead of once per domain
+        dns_metrics = metrics.registry.as_dict()['lookups']['dns']
+        self.assertEquals(dns_metrics['NS']['queries'], 10)
+        self.assertEquals(dns_metrics['A']['queries'], 4)
+        self.assertEquals(len(host_registry), 4)
+
+        self.assertEquals([ip.ip for ip in ns1.ips], lookup.direct_dns('ns1.example.com'))
+        self.assertEquals(ns1.ips[0].rev_domains, ['host-' + ns1.ips[0].ip.replace('.', '-') + '.example.com'])
+
+    def test_sweep_reuses_known_reverse_domains(self):
+        ns1 = host_registry.resolve(['NS1.example.com.'])[0]
+        self.assertIs(host_registry.resolve(['ns1.example.com'])[0], ns1)
+        queries = self.stub.queries
+
+        blocks = list(lookup.rev_dns_on_blocks(ipa.ip_network(u'192.0.2.0/24'), 50, known=host_registry.reverse_domains()))
+        self.assertEquals(self.stub.queries - queries, 255)
+        found = dict(blocks[0][1])
+        self.assertEquals(len(found), 256)
+        self.assertEquals(found[ipa.ip_address(unicode(ns1.ips[0].ip))], ns1.ips[0].rev_domains)
+
+    def test_google_urls_kept_per_target(self):
+        # Registered first as an MX record, spelt differently from Google's results
+        mx1 = host_registry.resolve(['MX1.Example.com'])[0]
+
+        def google_subdomains(name):
+            result = lookup.GoogleDomainResult()
+            result.add_url('http://', '/' + name)
+            return {'mx1.example.com': result}
+
+        saved = lookup.google_subdomains
+        lookup.google_subdomains = google_subdomains
+        try:
+            com = Host('example.com', ips=['192.0.2.1'])
+            com.lookup_google_subdomains()
+            org = Host('example.org', ips=['192.0.2.2'])
+            org.lookup_google_subdomains()
+        finally:
+            lookup.google_subdomains = saved
+
+        self.assertEquals(com.google_subdomains, set([mx1]))
+        self.assertEquals(com.subdomain_urls, {'mx1.example.com': {'http://': set(['/example.com'])}})
+        self.assertEquals(org.subdomain_urls, {'mx1.example.com': {'http://': set(['/example.org'])}})
+        self.assertFalse(mx1.urls)
+        self.assertIn('/example.com', com.print_google_subdomains())
+        self.assertNotIn('/example.org', com.print_google_subdomains())
+
+class TIngestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.chunk_size = ingest.sort_chunk_size
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        ingest.sort_chunk_size = self.chunk_size
+        shutil.rmtree(self.directory)
+
+    def test_targets_deduplicated_and_collapsed(self):
+        # Small enough that the sort spills to temporary files
+        ingest.sort_chunk_size = 2
+        texts = ['10.0.1.5', '10.0.0.0/16', 'b.example.com', '10.0.1.0/24', 'A.example.com', 'a.example.com.',
+                 '192.0.2.1', '10.1.0.7/24', '10.0.0.0/16', '2001:db8::/32', '2001:db8::1']
+
+        self.assertEquals(list(ingest.targets(iter(texts))), [
+            (ingest.NETWORK, '10.0.0.0/16'),
+            (ingest.NETWORK, '10.1.0.0/24'),
+            (ingest.IP, '192.0.2.1'),
+            (ingest.NETWORK, '2001:db8::/32'),
+            (ingest.DOMAIN, 'a.example.com'),
+            (ingest.DOMAIN, 'b.example.com'),
+        ])
+
+    def test_read_lines_from_files_and_stdin(self):
+        path = os.path.join(self.directory, 'targets.txt')
+        with open(path, 'w') as f:
+            f.write('# Scope\nexample.com\n\n198.51.100.0/24  # office\n')
+        self.assertEquals(list(ingest.read_lines([path])), ['example.com', '198.51.100.0/24'])
+
+        stub = StubDNSServer()
+        try:
+            process = subprocess.Popen(
+                [sys.executable, 'scripts/instarecon.py', '-n', '127.0.0.1:' + str(stub.port), '-i', '-', '198.51.100.0/24'],
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=dict(os.environ, PYTHONPATH='.'),
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            out = process.communicate('198.51.100.0/25\n198.51.100.5\n')[0]
+        finally:
+            stub.close()
+
+        self.assertIn('# Scanned 1/1 hosts', out)
+        self.assertEquals(stub.queries, 256)
+
+class UPopulateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubDNSServer(latency=0.2)
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+    def tearDown(self):
+        self.stub.close()
+        sys.path.pop(0)
+        lookup.nameservers = None
+
+    def test_targets_ready_before_every_domain_resolves(self):
+        from instarecon import InstaRecon
+        scan = InstaRecon(nameserver='127.0.0.1:' + str(self.stub.port))
+        domains = ['site{}.example.com'.format(i) for i in range(50)]
+
+        start = time.time()
+        scan.populate(domains + ['192.0.2.1', '198.51.100.0/24', '198.51.100.7'])
+        first = next(scan.pending)
+        self.assertLess(time.time() - start, 0.2)
+        targets = [first] + list(scan.pending)
+        # One at a time, 50 lookups would take 10s
+        self.assertLess(time.time() - start, 2)
+
+        self.assertEquals([str(target) for target in targets], ['192.0.2.1', '198.51.100.0/24'] + sorted(domains))
+        self.assertEquals(len(scan.targets), 52)
+        self.assertEquals([ip.ip for ip in targets[2].ips], lookup.direct_dns(domains[0]))
+
+    def test_domains_resolved_to_nothing_not_looked_up_again(self):
+        lookup.configure_nameservers([('127.0.0.1', self.stub.port)])
+        host = Host(domain='nx.example.com', ips=[])
+        queries = self.stub.queries
+        host.lookup_dns_a()
+        self.assertEquals(self.stub.queries, queries)
+        self.assertEquals(host.ips, [])
+
+        host = Host(domain='nx.example.com', strict=False)
+        queries = self.stub.queries
+        host.lookup_dns_a()
+        self.assertEquals(self.stub.queries, queries)
+
 if __name__ == '__main__':
     unittest.main()